@@ -1,8 +1,21 @@
 import streamlit as st # type: ignore
-from huggingface_hub import InferenceClient # type: ignore
 from pymongo import MongoClient # type: ignore
 import hashlib
-from datetime import datetime
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from llm_backends import DEFAULT_MODEL, make_backend
+from metrics import REGISTRY, InstrumentedCollection, configure_json_logging, serve_metrics
+from plan_cache import make_plan_cache
+from plan_generation import diet_day_part, diet_day_title, diet_days, join_diet_days, make_gateway, make_plan_generator
+from plan_jobs import FAILED, JobManager, PlanJob
+from plan_schema import parse_plan, render_plan
+from plan_search import PlanSearch
+from plan_store import DATE_FORMAT, make_plan_store, migrate_user_history
+from plan_writer import PlanWriter
+from progress import MEALS_PER_DAY, ProgressStore, adherence, bmi_trend, summary, to_frame, weight_trend
+from prompts import DIET_PLAN_DAYS, DIETS, GENDERS, GOALS, LOCATIONS, PROFILE_RANGES
 
 # --- Configuration ---
 st.set_page_config(
@@ -13,134 +26,48 @@ st.set_page_config(
 
 
 # --- Custom CSS for Modern UI ---
-st.markdown("""
-<style>
-    .main {
-        background-color: black;
-    }
-    
-    .header-container {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 3rem 2rem;
-        border-radius: 0 0 25px 25px;
-        margin-bottom: 2rem;
-        margin-top: -5rem;
-        color: white;
-        text-align: center;
-    }
-    
-    .custom-card {
-        background: white;
-        padding: 2rem;
-        border-radius: 20px;
-        border: 1px solid #e0e0e0;
-        box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-        margin-bottom: 1.5rem;
-        transition: all 0.3s ease;
-    }
-    
-    .custom-card:hover {
-        transform: translateY(-5px);
-        box-shadow: 0 8px 30px rgba(0,0,0,0.12);
-    }
-    
-    .feature-card {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        padding: 1.5rem;
-        border-radius: 15px;
-        text-align: center;
-        margin: 0.5rem;
-    }
-    
-    .metric-card {
-        background: white;
-        padding: 1.5rem;
-        border-radius: 15px;
-        border-left: 5px solid #667eea;
-        box-shadow: 0 2px 10px rgba(0,0,0,0.05);
-        margin: 0.5rem 0;
-    }
-    
-    .stButton button {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        border: none;
-        border-radius: 25px;
-        padding: 0.75rem 2rem;
-        font-weight: 600;
-        font-size: 1rem;
-        transition: all 0.3s ease;
-        width: 100%;
-    }
-    
-    .stButton button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 8px 25px rgba(102, 126, 234, 0.4);
-    }
-    
-    .stTextInput input, .stTextArea textarea, .stNumberInput input {
-        border-radius: 15px;
-        border: 2px solid #e0e0e0;
-        padding: 0.75rem;
-        font-size: 1rem;
-    }
-    
-    .stTextInput input:focus, .stTextArea textarea:focus, .stNumberInput input:focus {
-        border-color: #667eea;
-        box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);
-    }
-    
-    .success-message {
-        background: linear-gradient(135deg, #4CAF50 0%, #45a049 100%);
-        color: white;
-        padding: 1.5rem;
-        border-radius: 15px;
-        text-align: center;
-        margin: 1rem 0;
-    }
-    
-    .info-message {
-        background: linear-gradient(135deg, #2196F3 0%, #1976D2 100%);
-        color: white;
-        padding: 1.5rem;
-        border-radius: 15px;
-        text-align: center;
-        margin: 1rem 0;
-    }
-    
-    .plan-section {
-        border: 2px solid #e0e0e0;
-        border-radius: 15px;
-        padding: 1.5rem;
-        background: white;
-        margin: 1rem 0;
-    }
-    
-    
-    
-    .sidebar .sidebar-content {
-        background: linear-gradient(180deg, #667eea 0%, #764ba2 100%);
-    }
-</style>
-""", unsafe_allow_html=True)
+# Static markup is read/built once per process; reruns only re-send the cached strings
+@st.cache_data
+def load_css():
+    """Reads the app stylesheet."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "style.css")) as f:
+        return f"<style>\n{f.read()}</style>"
+
+st.markdown(load_css(), unsafe_allow_html=True)
 
 # --- User Authentication and Data Management ---
 # --- MongoDB Connection ---
 @st.cache_resource
-def get_mongo_client():
-    """Establishes a connection to MongoDB and returns the collection object."""
+def get_database():
+    """Establishes a connection to MongoDB and returns the database object."""
     try:
         MONGO_URI = st.secrets["MONGO_URI"]
         DB_NAME = st.secrets["DB_NAME"]
+        if MONGO_URI.startswith("mongomock://"):
+            # In-memory stand-in for offline development and benchmarks
+            import mongomock # type: ignore
+            client = mongomock.MongoClient()
+        else:
+            client = MongoClient(MONGO_URI)
+        return client[DB_NAME]
+    except Exception as e:
+        st.error(f"Failed to connect to MongoDB: {e}")
+        st.stop()
+
+@st.cache_resource
+def get_mongo_client():
+    """Establishes a connection to MongoDB and returns the collection object."""
+    try:
         COLLECTION_NAME = st.secrets["COLLECTION_NAME"]
-        client = MongoClient(MONGO_URI)
-        return client[DB_NAME][COLLECTION_NAME]
+        return InstrumentedCollection(get_database()[COLLECTION_NAME])
     except Exception as e:
         st.error(f"Failed to connect to MongoDB: {e}")
         st.stop()
 
-users_collection = get_mongo_client()
+@st.cache_resource
+def get_plan_store():
+    """Returns the store for the indexed `plans` collection, compressing plan bodies if configured."""
+    return make_plan_store(st.secrets, get_database(), wrap=InstrumentedCollection)
 
 def load_users():
     """Loads a specific user from MongoDB."""
@@ -156,219 +83,322 @@ def verify_password(stored_password, provided_password):
     """Verifies a provided password against a stored hash."""
     return stored_password == hash_password(provided_password)
 
-def add_plan_to_history(username, workout_plan, diet_plan):
-    """Adds a generated plan to the user's history."""
-    plan_entry = {
-        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "workout_plan": workout_plan,
-        "diet_plan": diet_plan
-    }
-    users_collection.update_one(
-        {"_id": username},
-        {"$push": {"history": {"$each": [plan_entry], "$position": 0}}}
+@st.cache_resource
+def get_plan_search():
+    """Returns the ranked, per-user search over the `plans` collection."""
+    # mongomock has no `$text` support, so it searches an in-memory inverted index
+    in_memory = st.secrets["MONGO_URI"].startswith("mongomock://")
+    return PlanSearch(get_plan_store().collection, use_text_index=False if in_memory else None)
+
+@st.cache_resource
+def get_progress_store():
+    """Returns the store for month-bucketed progress logs."""
+    return ProgressStore(InstrumentedCollection(get_database()[st.secrets.get("PROGRESS_COLLECTION_NAME", "progress")]))
+
+@st.cache_resource
+def get_plan_writer():
+    """Returns the process-wide write-behind queue for finished plans."""
+    writer = PlanWriter(
+        get_plan_store(),
+        spill_path=st.secrets.get("PLAN_SPILL_PATH", "plan_spill.jsonl"),
+        batch_size=int(st.secrets.get("WRITE_BATCH_SIZE", 50)),
+        max_retries=int(st.secrets.get("WRITE_MAX_RETRIES", 4)),
     )
+    REGISTRY.register_collector("plan_writer", writer.stats)
+    return writer
+
+def add_plan_to_history(username, workout_plan, diet_plan, goal=None, workout_data=None, diet_data=None):
+    """Queues a generated plan, with its structured form if parsed, for the user's history and returns its id."""
+    return get_plan_writer().submit(username, workout_plan, diet_plan, goal=goal,
+                                    workout_data=workout_data, diet_data=diet_data)
 
-# Hugging Face token (securely stored in Streamlit secrets)
-# Make sure to add HF_TOKEN to your Streamlit secrets
+# Model backend: "huggingface" (needs HF_TOKEN) or "local" for the offline stand-in
+# Make sure to add HF_TOKEN to your Streamlit secrets when using Hugging Face
 try:
-    HF_TOKEN = st.secrets["HF_TOKEN"]
+    LLM_BACKEND = st.secrets.get("LLM_BACKEND", "huggingface")
 except FileNotFoundError:
     st.error("Streamlit secrets file not found. Please create a .streamlit/secrets.toml file with your HF_TOKEN.")
     st.stop()
 
-client = InferenceClient("meta-llama/Meta-Llama-3-8B-Instruct", token=HF_TOKEN)
+@st.cache_resource
+def get_llm_backend():
+    """Returns the model backend selected by LLM_BACKEND."""
+    try:
+        backend = make_backend(st.secrets)
+        REGISTRY.register_collector("llm", backend.usage)
+        return backend
+    except KeyError as e:
+        st.error(f"Missing setting {e} for the {LLM_BACKEND} model backend. Please add it to .streamlit/secrets.toml.")
+        st.stop()
+    except ValueError as e:
+        # e.g. an unknown LLM_BACKEND
+        st.error(f"Invalid model backend settings: {e}. Please fix them in .streamlit/secrets.toml.")
+        st.stop()
+
+# Upper bound on plan generations running at once across all sessions
+PLAN_WORKERS = int(st.secrets.get("PLAN_WORKERS", 8))
+
+# Upper bound on plan jobs (each streaming its parts on the plan executor) per process
+JOB_WORKERS = int(st.secrets.get("JOB_WORKERS", 4))
+
+# Seconds between polls of a running job while its plans stream in
+JOB_POLL_INTERVAL = 0.5
+
+@st.cache_resource
+def get_plan_cache():
+    """Returns the shared plan cache backed by its own TTL-indexed MongoDB collection."""
+    cache = make_plan_cache(st.secrets, get_database(), wrap=InstrumentedCollection)
+    REGISTRY.register_collector("plan_cache", cache.stats)
+    return cache
+
+@st.cache_resource
+def get_plan_executor():
+    """Returns the shared, bounded thread pool used to run plan generations concurrently."""
+    return ThreadPoolExecutor(max_workers=PLAN_WORKERS, thread_name_prefix="plan")
 
 # --- Helper Function to Generate Plans ---
-def generate_plan(prompt):
-    """
-    Generates a response from the LLaMA model based on a detailed prompt.
-    """
-    messages = [
-        {
-            "role": "system",
-            "content": "You are an expert fitness and nutrition coach for students. Your goal is to create practical, budget-friendly, and effective workout and diet plans. Be encouraging and clear in your instructions. Format your response using Markdown.",
-        },
-        {"role": "user", "content": prompt},
-    ]
+@st.cache_resource
+def get_inference_gateway():
+    """Returns the process-wide gateway that limits and coalesces model calls."""
+    gateway = make_gateway(st.secrets, get_llm_backend().stream_chat, DEFAULT_MODEL)
+    REGISTRY.register_collector("inference", gateway.stats)
+    return gateway
 
-    response_text = ""
-    try:
-        # Use chat_completion for conversational models like Llama-3
-        for chunk in client.chat_completion(messages, max_tokens=1024, temperature=0.8, stream=True):
-            # Add a check to ensure the choices list is not empty before accessing it
-            if chunk.choices and chunk.choices[0].delta.content:
-                response_text += chunk.choices[0].delta.content
-    except Exception as e:
-        st.error(f"An error occurred while communicating with the AI model: {e}")
-        return "Sorry, I couldn't generate a plan at this moment. Please try again later."
-        
-    return response_text.strip()
+@st.cache_resource
+def get_plan_generator():
+    """Returns the generator that builds prompts and streams plans through the gateway and plan cache."""
+    return make_plan_generator(st.secrets, get_inference_gateway(), cache=get_plan_cache())
+
+def _save_job_plan(job, texts):
+    """Worker-side completion hook: parses a finished job's plans once and queues them for the user's history."""
+    # A weekly meal plan's days become the job's single "diet" result, parsed day by day
+    job.results = join_diet_days(job.results)
+    for name, result in job.results.items():
+        if result.data is None:
+            with REGISTRY.timer("plan_stage_seconds", stage="parse"):
+                result.data = parse_plan(name, result.text)
+        REGISTRY.inc("plan_parse_total", help="Plans parsed into structured data",
+                     part=name, outcome="ok" if result.data else "fallback")
+    return add_plan_to_history(job.username, job.results["workout"].text, job.results["diet"].text, goal=job.goal,
+                               workout_data=job.results["workout"].data, diet_data=job.results["diet"].data)
 
+@st.cache_resource
+def get_job_manager():
+    """Returns the process-wide manager running plan jobs in the background."""
+    generator = get_plan_generator()
+    return JobManager(
+        InstrumentedCollection(get_database()[st.secrets.get("JOBS_COLLECTION_NAME", "plan_jobs")]),
+        stream_part=generator.stream,
+        part_executor=get_plan_executor(),
+        on_complete=_save_job_plan,
+        max_workers=JOB_WORKERS,
+        stream_combined=generator.stream_combined,
+    )
+
+# --- Observability ---
+# Usernames allowed to see the Metrics tab
+ADMIN_USERS = set(st.secrets.get("ADMIN_USERS", []))
+
+@st.cache_resource
+def setup_observability():
+    """Starts the optional metrics endpoint and JSON logging once per process."""
+    if st.secrets.get("METRICS_PORT"):
+        serve_metrics(int(st.secrets["METRICS_PORT"]))
+    if st.secrets.get("JSON_LOGS", False):
+        configure_json_logging()
+    return REGISTRY
+
+setup_observability()
+# The plan writer starts with the process, so plans spilled by an earlier run are
+# replayed straight away rather than when a user first opens History or saves a plan
+get_plan_writer()
+
+HEADER_HTML = """
+<div class="header-container">
+    <h1 style="margin:0; font-size: 3rem; font-weight: 700;">💪 AI Fitness Coach</h1>
+    <p style="margin:0; font-size: 1.3rem; opacity: 0.9; margin-top: 0.5rem;">
+    Get personalized workout & diet plans tailored just for you
+    </p>
+</div>
+"""
+
+FEATURES = [
+    ("🏋️ Personalized Workouts", "Custom exercises for your goals"),
+    ("🥗 Smart Meal Plans", "Delicious & budget-friendly recipes"),
+    ("📊 Progress Tracking", "Monitor your fitness journey"),
+    ("🎯 Goal-Oriented", "Plans tailored to your objectives"),
+]
+
+@st.cache_data
+def features_html():
+    """Builds the feature cards as a single block of markup."""
+    cards = "".join(
+        f'<div class="feature-card"><h3>{title}</h3><p>{text}</p></div>'
+        for title, text in FEATURES
+    )
+    return f'<div class="features-grid">{cards}</div>'
+
+@REGISTRY.timed("render_seconds", help="Script time per render phase", phase="header")
 def display_modern_header():
     """Display modern header with gradient"""
-    st.markdown("""
-    <div class="header-container">
-        <h1 style="margin:0; font-size: 3rem; font-weight: 700;">💪 AI Fitness Coach</h1>
-        <p style="margin:0; font-size: 1.3rem; opacity: 0.9; margin-top: 0.5rem;">
-        Get personalized workout & diet plans tailored just for you
-        </p>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(HEADER_HTML, unsafe_allow_html=True)
 
 def display_features():
     """Display feature cards"""
     st.markdown("### 🎯 What You'll Get")
-    
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        st.markdown("""
-        <div class="feature-card">
-            <h3>🏋️ Personalized Workouts</h3>
-            <p>Custom exercises for your goals</p>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown("""
-        <div class="feature-card">
-            <h3>🥗 Smart Meal Plans</h3>
-            <p>Delicious & budget-friendly recipes</p>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col3:
-        st.markdown("""
-        <div class="feature-card">
-            <h3>📊 Progress Tracking</h3>
-            <p>Monitor your fitness journey</p>
-        </div>
-        """, unsafe_allow_html=True)
-    
-    with col4:
-        st.markdown("""
-        <div class="feature-card">
-            <h3>🎯 Goal-Oriented</h3>
-            <p>Plans tailored to your objectives</p>
-        </div>
-        """, unsafe_allow_html=True)
+    st.markdown(features_html(), unsafe_allow_html=True)
 
+@st.fragment
+@REGISTRY.timed("render_seconds", phase="auth")
 def display_modern_auth():
-    """Display modern authentication in sidebar"""
-    with st.sidebar:
-        st.markdown("""
-        <div style="text-align: center; margin-bottom: 2rem; padding: 1rem; background: rgba(255,255,255,0.1); border-radius: 15px;">
-            <h2 style="color: white; margin: 0;">Fitness Coach</h2>
-            <p style="color: rgba(255,255,255,0.8); margin: 0;">AI-Powered Plans</p>
-        </div>
-        """, unsafe_allow_html=True)
+    """Display modern authentication (rendered into the sidebar)"""
+    st.markdown("""
+    <div style="text-align: center; margin-bottom: 2rem; padding: 1rem; background: rgba(255,255,255,0.1); border-radius: 15px;">
+        <h2 style="color: white; margin: 0;">Fitness Coach</h2>
+        <p style="color: rgba(255,255,255,0.8); margin: 0;">AI-Powered Plans</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    if not st.session_state.logged_in:
+        tab1, tab2 = st.tabs(["🔐 Login", "📝 Register"])
         
-        if not st.session_state.logged_in:
-            tab1, tab2 = st.tabs(["🔐 Login", "📝 Register"])
+        with tab1:
+            username = st.text_input("Username", key="login_user")
+            password = st.text_input("Password", type="password", key="login_pass")
             
-            with tab1:
-                username = st.text_input("Username", key="login_user")
-                password = st.text_input("Password", type="password", key="login_pass")
-                
-                if st.button("Login", use_container_width=True):
-                    if username and password:
-                        user_data = users_collection.find_one({"_id": username})
-                        if user_data and verify_password(user_data["password"], password):
-                            st.session_state.logged_in = True
-                            st.session_state.username = username
-                            st.rerun()
-                        else:
-                            st.error("Invalid username or password")
+            if st.button("Login", use_container_width=True):
+                if username and password:
+                    user_data = get_mongo_client().find_one({"_id": username}, {"password": 1})
+                    if user_data and verify_password(user_data["password"], password):
+                        migrate_user_history(get_mongo_client(), get_plan_store(), username)
+                        st.session_state.logged_in = True
+                        st.session_state.username = username
+                        st.rerun()
                     else:
-                        st.warning("Please enter username and password")
+                        st.error("Invalid username or password")
+                else:
+                    st.warning("Please enter username and password")
+        
+        with tab2:
+            username = st.text_input("Username", key="reg_user")
+            password = st.text_input("Password", type="password", key="reg_pass")
+            confirm_password = st.text_input("Confirm Password", type="password", key="reg_confirm")
             
-            with tab2:
-                username = st.text_input("Username", key="reg_user")
-                password = st.text_input("Password", type="password", key="reg_pass")
-                confirm_password = st.text_input("Confirm Password", type="password", key="reg_confirm")
-                
-                if st.button("Register", use_container_width=True):
-                    if username and password:
-                        if password == confirm_password:
-                            if users_collection.find_one({"_id": username}):
-                                st.error("Username already exists")
-                            else:
-                                users_collection.insert_one({
-                                    "_id": username,
-                                    "password": hash_password(password),
-                                    "history": []
-                                })
-                                st.success("Registration successful! Please login.")
+            if st.button("Register", use_container_width=True):
+                if username and password:
+                    if password == confirm_password:
+                        if get_mongo_client().find_one({"_id": username}, {"_id": 1}):
+                            st.error("Username already exists")
                         else:
-                            st.error("Passwords do not match")
+                            get_mongo_client().insert_one({
+                                "_id": username,
+                                "password": hash_password(password)
+                            })
+                            st.success("Registration successful! Please login.")
                     else:
-                        st.warning("Please fill all fields")
-        else:
-            st.markdown(f"""
-            <div style="background: rgba(255,255,255,0.1); padding: 1.5rem; border-radius: 15px; margin-bottom: 1rem;">
-                <h4 style="color: white; margin: 0;">Welcome back!</h4>
-                <p style="color: rgba(255,255,255,0.8); margin: 0.5rem 0;">{st.session_state.username}</p>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            if st.button("Logout", use_container_width=True):
-                st.session_state.logged_in = False
-                st.session_state.username = ""
-                st.rerun()
-
+                        st.error("Passwords do not match")
+                else:
+                    st.warning("Please fill all fields")
+    else:
+        st.markdown(f"""
+        <div style="background: rgba(255,255,255,0.1); padding: 1.5rem; border-radius: 15px; margin-bottom: 1rem;">
+            <h4 style="color: white; margin: 0;">Welcome back!</h4>
+            <p style="color: rgba(255,255,255,0.8); margin: 0.5rem 0;">{st.session_state.username}</p>
+        </div>
+        """, unsafe_allow_html=True)
+        
+        if st.button("Logout", use_container_width=True):
+            st.session_state.logged_in = False
+            st.session_state.username = ""
+            st.session_state.history_cursors = [None]
+            st.session_state.history_search_query = None
+            st.session_state.plan_body_cache = {}
+            st.session_state.active_job = None
+            st.rerun()
+
+@st.fragment
+@REGISTRY.timed("render_seconds", phase="profile_form")
 def display_profile_form():
-    """Display modern profile form in sidebar"""
-    st.sidebar.markdown("### 📝 Your Profile")
-    
-    with st.sidebar:
-        with st.form(key='profile_form'):
-            st.markdown("#### Personal Info")
-            age = st.number_input("Age", min_value=16, max_value=80, value=20)
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                weight = st.number_input("Weight (kg)", min_value=40.0, max_value=150.0, value=60.0, step=0.5)
-            with col2:
-                height = st.number_input("Height (cm)", min_value=140.0, max_value=220.0, value=170.0, step=0.5)
-            
-            gender = st.selectbox("Gender", ["Male", "Female", "Prefer not to say"])
-
-            st.markdown("#### 🎯 Fitness Goals")
-            fitness_goal = st.selectbox("Primary Goal", ["Lose Weight", "Gain Muscle", "Improve Fitness & Stamina"])
-            workout_days = st.slider("Workout Days per Week", 1, 7, 3)
-
-            st.markdown("#### 💪 Workout Preferences")
-            workout_location = st.selectbox("Where do you work out?", ["Home", "Gym"])
-            available_equipment = st.text_input("Equipment available", "None", placeholder="dumbbells, yoga mat...")
-
-            st.markdown("#### 🍽️ Dietary Preferences")
-            diet_pref = st.selectbox("Diet", ["Anything", "Vegetarian", "Vegan"])
-            cuisine_pref = st.text_input("Preferred Cuisine", "Indian", placeholder="Italian, Asian...")
-            allergies = st.text_input("Any Allergies?", "None")
-
-            st.markdown("#### 🤔 Additional Details")
-            special_info = st.text_area(
-                "Injuries, food dislikes, time constraints...",
-                placeholder="Tell us anything else we should know..."
-            )
-            
-            submit_button = st.form_submit_button(
-                label="🚀 Generate My Plan", 
-                use_container_width=True
-            )
+    """Display modern profile form (rendered into the sidebar) and submit it as a plan job"""
+    st.markdown("### 📝 Your Profile")
     
-    return (age, weight, height, gender, fitness_goal, workout_days, 
-            workout_location, available_equipment, diet_pref, cuisine_pref, 
-            allergies, special_info, submit_button)
+    with st.form(key='profile_form'):
+        st.markdown("#### Personal Info")
+        age = st.number_input("Age", *PROFILE_RANGES["age"], value=20)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            weight = st.number_input("Weight (kg)", *PROFILE_RANGES["weight"], value=60.0, step=0.5)
+        with col2:
+            height = st.number_input("Height (cm)", *PROFILE_RANGES["height"], value=170.0, step=0.5)
+        
+        gender = st.selectbox("Gender", GENDERS)
+
+        st.markdown("#### 🎯 Fitness Goals")
+        fitness_goal = st.selectbox("Primary Goal", GOALS)
+        workout_days = st.slider("Workout Days per Week", *PROFILE_RANGES["workout_days"], 3)
+
+        st.markdown("#### 💪 Workout Preferences")
+        workout_location = st.selectbox("Where do you work out?", LOCATIONS)
+        available_equipment = st.text_input("Equipment available", "None", placeholder="dumbbells, yoga mat...")
+
+        st.markdown("#### 🍽️ Dietary Preferences")
+        diet_pref = st.selectbox("Diet", DIETS)
+        cuisine_pref = st.text_input("Preferred Cuisine", "Indian", placeholder="Italian, Asian...")
+        allergies = st.text_input("Any Allergies?", "None")
+        diet_plan_length = st.radio("Meal plan", list(DIET_PLAN_DAYS), horizontal=True,
+                                    help="A full week is generated day by day, in parallel")
+
+        st.markdown("#### 🤔 Additional Details")
+        special_info = st.text_area(
+            "Injuries, food dislikes, time constraints...",
+            placeholder="Tell us anything else we should know..."
+        )
+
+        fresh_plan = st.checkbox(
+            "🔄 Generate a fresh plan",
+            help="Skip previously generated plans for the same profile"
+        )
+        
+        submit_button = st.form_submit_button(
+            label="🚀 Generate My Plan", 
+            use_container_width=True
+        )
+
+    if submit_button:
+        profile = {
+            "age": age, "weight": weight, "height": height, "gender": gender,
+            "fitness_goal": fitness_goal, "workout_days": workout_days,
+            "workout_location": workout_location, "available_equipment": available_equipment,
+            "diet_pref": diet_pref, "cuisine_pref": cuisine_pref,
+            "allergies": allergies, "special_info": special_info,
+            "diet_days": DIET_PLAN_DAYS[diet_plan_length],
+        }
+        # Kept for progress tracking (BMI, planned workout days)
+        st.session_state.profile = profile
+        submit_plan_request(profile, fresh_plan)
+        # The New Plan tab lives outside this fragment, so redraw the whole page
+        st.rerun()
+
+def submit_plan_request(profile, fresh=False):
+    """Builds the prompts for `profile` and enqueues the plan job for the current user"""
+    with st.spinner("🔍 Analyzing your profile..."), REGISTRY.timer("plan_stage_seconds", stage="prompt_build"):
+        # --- Prompt Engineering ---
+        parts, combined = get_plan_generator().requests(profile)
+
+    # --- Plan Generation (runs in the background and survives reruns) ---
+    st.session_state.active_job = get_job_manager().submit(
+        st.session_state.username,
+        parts,
+        fresh=fresh,
+        goal=profile["fitness_goal"],
+        combined=combined,
+    )
+
+def display_plan_layout():
+    """Lay out the results area and return placeholders for (banner, workout plan, diet plan)"""
+    banner = st.empty()
 
-def display_plan_results(workout_plan, diet_plan):
-    """Display the generated plans in a modern layout"""
-    st.markdown("""
-    <div class="success-message">
-        <h3 style="margin:0; color: white;">🎉 Your Personalized Plans Are Ready!</h3>
-    </div>
-    """, unsafe_allow_html=True)
-    
     # Display Plans in Tabs
     plan_tab1, plan_tab2 = st.tabs(["🏋️ Workout Plan", "🥗 Diet Plan"])
     
@@ -377,7 +407,7 @@ def display_plan_results(workout_plan, diet_plan):
         <div class="custom-card">
             <h2 style="color: #333; margin-bottom: 1.5rem;">Your Workout Plan</h2>
         """, unsafe_allow_html=True)
-        st.markdown(workout_plan)
+        workout_slot = st.empty()
         st.markdown("</div>", unsafe_allow_html=True)
     
     with plan_tab2:
@@ -385,8 +415,22 @@ def display_plan_results(workout_plan, diet_plan):
         <div class="custom-card">
             <h2 style="color: #333; margin-bottom: 1.5rem;">Your Diet Plan</h2>
         """, unsafe_allow_html=True)
-        st.markdown(diet_plan)
+        diet_slot = st.empty()
         st.markdown("</div>", unsafe_allow_html=True)
+
+    return banner, workout_slot, diet_slot
+
+def display_plan_results(workout_plan, diet_plan, layout=None, workout_data=None, diet_data=None):
+    """Display the generated plans in a modern layout, from their structured form when available"""
+    banner, workout_slot, diet_slot = layout or display_plan_layout()
+
+    banner.markdown("""
+    <div class="success-message">
+        <h3 style="margin:0; color: white;">🎉 Your Personalized Plans Are Ready!</h3>
+    </div>
+    """, unsafe_allow_html=True)
+    workout_slot.markdown(render_plan("workout", workout_plan, workout_data))
+    diet_slot.markdown(render_plan("diet", diet_plan, diet_data))
     
     # Download Button
     full_plan_text = f"""
@@ -408,6 +452,254 @@ def display_plan_results(workout_plan, diet_plan):
         use_container_width=True
     )
 
+PLAN_PART_MESSAGES = {
+    "workout": "🏋️ Creating your personalized workout plan...",
+    "diet": "🥗 Designing your perfect diet plan...",
+    "diet_day": "🥗 Planning this day's meals...",
+}
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def display_job_progress(job_id):
+    """Poll a running plan job and stream its partial plans into the page"""
+    job = get_job_manager().get(job_id)
+    if not isinstance(job, PlanJob) or job.done:
+        # Hand over to the New Plan tab, which shows the finished plans
+        st.rerun()
+
+    _, workout_slot, diet_slot = display_plan_layout()
+    progress = job.snapshot()
+    queued = get_inference_gateway().limiter.queue_depth
+    waiting = f" ({queued} requests waiting for the AI model)" if queued else ""
+
+    def show(slot, name, message):
+        text, finished, _ = progress[name]
+        if text:
+            slot.markdown(text + ("" if finished else " ▌"))
+        else:
+            slot.info(message + waiting)
+
+    show(workout_slot, "workout", PLAN_PART_MESSAGES["workout"])
+    days = diet_days(progress)
+    if not days:
+        show(diet_slot, "diet", PLAN_PART_MESSAGES["diet"])
+        return
+    # A weekly plan: every day shows up as soon as it streams, whatever the order they finish in
+    with diet_slot.container():
+        finished = sum(progress[diet_day_part(day)][1] for day in days)
+        st.progress(finished / len(days), text=f"{finished} of {len(days)} days ready")
+        for day in days:
+            st.markdown(f"#### {diet_day_title(day)}")
+            show(st.empty(), diet_day_part(day), PLAN_PART_MESSAGES["diet_day"])
+
+def display_job_result(job_id):
+    """Display the plans produced by a finished job"""
+    job = get_job_manager().get(job_id)
+
+    if isinstance(job, PlanJob):
+        if job.status != FAILED:
+            workout, diet = job.results["workout"], job.results["diet"]
+            display_plan_results(workout.text, diet.text, workout_data=workout.data, diet_data=diet.data)
+            return
+
+        failed = [result for result in job.results.values() if not result.ok]
+        for result in failed:
+            st.error(f"An error occurred while communicating with the AI model: {result.error}")
+        if not failed:
+            # Every part was generated, but the plan could not be saved
+            st.error(f"An error occurred while saving your plan: {job.error}")
+        st.info("Nothing was saved to your history. Your profile is kept, so you can simply try again.")
+        if st.button("🔁 Try Again", use_container_width=True):
+            st.session_state.active_job = get_job_manager().resubmit(job_id)
+            st.rerun(scope="fragment")
+        return
+
+    # The job ran in another process (e.g. before a restart): read back what it stored
+    body = None
+    if job and job.get("plan_id") is not None:
+        body = get_plan_store().get_plan(st.session_state.username, job["plan_id"])
+    if job and job.get("status") == FAILED:
+        st.error(f"An error occurred while communicating with the AI model: {job.get('error')}")
+        st.session_state.active_job = None
+    elif body:
+        display_plan_results(body["workout_plan"], body["diet_plan"],
+                             workout_data=body.get("workout_data"), diet_data=body.get("diet_data"))
+    else:
+        st.warning("Your last plan request was interrupted. Please generate it again.")
+        st.session_state.active_job = None
+
+READY_CARD_HTML = """
+<div class="custom-card">
+    <h2 style="text-align: center; color: #333; margin-bottom: 1rem;">Ready to Transform Your Fitness? 🚀</h2>
+    <p style="text-align: center; color: #666; font-size: 1.1rem;">
+    Fill out your profile in the sidebar and click <strong>"Generate My Plan"</strong> to get started!
+    </p>
+    <div style="text-align: center; font-size: 4rem; margin: 2rem 0;">💪</div>
+</div>
+"""
+
+@st.fragment
+@REGISTRY.timed("render_seconds", phase="new_plan_tab")
+def display_new_plan_tab():
+    """Display the New Plan tab: the active job's progress or result"""
+    display_features()
+
+    active_job = st.session_state.get("active_job")
+    if active_job:
+        job = get_job_manager().get(active_job)
+        if isinstance(job, PlanJob) and not job.done:
+            display_job_progress(active_job)
+        else:
+            display_job_result(active_job)
+    else:
+        st.markdown(READY_CARD_HTML, unsafe_allow_html=True)
+
+# Plan bodies kept per session after an entry has been opened once
+PLAN_BODY_CACHE_SIZE = 20
+
+def load_plan_body(plan_id):
+    """Fetches an opened history entry's plan texts, caching the most recent ones in the session."""
+    cache = st.session_state.setdefault("plan_body_cache", {})
+    if plan_id in cache:
+        cache[plan_id] = cache.pop(plan_id)  # mark as most recently used
+        return cache[plan_id]
+
+    username = st.session_state.username
+    body = get_plan_store().get_plan(username, plan_id) or get_plan_writer().get_pending(username, plan_id) or {}
+    cache[plan_id] = body
+    while len(cache) > PLAN_BODY_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    return body
+
+def display_history_entry(entry):
+    """Display one history entry: metadata up front, the plans only once opened"""
+    with st.container(border=True):
+        goal = f" · 🎯 {entry['goal']}" if entry.get("goal") else ""
+        st.markdown(f"**📅 Plan from {entry['date'].strftime(DATE_FORMAT)}**{goal}")
+        if entry.get("summary"):
+            st.caption(entry["summary"])
+        for snippet in entry.get("snippets", []):
+            st.markdown(f"🔎 …{snippet}…")
+
+        if not st.toggle("Show plan", key=f"history_open_{entry['_id']}"):
+            return
+
+        body = load_plan_body(entry["_id"])
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.markdown("""
+            <div class="plan-section">
+                <h3 style="color: #667eea;">🏋️ Workout Plan</h3>
+            """, unsafe_allow_html=True)
+            st.markdown(render_plan("workout", body.get("workout_plan"), body.get("workout_data")))
+            st.markdown("</div>", unsafe_allow_html=True)
+        
+        with col2:
+            st.markdown("""
+            <div class="plan-section">
+                <h3 style="color: #667eea;">🥗 Diet Plan</h3>
+            """, unsafe_allow_html=True)
+            st.markdown(render_plan("diet", body.get("diet_plan"), body.get("diet_data")))
+            st.markdown("</div>", unsafe_allow_html=True)
+
+# Chart periods on the progress view, in days (None: everything logged)
+PROGRESS_PERIODS = {"3 months": 91, "1 year": 365, "All time": None}
+# Workout choices on the progress form; None leaves the day's workout as it was
+WORKOUT_LOG_OPTIONS = {None: "Not logged", True: "Done", False: "Skipped"}
+
+@st.fragment
+@REGISTRY.timed("render_seconds", phase="progress")
+def display_progress():
+    """Display the progress log form and the weight, BMI and adherence charts"""
+    st.markdown("### 📊 Your Progress")
+    username = st.session_state.username
+    profile = st.session_state.get("profile") or {}
+    store = get_progress_store()
+
+    with st.expander("➕ Log your progress"):
+        with st.form(key="progress_form"):
+            day = st.date_input("Date", value=date.today(), max_value=date.today())
+            col1, col2, col3 = st.columns(3)
+            # Every field can be left unset, so a later log for the same day keeps what was logged earlier
+            with col1:
+                weight = st.number_input("Weight (kg)", min_value=30.0, max_value=250.0, value=None, step=0.1,
+                                         placeholder=f"{float(profile.get('weight', 60.0)):.1f}")
+            with col2:
+                workout = st.selectbox("Workout", list(WORKOUT_LOG_OPTIONS), format_func=WORKOUT_LOG_OPTIONS.get)
+            with col3:
+                meals = st.selectbox("Meals followed", [None, *range(MEALS_PER_DAY, -1, -1)],
+                                     format_func=lambda n: "Not logged" if n is None else f"{n} of {MEALS_PER_DAY}")
+            if st.form_submit_button("💾 Save", use_container_width=True):
+                if weight is None and workout is None and meals is None:
+                    st.warning("Enter at least one value to log.")
+                else:
+                    store.log(username, day, weight=weight, workout=workout, meals=meals,
+                              height=profile.get("height"))
+                    st.success(f"Saved your progress for {day:%d %b %Y}.")
+
+    period = st.radio("Period", list(PROGRESS_PERIODS), horizontal=True, key="progress_period")
+    days = PROGRESS_PERIODS[period]
+    since = date.today() - timedelta(days=days) if days else None
+    frame = to_frame(store.load(username, since=since), since=since)
+    if frame.empty:
+        st.info("Log your weight, workouts and meals to see your progress here.")
+        return
+
+    workout_days = profile.get("workout_days", 3)
+    stats = summary(frame, workout_days, height_cm=profile.get("height"))
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Weight", f"{stats['weight']:.1f} kg" if stats["weight"] else "—",
+                f"{stats['weight_change_30d']:+.1f} kg in 30 days" if stats["weight_change_30d"] is not None else None,
+                delta_color="off")
+    col2.metric("BMI", f"{stats['bmi']:.1f}" if stats["bmi"] else "—")
+    col3.metric("Workout adherence",
+                f"{stats['workout_adherence']:.0%}" if stats["workout_adherence"] is not None else "—",
+                f"target {workout_days} days/week",
+                delta_color="off")
+    col4.metric("Meal adherence", f"{stats['meal_adherence']:.0%}" if stats["meal_adherence"] is not None else "—")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("**⚖️ Weight**")
+        st.line_chart(weight_trend(frame))
+    with col2:
+        st.markdown("**📐 BMI**")
+        bmi = bmi_trend(frame, height_cm=profile.get("height"))
+        if bmi.empty:
+            st.caption("Generate a plan to set your height and see your BMI trend.")
+        else:
+            st.line_chart(bmi)
+    st.markdown("**✅ Weekly adherence (%)**")
+    st.bar_chart(adherence(frame, workout_days) * 100, stack=False)
+
+def display_search_results(query):
+    """Display one ranked page of the user's plans matching `query`, with highlighted snippets"""
+    # Start from the first page whenever the query changes
+    if st.session_state.get("history_search_query") != query:
+        st.session_state.history_search_query = query
+        st.session_state.history_search_page = 0
+    page = st.session_state.history_search_page
+
+    with REGISTRY.timer("plan_stage_seconds", stage="search"):
+        results, has_more = get_plan_search().search(st.session_state.username, query, page=page)
+
+    if not results:
+        st.info("No plans match your search." if page == 0 else "No more matching plans.")
+    for entry in results:
+        display_history_entry(entry)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if page > 0 and st.button("⬅️ Better matches", key="search_prev", use_container_width=True):
+            st.session_state.history_search_page -= 1
+            st.rerun(scope="fragment")
+    with col2:
+        if has_more and st.button("More matches ➡️", key="search_next", use_container_width=True):
+            st.session_state.history_search_page += 1
+            st.rerun(scope="fragment")
+
+@st.fragment
+@REGISTRY.timed("render_seconds", phase="history_tab")
 def display_modern_history():
     """Display modern history view"""
     st.markdown("""
@@ -415,10 +707,28 @@ def display_modern_history():
         <h2 style="color: #333; text-align: center; margin-bottom: 2rem;">📚 Your Plan History</h2>
     """, unsafe_allow_html=True)
     
-    user_data = users_collection.find_one({"_id": st.session_state.username})
-    user_history = user_data.get("history", []) if user_data else []
-
-    if not user_history:
+    query = st.text_input("🔍 Search your plans", key="history_query",
+                          placeholder="e.g. dumbbell routine, chickpea curry...")
+    if query.strip():
+        display_search_results(query)
+        st.markdown("</div>", unsafe_allow_html=True)
+        return
+
+    # Stack of page cursors: the last one is the page being shown
+    if "history_cursors" not in st.session_state:
+        st.session_state.history_cursors = [None]
+    cursors = st.session_state.history_cursors
+
+    # Only lightweight metadata is loaded here; plan bodies are fetched when an entry is opened
+    user_history, next_cursor = get_plan_store().list_plans(st.session_state.username, cursor=cursors[-1])
+    if cursors[-1] is None:
+        # Plans still in the write-behind queue go on top of the first page
+        listed = {entry["_id"] for entry in user_history}
+        pending = [entry for entry in get_plan_writer().pending_plans(st.session_state.username)
+                   if entry["_id"] not in listed]
+        user_history = pending + user_history
+
+    if not user_history and len(cursors) == 1:
         st.markdown("""
         <div style="text-align: center; padding: 3rem;">
             <h3 style="color: #666;">No plans yet</h3>
@@ -427,28 +737,45 @@ def display_modern_history():
         </div>
         """, unsafe_allow_html=True)
     else:
-        for i, entry in enumerate(user_history):
-            with st.expander(f"📅 Plan from {entry['date']}", expanded=(i==0)):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.markdown("""
-                    <div class="plan-section">
-                        <h3 style="color: #667eea;">🏋️ Workout Plan</h3>
-                    """, unsafe_allow_html=True)
-                    st.markdown(entry["workout_plan"])
-                    st.markdown("</div>", unsafe_allow_html=True)
-                
-                with col2:
-                    st.markdown("""
-                    <div class="plan-section">
-                        <h3 style="color: #667eea;">🥗 Diet Plan</h3>
-                    """, unsafe_allow_html=True)
-                    st.markdown(entry["diet_plan"])
-                    st.markdown("</div>", unsafe_allow_html=True)
+        for entry in user_history:
+            display_history_entry(entry)
+
+        # --- Pagination ---
+        col1, col2 = st.columns(2)
+        with col1:
+            if len(cursors) > 1 and st.button("⬅️ Newer plans", key="history_newer", use_container_width=True):
+                cursors.pop()
+                st.rerun(scope="fragment")
+        with col2:
+            if next_cursor is not None and st.button("Older plans ➡️", key="history_older", use_container_width=True):
+                cursors.append(next_cursor)
+                st.rerun(scope="fragment")
     
     st.markdown("</div>", unsafe_allow_html=True)
 
+@st.fragment
+def display_metrics_dashboard():
+    """Display the admin-only metrics view"""
+    st.markdown("### 📈 Performance Metrics")
+
+    cache = get_plan_cache().stats()
+    inference = get_inference_gateway().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Plan cache hit rate", f"{cache['hit_rate']:.0%}", f"{cache['hits']} hits / {cache['misses']} misses")
+    col2.metric("Inference queue", inference["queue_depth"], f"{inference['in_flight']}/{inference['limit']} streams in flight")
+    col3.metric("Retries", inference["retries"], f"{inference['hedges']} hedged requests")
+    col4.metric("Failed generations", inference["failures"], f"{inference['timeouts']} timeouts")
+
+    rows = [
+        {"metric": name, "labels": labels, "count": count, "mean (ms)": round(mean * 1000, 1)}
+        for name, series in sorted(REGISTRY.summary().items())
+        for labels, (count, mean) in sorted(series.items())
+    ]
+    st.dataframe(rows, use_container_width=True)
+
+    with st.expander("Prometheus exposition"):
+        st.code(REGISTRY.render_prometheus(), language="text")
+
 # --- Main App Interface ---
 display_modern_header()
 
@@ -457,7 +784,8 @@ if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
     st.session_state.username = ""
 
-display_modern_auth()
+with st.sidebar:
+    display_modern_auth()
 
 if not st.session_state.logged_in:
     # Welcome screen for non-logged in users
@@ -484,66 +812,22 @@ if not st.session_state.logged_in:
 
 # --- Main Application ---
 if st.session_state.logged_in:
-    # Get form data from sidebar
-    form_data = display_profile_form()
-    (age, weight, height, gender, fitness_goal, workout_days, 
-     workout_location, available_equipment, diet_pref, cuisine_pref, 
-     allergies, special_info, submit_button) = form_data
+    # Sidebar form; submitting it enqueues a plan job
+    with st.sidebar:
+        display_profile_form()
 
     # --- Main Application Tabs ---
-    tab1, tab2 = st.tabs(["🎯 New Plan", "📚 History"])
+    is_admin = st.session_state.username in ADMIN_USERS
+    tabs = st.tabs(["🎯 New Plan", "📚 History"] + (["📈 Metrics"] if is_admin else []))
+    tab1, tab2 = tabs[:2]
 
     with tab1:
-        display_features()
-        
-        if submit_button:
-            with st.spinner("🔍 Analyzing your profile..."):
-                # --- Prompt Engineering ---
-                special_notes_prompt_section = ""
-                if special_info and special_info.strip():
-                    special_notes_prompt_section = f"\nImportant Additional Notes from the user: {special_info}"
-
-                workout_prompt = f"""
-                Create a personalized workout plan for a {age}-year-old {gender} student who is {height} cm tall and weighs {weight} kg.
-                Primary Goal: {fitness_goal}.
-                Workout Schedule: {workout_days} days a week.
-                Workout Location: {workout_location}.
-                Available Equipment: {available_equipment}.
-                {special_notes_prompt_section}
-                Please provide a weekly schedule. For each workout day, list the exercises with sets and reps. Include a warm-up and cool-down routine. Make the plan encouraging and easy to follow for a student.
-                """
-
-                diet_prompt = f"""
-                Create a personalized, budget-friendly, 1-day sample meal plan for a {age}-year-old {gender} student with the goal of '{fitness_goal}'.
-                Dietary Preference: {diet_pref}.
-                Preferred Cuisine: {cuisine_pref}.
-                Allergies: {allergies}.
-                {special_notes_prompt_section}
-                The plan should be simple, using easily available ingredients suitable for a student's budget. Provide options for Breakfast, Lunch, Dinner, and one Snack. Make it sound delicious and motivating!
-                """
-
-            # --- Plan Generation ---
-            with st.spinner("🏋️ Creating your personalized workout plan..."):
-                workout_plan = generate_plan(workout_prompt)
-            
-            with st.spinner("🥗 Designing your perfect diet plan..."):
-                diet_plan = generate_plan(diet_prompt)
-
-            # --- Store plan in history ---
-            add_plan_to_history(st.session_state.username, workout_plan, diet_plan)
-
-            # Display results
-            display_plan_results(workout_plan, diet_plan)
-        else:
-            st.markdown("""
-            <div class="custom-card">
-                <h2 style="text-align: center; color: #333; margin-bottom: 1rem;">Ready to Transform Your Fitness? 🚀</h2>
-                <p style="text-align: center; color: #666; font-size: 1.1rem;">
-                Fill out your profile in the sidebar and click <strong>"Generate My Plan"</strong> to get started!
-                </p>
-                <div style="text-align: center; font-size: 4rem; margin: 2rem 0;">💪</div>
-            </div>
-            """, unsafe_allow_html=True)
+        display_new_plan_tab()
 
     with tab2:
+        display_progress()
         display_modern_history()
+
+    if is_admin:
+        with tabs[2]:
+            display_metrics_dashboard()
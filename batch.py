@@ -0,0 +1,507 @@
+"""
+Headless plan generation for whole cohorts.
+
+Reads profiles from a CSV or JSONL file, one per row, whose columns are the
+profile fields (see prompts.normalize_profile) plus optional `id` and
+`username`. Plans are generated by the same PlanGenerator as the app, in an
+asyncio pipeline that keeps a fixed number of profiles in flight, while the
+inference gateway caps upstream model calls. Results stream to a JSONL file
+or, with --to-history, straight into the users' histories in bulk writes.
+
+Runs are resumable: records already in the output file (or, for histories,
+in the plans collection) are skipped, so rerunning an interrupted batch
+finishes it.
+
+    python batch.py run cohort.csv --output plans.jsonl
+    python batch.py run cohort.jsonl --to-history --concurrency 16
+    python batch.py serve --port 8600
+
+The HTTP endpoint runs the same batches, named by the caller. It refuses
+to start without BATCH_API_TOKEN, which every request must send as
+`Authorization: Bearer <token>`:
+
+    POST /batches/<name>          body: CSV (Content-Type: text/csv) or JSONL;
+                                  ?to_history=1 writes to histories
+    GET  /batches/<name>          progress and throughput
+    GET  /batches/<name>/results  the JSONL output
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import hmac
+import io
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bson import ObjectId # type: ignore
+from pymongo import MongoClient # type: ignore
+
+from llm_backends import DEFAULT_MODEL, make_backend
+from plan_cache import make_plan_cache
+from plan_generation import make_gateway, make_plan_generator
+from plan_store import make_plan_store
+from prompts import normalize_profile
+from settings import load_secrets
+
+# Results per write to the output file or the plans collection
+WRITE_BATCH_SIZE = 50
+# Seconds between progress reports
+PROGRESS_INTERVAL = 5.0
+# Ids per query when checking which records are already done
+LOOKUP_BATCH = 500
+_BATCH_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+# Marks the end of the results queue
+_END = object()
+
+
+def parse_records(text, fmt):
+    """
+    Returns [(record id, record)] from CSV or JSONL text. A record's id is
+    its `id` column, else its `username`, else its row number.
+    """
+    if fmt == "csv":
+        rows = list(csv.DictReader(io.StringIO(text)))
+    else:
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [
+        (str(row.get("id") or row.get("username") or f"row-{number}"), row)
+        for number, row in enumerate(rows, 1)
+    ]
+
+
+def read_records(path):
+    """Reads a .csv file, or JSONL from any other file."""
+    with open(path, encoding="utf-8") as f:
+        return parse_records(f.read(), "csv" if path.lower().endswith(".csv") else "jsonl")
+
+
+class JsonlSink:
+    """Appends results to a JSONL file; records with a result line and no error are done."""
+
+    needs_username = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def unknown_users(self, usernames):
+        return set()
+
+    def completed(self, ids):
+        done = set()
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by an interruption
+                    if not result.get("error"):
+                        done.add(result["id"])
+        return done & set(ids)
+
+    def write(self, results):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class HistorySink:
+    """
+    Bulk-writes successful results to the users' plan histories. Each
+    record's plan id is derived from the batch name and record id, so a
+    record is never stored twice and finished records are found on resume.
+    Records for usernames that are not in the `users` collection fail.
+    """
+
+    needs_username = True
+
+    def __init__(self, plan_store, batch, users):
+        self.plan_store = plan_store
+        self.batch = batch
+        self.users = users
+
+    def unknown_users(self, usernames):
+        usernames = list(usernames)
+        found = set()
+        for start in range(0, len(usernames), LOOKUP_BATCH):
+            query = {"_id": {"$in": usernames[start:start + LOOKUP_BATCH]}}
+            found.update(doc["_id"] for doc in self.users.find(query, {"_id": 1}))
+        return set(usernames) - found
+
+    def plan_id(self, record_id):
+        return ObjectId(hashlib.sha256(f"{self.batch}:{record_id}".encode()).digest()[:12])
+
+    def completed(self, ids):
+        by_plan_id = {self.plan_id(record_id): record_id for record_id in ids}
+        plan_ids = list(by_plan_id)
+        done = set()
+        for start in range(0, len(plan_ids), LOOKUP_BATCH):
+            query = {"_id": {"$in": plan_ids[start:start + LOOKUP_BATCH]}}
+            done.update(by_plan_id[doc["_id"]] for doc in self.plan_store.collection.find(query, {"_id": 1}))
+        return done
+
+    def write(self, results):
+        docs = [
+            self.plan_store.new_plan(
+                result["username"], result["workout_plan"], result["diet_plan"],
+                goal=result["profile"]["fitness_goal"],
+                workout_data=result["workout_data"], diet_data=result["diet_data"],
+                plan_id=self.plan_id(result["id"]),
+            )
+            for result in results if not result["error"]
+        ]
+        self.plan_store.write_plans(docs)
+
+
+class BatchRun:
+    """Generates plans for a list of records into a sink, with `concurrency` profiles in flight."""
+
+    def __init__(self, generator, sink, records, concurrency=8, fresh=False,
+                 write_size=WRITE_BATCH_SIZE, log=print):
+        self.generator = generator
+        self.sink = sink
+        self.records = records
+        self.concurrency = concurrency
+        self.fresh = fresh
+        self.write_size = write_size
+        self.log = log
+        self.status = "queued"
+        self.total = len(records)
+        self.skipped = 0
+        self.generated = 0
+        self.failed = 0
+        self.written = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self._unknown_users = set()
+
+    def progress(self):
+        """Returns counters, elapsed time, throughput in profiles per minute and the estimated time left."""
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        done = self.generated + self.failed
+        rate = done / elapsed * 60 if elapsed else 0.0
+        remaining = self.total - self.skipped - done
+        return {
+            "status": self.status,
+            "total": self.total,
+            "skipped": self.skipped,
+            "generated": self.generated,
+            "failed": self.failed,
+            "written": self.written,
+            "elapsed_seconds": round(elapsed, 1),
+            "profiles_per_minute": round(rate, 1),
+            "eta_seconds": round(remaining / rate * 60) if rate and self.status == "running" else None,
+            "error": self.error,
+        }
+
+    def _generate(self, record_id, record, part_executor):
+        """Returns the result line for one record (blocking; runs on a worker thread)."""
+        username = str(record.get("username") or "").strip() or None
+        result = {"id": record_id, "username": username, "profile": None, "workout_plan": None,
+                  "diet_plan": None, "workout_data": None, "diet_data": None, "error": None}
+        try:
+            result["profile"] = normalize_profile(record)
+        except ValueError as e:
+            result["error"] = f"invalid profile: {e}"
+            return result
+        if self.sink.needs_username and not username:
+            result["error"] = "missing username"
+            return result
+        if username in self._unknown_users:
+            result["error"] = f"unknown user {username}"
+            return result
+
+        plans = self.generator.generate(result["profile"], fresh=self.fresh, executor=part_executor)
+        errors = [f"{name}: {plan.error}" for name, plan in plans.items() if not plan.ok]
+        if errors:
+            result["error"] = "; ".join(errors)
+            return result
+        for name, plan in plans.items():
+            result[f"{name}_plan"] = plan.text
+            result[f"{name}_data"] = plan.data
+        return result
+
+    async def run(self):
+        """Runs the batch to completion; returns the final progress."""
+        loop = asyncio.get_running_loop()
+        self.started_at = time.time()
+        self.status = "running"
+        try:
+            ids = [record_id for record_id, _ in self.records]
+            done = await loop.run_in_executor(None, self.sink.completed, ids)
+            todo = [(record_id, record) for record_id, record in self.records if record_id not in done]
+            self.skipped = self.total - len(todo)
+            if self.sink.needs_username:
+                usernames = {str(record.get("username") or "").strip() for _, record in todo} - {""}
+                self._unknown_users = await loop.run_in_executor(None, self.sink.unknown_users, usernames)
+            self.log(f"{self.total} records, {self.skipped} already done, {len(todo)} to generate.")
+
+            with ThreadPoolExecutor(self.concurrency, thread_name_prefix="batch") as profile_executor, \
+                    ThreadPoolExecutor(2 * self.concurrency, thread_name_prefix="batch-part") as part_executor:
+                await self._pipeline(loop, iter(todo), profile_executor, part_executor)
+            self.status = "done"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            raise
+        finally:
+            self.finished_at = time.time()
+            if self.status == "running":
+                self.status = "interrupted"
+            self._report()
+        return self.progress()
+
+    async def _pipeline(self, loop, pending, profile_executor, part_executor):
+        results = asyncio.Queue(maxsize=2 * self.write_size)
+
+        async def worker():
+            # Workers share one iterator, so exactly `concurrency` records are in flight
+            for record_id, record in pending:
+                try:
+                    result = await loop.run_in_executor(profile_executor, self._generate, record_id, record,
+                                                        part_executor)
+                except Exception as e:
+                    result = {"id": record_id, "username": record.get("username"), "error": str(e)}
+                if result["error"]:
+                    self.failed += 1
+                    self.log(f"Record {record_id} failed: {result['error']}")
+                else:
+                    self.generated += 1
+                await results.put(result)
+
+        async def writer():
+            batch = []
+            try:
+                while True:
+                    try:
+                        result = await asyncio.wait_for(results.get(), timeout=1.0)
+                    except asyncio.TimeoutError:
+                        result = None  # idle: write out what has finished so far
+                    if isinstance(result, dict):
+                        batch.append(result)
+                        if len(batch) < self.write_size:
+                            continue
+                    if batch:
+                        flushing, batch = batch, []
+                        await loop.run_in_executor(None, self.sink.write, flushing)
+                        self.written += len(flushing)
+                    if result is _END:
+                        return
+            finally:
+                if batch:
+                    # Interrupted: keep the results that have finished
+                    self.sink.write(batch)
+                    self.written += len(batch)
+
+        async def reporter():
+            while True:
+                await asyncio.sleep(PROGRESS_INTERVAL)
+                self._report()
+
+        writer_task = asyncio.create_task(writer())
+        reporter_task = asyncio.create_task(reporter())
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+            await results.put(_END)
+            await writer_task
+        finally:
+            for task in (writer_task, reporter_task):
+                task.cancel()
+            await asyncio.gather(writer_task, reporter_task, return_exceptions=True)
+
+    def _report(self):
+        p = self.progress()
+        eta = f", about {p['eta_seconds']}s left" if p["eta_seconds"] is not None else ""
+        self.log(f"[{p['status']}] {p['generated'] + p['failed']}/{p['total'] - p['skipped']} profiles "
+                 f"({p['failed']} failed, {p['skipped']} skipped), "
+                 f"{p['profiles_per_minute']} profiles/min{eta}")
+
+
+def make_generator(secrets, db, concurrency, rate=None):
+    """Builds a PlanGenerator with the app's backend, cache and key settings."""
+    gateway = make_gateway(secrets, make_backend(secrets).stream_chat, DEFAULT_MODEL, concurrency, rate)
+    return make_plan_generator(secrets, gateway, cache=make_plan_cache(secrets, db))
+
+
+class BatchService:
+    """Runs named batches submitted over HTTP, one background thread each, sharing one generator."""
+
+    def __init__(self, generator, directory, concurrency=8, plan_store=None, users=None):
+        """History output needs both `plan_store` and the `users` collection that usernames are checked against."""
+        self.generator = generator
+        self.directory = directory
+        self.concurrency = concurrency
+        self.plan_store = plan_store
+        self.users = users
+        self._runs = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def output_path(self, name):
+        return os.path.join(self.directory, f"{name}.jsonl")
+
+    def start(self, name, records, to_history=False):
+        """Starts (or resumes) batch `name`; returns its run, or None if it is already running."""
+        if to_history:
+            sink = HistorySink(self.plan_store, name, self.users)
+        else:
+            sink = JsonlSink(self.output_path(name))
+        with self._lock:
+            run = self._runs.get(name)
+            if run is not None and run.status in ("queued", "running"):
+                return None
+            run = self._runs[name] = BatchRun(self.generator, sink, records, self.concurrency,
+                                              log=lambda message: print(f"{name}: {message}", flush=True))
+        threading.Thread(target=asyncio.run, args=(run.run(),), name=f"batch-{name}", daemon=True).start()
+        return run
+
+    def get(self, name):
+        with self._lock:
+            return self._runs.get(name)
+
+
+def serve(service, host, port, token):
+    """Serves the batch endpoints; every request must send `Authorization: Bearer <token>`."""
+    if not token:
+        raise ValueError("the batch endpoint needs an API token")
+    expected = f"Bearer {token}".encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _route(self):
+            """Returns (batch name, sub-resource, query) for an authorized /batches/ path, or None once answered."""
+            if not hmac.compare_digest(self.headers.get("Authorization", "").encode(), expected):
+                self._send_json(401, {"error": "unauthorized"})
+                return None
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+            if len(parts) not in (2, 3) or parts[0] != "batches" or not _BATCH_NAME_RE.match(parts[1]):
+                self._send_json(404, {"error": "not found"})
+                return None
+            return parts[1], parts[2] if len(parts) == 3 else None, parse_qs(url.query)
+
+        def do_POST(self):
+            route = self._route()
+            if route is None:
+                return
+            name, sub, query = route
+            if sub is not None:
+                self._send_json(404, {"error": "not found"})
+                return
+            to_history = query.get("to_history", ["0"])[0] in ("1", "true")
+            if to_history and (service.plan_store is None or service.users is None):
+                self._send_json(400, {"error": "history output is not configured"})
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+            fmt = "csv" if "csv" in (self.headers.get("Content-Type") or "") else "jsonl"
+            try:
+                records = parse_records(body, fmt)
+            except (ValueError, csv.Error) as e:
+                self._send_json(400, {"error": f"could not parse the {fmt} body: {e}"})
+                return
+            run = service.start(name, records, to_history=to_history)
+            if run is None:
+                self._send_json(409, {"error": f"batch {name} is already running"})
+                return
+            self._send_json(202, {"batch": name, **run.progress()})
+
+        def do_GET(self):
+            route = self._route()
+            if route is None:
+                return
+            name, sub, _ = route
+            if sub is None:
+                run = service.get(name)
+                if run is None:
+                    self._send_json(404, {"error": f"no batch {name} in this process"})
+                else:
+                    self._send_json(200, {"batch": name, **run.progress()})
+                return
+            path = service.output_path(name)
+            if sub != "results" or not os.path.exists(path):
+                self._send_json(404, {"error": "not found"})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Content-Length", str(os.path.getsize(path)))
+            self.end_headers()
+            with open(path, "rb") as f:
+                while chunk := f.read(64 * 1024):
+                    self.wfile.write(chunk)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving batch API on http://{host}:{port}/batches/", flush=True)
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate plans for a cohort of profiles.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="generate plans for the profiles in a CSV or JSONL file")
+    run_parser.add_argument("input", help="profiles, .csv or JSONL")
+    output = run_parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--output", help="JSONL file to append results to")
+    output.add_argument("--to-history", action="store_true", help="save plans to each `username`'s history")
+    run_parser.add_argument("--batch", help="batch name for --to-history resumes (default: input file name)")
+    run_parser.add_argument("--fresh", action="store_true", help="skip the plan cache")
+    serve_parser = commands.add_parser("serve", help="run the batch HTTP endpoint")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8600)
+    serve_parser.add_argument("--directory", default="batches", help="where batch results are written")
+    for sub in (run_parser, serve_parser):
+        sub.add_argument("--concurrency", type=int, default=8, help="profiles (and model requests) in flight")
+        sub.add_argument("--rate", type=float, help="at most this many model requests per minute")
+    args = parser.parse_args()
+
+    secrets = load_secrets()
+    db = MongoClient(secrets["MONGO_URI"])[secrets["DB_NAME"]]
+    generator = make_generator(secrets, db, args.concurrency, args.rate)
+
+    if args.command == "serve":
+        token = secrets.get("BATCH_API_TOKEN")
+        if not token:
+            parser.error("set BATCH_API_TOKEN in the secrets file before running the batch endpoint")
+        service = BatchService(generator, args.directory, args.concurrency, plan_store=make_plan_store(secrets, db),
+                               users=db[secrets["COLLECTION_NAME"]])
+        serve(service, args.host, args.port, token)
+        return
+
+    records = read_records(args.input)
+    if args.to_history:
+        batch = args.batch or os.path.splitext(os.path.basename(args.input))[0]
+        sink = HistorySink(make_plan_store(secrets, db), batch, db[secrets["COLLECTION_NAME"]])
+    else:
+        sink = JsonlSink(args.output)
+    run = BatchRun(generator, sink, records, args.concurrency, fresh=args.fresh)
+    try:
+        progress = asyncio.run(run.run())
+    except KeyboardInterrupt:
+        print("Interrupted; finished plans are saved. Run the same command again to resume.")
+        raise SystemExit(130)
+    if progress["failed"]:
+        print(f"{progress['failed']} records failed; run again to retry them.")
+
+
+if __name__ == "__main__":
+    main()
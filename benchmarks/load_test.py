@@ -0,0 +1,266 @@
+"""
+End-to-end load test for the Streamlit app.
+
+Simulates N concurrent users driving `app.py` through Streamlit's AppTest:
+each one registers, logs in, submits the profile form, waits for the plans
+to stream in and opens an entry in the History tab. The app runs against the
+local model backend and an in-memory mongomock database, so no network or
+credentials are needed.
+
+Reports p50/p95/p99 rerun latency, time to first token and to the finished
+plan as seen on the page, and memory per session, and writes them as JSON so
+runs can be compared across commits:
+
+    python benchmarks/load_test.py --users 20 --output before.json
+    python benchmarks/load_test.py --users 20 --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+sys.path.insert(0, REPO_ROOT)
+
+from streamlit.testing.v1 import AppTest # type: ignore # noqa: E402
+
+# AppTest swaps process-global Streamlit state (runtime, secrets) in and out
+# around each run, so script runs are serialized. Sessions still interleave,
+# and their background jobs and model streams overlap as they would in a server.
+_APPTEST_LOCK = threading.Lock()
+
+READY_TEXT = "Your Personalized Plans Are Ready"
+STREAMING_CURSOR = " ▌"
+
+
+def percentiles(samples):
+    """Returns count, mean and p50/p95/p99 (in milliseconds) of `samples` in seconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean": statistics.fmean(ordered) * 1000,
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": ordered[-1] * 1000,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class SimulatedUser:
+    """One browser session driving the app, recording the latency of every rerun."""
+
+    def __init__(self, index, args, secrets):
+        self.index = index
+        self.args = args
+        self.username = f"bench-{args.run_id}-{index}"
+        self.password = "bench-password"
+        self.at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+        for key, value in secrets.items():
+            self.at.secrets[key] = value
+        self.reruns = {}
+        self.ttft = None
+        self.plan_time = None
+        self.errors = []
+
+    def _run(self, phase, action=None):
+        with _APPTEST_LOCK:
+            start = time.perf_counter()
+            (action or self.at).run()
+            self.reruns.setdefault(phase, []).append(time.perf_counter() - start)
+        if self.at.exception:
+            self.errors.append(f"{phase}: {self.at.exception[0].message}")
+
+    def _button(self, label):
+        return next(b for b in self.at.button if b.label == label)
+
+    def _markdown_texts(self):
+        return [m.value for m in self.at.markdown]
+
+    def register_and_login(self):
+        self._run("load")
+        self.at.text_input(key="reg_user").input(self.username)
+        self.at.text_input(key="reg_pass").input(self.password)
+        self.at.text_input(key="reg_confirm").input(self.password)
+        self._run("register", self._button("Register").click())
+
+        self.at.text_input(key="login_user").input(self.username)
+        self.at.text_input(key="login_pass").input(self.password)
+        self._run("login", self._button("Login").click())
+
+    def submit_profile(self):
+        if not self.args.same_profile:
+            # Distinct profiles miss the plan cache, like real traffic mostly does
+            age = 16 + self.index % 60
+            next(n for n in self.at.number_input if n.label == "Age").set_value(age)
+        submitted = time.perf_counter()
+        self._run("submit", self._button("🚀 Generate My Plan").click())
+
+        # Poll like the job fragment does until the plans are on the page
+        deadline = submitted + self.args.timeout
+        while time.perf_counter() < deadline:
+            texts = self._markdown_texts()
+            if self.ttft is None and any(t.endswith(STREAMING_CURSOR) or READY_TEXT in t for t in texts):
+                self.ttft = time.perf_counter() - submitted
+            if any(READY_TEXT in t for t in texts):
+                self.plan_time = time.perf_counter() - submitted
+                return
+            time.sleep(self.args.poll_interval)
+            self._run("poll")
+        self.errors.append("submit: plans did not finish before the timeout")
+
+    def open_history(self):
+        if not self.at.toggle:
+            self.errors.append("history: no history entry to open")
+            return
+        self._run("history", self.at.toggle[0].set_value(True))
+
+    def run_session(self):
+        try:
+            self.register_and_login()
+            self.submit_profile()
+            self.open_history()
+        except Exception as e:
+            self.errors.append(f"{type(e).__name__}: {e}")
+        return self
+
+
+def benchmark_secrets(args):
+    return {
+        "MONGO_URI": "mongomock://localhost",
+        "DB_NAME": "benchmark",
+        "COLLECTION_NAME": "users",
+        "LLM_BACKEND": "local",
+        "LOCAL_TTFT": args.ttft,
+        "LOCAL_TOKENS_PER_SECOND": args.tokens_per_second,
+        "LOCAL_JITTER": args.jitter,
+        "MAX_CONCURRENT_INFERENCE": args.max_concurrent_inference,
+        "GENERATION_MODE": args.generation_mode,
+    }
+
+
+def run_load(args, secrets):
+    """Runs `args.users` sessions concurrently and aggregates their measurements."""
+    users = [SimulatedUser(i, args, secrets) for i in range(args.users)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(SimulatedUser.run_session, users))
+    wall_time = time.perf_counter() - start
+
+    phases = {}
+    for user in users:
+        for phase, samples in user.reruns.items():
+            phases.setdefault(phase, []).extend(samples)
+    all_reruns = [sample for samples in phases.values() for sample in samples]
+
+    return {
+        "wall_time_s": wall_time,
+        "rerun_latency_ms": percentiles(all_reruns),
+        "rerun_latency_by_phase_ms": {phase: percentiles(s) for phase, s in sorted(phases.items())},
+        "ttft_ms": percentiles([u.ttft for u in users if u.ttft is not None]),
+        "plan_complete_ms": percentiles([u.plan_time for u in users if u.plan_time is not None]),
+        "errors": [f"{u.username}: {e}" for u in users for e in u.errors],
+    }
+
+
+def measure_memory(args, secrets):
+    """Returns the average memory (KiB) retained per completed session, measured sequentially."""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    memory_args = argparse.Namespace(**{**vars(args), "run_id": f"{args.run_id}-mem"})
+    sessions = [SimulatedUser(i, memory_args, secrets).run_session() for i in range(args.memory_sessions)]
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del sessions
+    return retained / max(1, args.memory_sessions) / 1024
+
+
+def compare(current, baseline_path):
+    """Prints how the headline numbers moved against a previous results file."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    for section in ("rerun_latency_ms", "ttft_ms", "plan_complete_ms"):
+        for stat in ("p50", "p95", "p99"):
+            before = baseline.get(section, {}).get(stat)
+            after = current.get(section, {}).get(stat)
+            if before and after is not None:
+                print(f"  {section}.{stat}: {before:.1f} -> {after:.1f} ({(after - before) / before:+.1%})")
+    before = baseline.get("memory_per_session_kib")
+    after = current.get("memory_per_session_kib")
+    if before and after is not None:
+        print(f"  memory_per_session_kib: {before:.1f} -> {after:.1f} ({(after - before) / before:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test app.py with simulated concurrent users.")
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--ttft", type=float, default=0.5, help="local backend time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--max-concurrent-inference", type=int, default=4)
+    parser.add_argument("--generation-mode", choices=["separate", "combined"], default="separate",
+                        help="one completion per plan, or both plans from one completion")
+    parser.add_argument("--same-profile", action="store_true", help="every user submits the same profile")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="seconds between polling reruns")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-rerun and per-plan timeout (s)")
+    parser.add_argument("--memory-sessions", type=int, default=5, help="sessions used to measure memory (0 to skip)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    args = parser.parse_args()
+    args.run_id = datetime.now().strftime("%H%M%S")
+
+    secrets = benchmark_secrets(args)
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "run_id")},
+        **run_load(args, secrets),
+    }
+    if args.memory_sessions:
+        results["memory_per_session_kib"] = measure_memory(args, secrets)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    rerun = results["rerun_latency_ms"]
+    print(f"{args.users} users in {results['wall_time_s']:.1f}s, {rerun.get('count', 0)} reruns")
+    for section in ("rerun_latency_ms", "ttft_ms", "plan_complete_ms"):
+        stats = results[section]
+        if stats.get("count"):
+            print(f"  {section}: p50 {stats['p50']:.1f}  p95 {stats['p95']:.1f}  p99 {stats['p99']:.1f}")
+    if "memory_per_session_kib" in results:
+        print(f"  memory per session: {results['memory_per_session_kib']:.1f} KiB")
+    if results["errors"]:
+        print(f"  {len(results['errors'])} errors, first: {results['errors'][0]}")
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+"""
+Process-wide gateway for streaming model completions.
+
+Every session shares one gateway, which
+- caps how many upstream streams run at once, admitting waiters in arrival
+  order and reporting how many are queued,
+- coalesces identical requests that are in flight at the same moment, so N
+  sessions asking for the same prompt share a single upstream stream, and
+- bounds each request with a first-token and a total timeout, retries
+  transient failures with exponential backoff across a failover model list,
+  and can hedge a slow request with a second one, keeping whichever answers
+  first.
+
+Failures surface as GenerationError (or a failed PlanResult), never as text.
+"""
+import hashlib
+import json
+import queue
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import REGISTRY
+
+# HTTP statuses worth retrying: timeouts, rate limiting and upstream hiccups
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class GenerationError(Exception):
+    """Raised when a completion could not be produced."""
+
+
+class PlanResult:
+    """Outcome of generating one plan: its text (and structured form, once parsed), or the reason it failed."""
+
+    def __init__(self, text="", error=None, data=None):
+        self.text = text
+        self.error = error
+        self.data = data
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f"PlanResult(ok={self.ok}, chars={len(self.text)}, error={self.error!r})"
+
+
+def is_transient(error):
+    """Returns True for failures a retry may fix (timeouts, connection errors, 429/5xx)."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) in TRANSIENT_STATUS_CODES
+
+
+class _NoTokens(Exception):
+    """An attempt failed before producing any text, so it is safe to retry."""
+
+    def __init__(self, cause):
+        super().__init__(str(cause))
+        self.cause = cause
+
+
+# Marks the normal end of an upstream stream on the attempt's event queue
+_END = object()
+
+
+class FairLimiter:
+    """Counting semaphore that hands out slots strictly in arrival (FIFO) order."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Waits for a slot; returns False if `timeout` seconds pass first."""
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return True
+            granted = threading.Event()
+            self._waiters.append(granted)
+
+        if granted.wait(timeout):
+            return True
+        with self._lock:
+            if granted.is_set():
+                # Released to us between the timeout and taking the lock
+                return True
+            self._waiters.remove(granted)
+            return False
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # Hand the slot straight to the oldest waiter so nobody can jump the queue
+                self._waiters.popleft().set()
+            else:
+                self._active -= 1
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @property
+    def queue_depth(self):
+        with self._lock:
+            return len(self._waiters)
+
+    @property
+    def in_flight(self):
+        with self._lock:
+            return self._active
+
+
+class RateLimiter:
+    """Spaces out calls so no more than `per_minute` start in any minute; None or 0 disables it."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Waits for the next start; returns False, without taking it, if that is more than `timeout` seconds away."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            if timeout is not None and start - now > timeout:
+                return False
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return True
+
+
+class _Flight:
+    """One upstream stream, replayed to every caller that joined it."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def publish(self, text):
+        with self.cond:
+            self.chunks.append(text)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def follow(self):
+        """Yields every chunk from the start of the stream, then raises its error, if any."""
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.done:
+                    self.cond.wait()
+                new_chunks = self.chunks[index:]
+                index = len(self.chunks)
+                done, error = self.done, self.error
+            yield from new_chunks
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+def _close_stream(stream):
+    """Closes a completion stream (generator or response) if it can be closed."""
+    close = getattr(stream, "close", None)
+    if close is not None:
+        close()
+
+
+class _Upstream:
+    """
+    One upstream stream started by an attempt, and the limiter slot it holds.
+    The attempt cancels and releases it when it gives up, even if the
+    thread pumping the stream is still blocked waiting on the model.
+    """
+
+    def __init__(self, limiter):
+        self.cancelled = threading.Event()
+        self._limiter = limiter
+        self._stream = None
+        self._released = False
+        self._lock = threading.Lock()
+
+    def attach(self, stream):
+        """Records the opened stream; returns False (and closes it) if the attempt already gave up on it."""
+        self._stream = stream
+        if self.cancelled.is_set():
+            _close_stream(stream)
+            return False
+        return True
+
+    def cancel(self):
+        """Stops the stream and closes it, which drops its upstream connection."""
+        self.cancelled.set()
+        try:
+            _close_stream(self._stream)
+        except ValueError:
+            # A generator cannot be closed while its thread is inside it; that
+            # thread sees `cancelled` and closes it when the next chunk arrives
+            pass
+
+    def release(self):
+        """Returns the stream's limiter slot; only the first call has an effect."""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._limiter.release()
+
+
+def request_key(messages, params):
+    """Returns the identity of a completion request, used for coalescing."""
+    encoded = json.dumps({"messages": messages, "params": params}, sort_keys=True)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class InferenceGateway:
+    """
+    Limits, coalesces and guards calls to `stream_fn(model, messages, **params)`,
+    which yields text chunks. `models` is the failover list, primary first.
+    A `hedge_after` of None disables hedged requests. `admit(timeout)`, if
+    given, is called before every upstream request (retries and hedges
+    included) takes a slot, and returns False if the request may not start
+    within `timeout` seconds; a RateLimiter's `acquire` fits.
+    """
+
+    def __init__(self, stream_fn, models, max_concurrent=4, total_timeout=120.0,
+                 first_token_timeout=30.0, max_retries=2, backoff=1.0, hedge_after=None, admit=None):
+        self._stream_fn = stream_fn
+        self._admit = admit
+        self.models = list(models)
+        self.limiter = FairLimiter(max_concurrent)
+        self.total_timeout = total_timeout
+        self.first_token_timeout = first_token_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def stream(self, messages, **params):
+        """Yields the completion's text chunks, sharing an identical in-flight request if there is one."""
+        key = request_key(messages, params)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                # The upstream runs on its own thread so no single caller can stall the others
+                threading.Thread(
+                    target=self._run_flight, args=(key, flight, messages, params),
+                    name="inference-flight", daemon=True,
+                ).start()
+            else:
+                self.coalesced_calls += 1
+
+        yield from flight.follow()
+
+    def _run_flight(self, key, flight, messages, params):
+        error = None
+        try:
+            self._produce(flight, messages, params)
+        except GenerationError as e:
+            error = e
+        except Exception as e:
+            error = GenerationError(str(e))
+        finally:
+            with self._lock:
+                # Later identical requests start a new stream (or hit the plan cache)
+                self._flights.pop(key, None)
+                if error is not None:
+                    self.failures += 1
+            flight.finish(error)
+
+    def _produce(self, flight, messages, params):
+        """Publishes one completion to `flight`, retrying failed attempts that produced no text."""
+        deadline = time.monotonic() + self.total_timeout
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    self.retries += 1
+                delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.0)
+                if time.monotonic() + delay >= deadline:
+                    break
+                time.sleep(delay)
+            try:
+                return self._attempt(flight, messages, params, attempt, deadline)
+            except _NoTokens as e:
+                last_error = e.cause
+                if not is_transient(e.cause):
+                    raise GenerationError(str(e.cause)) from e.cause
+        raise GenerationError(f"The AI model did not respond after {attempt + 1} attempts: {last_error}")
+
+    def _start_upstream(self, attempt, events, messages, params):
+        """Starts streaming from the model for `attempt` on its own thread; the caller holds a limiter slot for it."""
+        upstream = _Upstream(self.limiter)
+        model = self.models[attempt % len(self.models)]
+        with self._lock:
+            self.upstream_calls += 1
+        threading.Thread(
+            target=self._pump_upstream, args=(model, upstream, events, messages, params),
+            name="inference-upstream", daemon=True,
+        ).start()
+        return upstream
+
+    def _pump_upstream(self, model, upstream, events, messages, params):
+        try:
+            stream = self._stream_fn(model, messages, **params)
+            if not upstream.attach(stream):
+                return
+            try:
+                for text in stream:
+                    if upstream.cancelled.is_set():
+                        break
+                    events.put((upstream, text))
+            finally:
+                _close_stream(stream)
+            events.put((upstream, _END))
+        except Exception as e:
+            events.put((upstream, e))
+
+    def _attempt(self, flight, messages, params, attempt, deadline):
+        """
+        Runs one attempt, optionally hedged, and publishes the winning stream.
+        Raises _NoTokens if it failed before any text was produced.
+        """
+        queued_at = time.monotonic()
+        # Waits for admission and a slot happen before the first-token clock starts
+        if self._admit is not None and not self._admit(timeout=max(0.0, deadline - queued_at)):
+            with self._lock:
+                self.timeouts += 1
+            raise GenerationError("Timed out waiting for the AI model's request rate limit.")
+        acquired = self.limiter.acquire(timeout=max(0.0, deadline - time.monotonic()))
+        REGISTRY.observe("inference_queue_wait_seconds", time.monotonic() - queued_at,
+                         help="Time spent waiting for an inference slot")
+        if not acquired:
+            with self._lock:
+                self.timeouts += 1
+            raise GenerationError("Timed out waiting for a free slot for the AI model.")
+
+        events = queue.Queue()
+        started = [self._start_upstream(attempt, events, messages, params)]
+        failed = set()
+        winner = None
+        start = time.monotonic()
+        first_token_deadline = min(deadline, start + self.first_token_timeout)
+        hedge_at = start + self.hedge_after if self.hedge_after is not None else None
+
+        try:
+            while True:
+                if winner is not None:
+                    wait_until = deadline
+                elif hedge_at is not None and len(started) == 1:
+                    wait_until = min(first_token_deadline, hedge_at)
+                else:
+                    wait_until = first_token_deadline
+
+                try:
+                    source, item = events.get(timeout=max(0.0, wait_until - time.monotonic()))
+                except queue.Empty:
+                    now = time.monotonic()
+                    if winner is None and hedge_at is not None and len(started) == 1 and now < first_token_deadline:
+                        # Hedge only with a spare slot; a hedge must never wait behind other users
+                        admitted = self._admit is None or self._admit(timeout=0)
+                        if admitted and self.limiter.acquire(timeout=0):
+                            started.append(self._start_upstream(attempt + 1, events, messages, params))
+                            with self._lock:
+                                self.hedges += 1
+                        else:
+                            hedge_at = None
+                        continue
+                    with self._lock:
+                        self.timeouts += 1
+                    if winner is None:
+                        raise _NoTokens(TimeoutError(
+                            f"No response from the AI model within {self.first_token_timeout:g}s."
+                        ))
+                    raise GenerationError(f"The AI model did not finish within {self.total_timeout:g}s.")
+
+                if winner is not None and source is not winner:
+                    continue  # output of a stream that lost the race
+                if isinstance(item, Exception):
+                    if winner is not None:
+                        raise GenerationError(f"The AI model stopped mid-response: {item}") from item
+                    # A failed stream is over, so its slot can go to the next waiter straight away
+                    source.release()
+                    failed.add(source)
+                    if len(failed) == len(started):
+                        raise _NoTokens(item)
+                    continue
+                if winner is None:
+                    winner = source
+                    REGISTRY.observe("inference_first_token_seconds", time.monotonic() - start,
+                                     help="Time from sending a request to its first token")
+                    if len(started) > 1 and source is started[1]:
+                        with self._lock:
+                            self.hedge_wins += 1
+                if item is _END:
+                    REGISTRY.observe("inference_stream_seconds", time.monotonic() - start,
+                                     help="Time from sending a request to the end of its stream")
+                    return
+                flight.publish(item)
+        finally:
+            # Every stream is over once the attempt gives up, the winner included,
+            # so its slot frees now rather than when a stalled upstream finally returns
+            for upstream in started:
+                upstream.cancel()
+                upstream.release()
+
+    def stats(self):
+        """Returns queue depth, streams in flight, and call, retry and hedge counters."""
+        with self._lock:
+            counters = {
+                "upstream_calls": self.upstream_calls,
+                "coalesced_calls": self.coalesced_calls,
+                "retries": self.retries,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+            }
+        return {
+            "queue_depth": self.limiter.queue_depth,
+            "in_flight": self.limiter.in_flight,
+            "limit": self.limiter.limit,
+            **counters,
+        }
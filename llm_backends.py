@@ -0,0 +1,233 @@
+"""
+Model backends used for plan generation.
+
+Every backend streams chat completions and keeps rough token accounting.
+`HuggingFaceBackend` talks to the Hugging Face Inference API; `LocalBackend`
+is an in-process stand-in that streams canned plans with configurable
+time-to-first-token and token rate, so the app can be developed, load-tested
+and benchmarked offline. Pick one with the LLM_BACKEND setting.
+"""
+import hashlib
+import random
+import threading
+import time
+
+from metrics import RATE_BUCKETS, REGISTRY
+from prompts import SECTION_MARKERS
+
+DEFAULT_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct"
+
+
+class LLMBackend:
+    """Interface for streaming chat completions with token accounting."""
+
+    name = "base"
+
+    def __init__(self):
+        self._usage_lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def _stream(self, model, messages, **params):
+        """Yields the completion's text chunks. Implemented by each backend."""
+        raise NotImplementedError
+
+    def stream_chat(self, model, messages, **params):
+        """Yields the completion's text chunks and records its token usage."""
+        prompt_tokens = sum(self.count_tokens(m["content"]) for m in messages)
+        with self._usage_lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+
+        first_token_at = None
+        completion_tokens = 0
+        for text in self._stream(model, messages, **params):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            tokens = self.count_tokens(text)
+            completion_tokens += tokens
+            with self._usage_lock:
+                self.completion_tokens += tokens
+            yield text
+
+        elapsed = time.perf_counter() - first_token_at if first_token_at else 0
+        if elapsed > 0:
+            REGISTRY.observe("llm_tokens_per_second", completion_tokens / elapsed, buckets=RATE_BUCKETS,
+                             help="Completion token throughput after the first token", backend=self.name)
+
+    def chat(self, model, messages, **params):
+        """Returns the whole completion as one string."""
+        return "".join(self.stream_chat(model, messages, **params))
+
+    def count_tokens(self, text):
+        """Approximates the token count of `text` (about four characters per token)."""
+        return max(1, len(text) // 4) if text else 0
+
+    def usage(self):
+        """Returns the request and token counters."""
+        with self._usage_lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+
+class HuggingFaceBackend(LLMBackend):
+    """Streams completions from the Hugging Face Inference API."""
+
+    name = "huggingface"
+
+    def __init__(self, token, timeout=None):
+        super().__init__()
+        from huggingface_hub import InferenceClient # type: ignore
+        self._client = InferenceClient(token=token, timeout=timeout)
+
+    def _stream(self, model, messages, **params):
+        # Use chat_completion for conversational models like Llama-3
+        chunks = self._client.chat_completion(messages, model=model, stream=True, **params)
+        try:
+            for chunk in chunks:
+                # Add a check to ensure the choices list is not empty before accessing it
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Closing the chunk iterator closes the HTTP response of a cancelled stream
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+
+
+LOCAL_WORKOUT_PLAN = """## 🏋️ Your Weekly Workout Plan
+
+Great job taking the first step! This plan fits a student schedule and builds the habit first.
+
+### Warm-up (every session)
+- Jumping jacks: 2 sets of 30 seconds
+- Arm circles: 2 sets of 15 reps
+- Bodyweight squats: 1 set of 10 reps
+
+### Day 1: Upper Body
+- Push-ups: 3 sets of 10 reps
+- Dumbbell rows: 3 sets of 12 reps
+- Shoulder press: 3 sets of 10 reps
+- Plank: 3 sets of 30 seconds
+
+### Day 2: Lower Body
+- Squats: 3 sets of 15 reps
+- Lunges: 3 sets of 10 reps
+- Glute bridges: 3 sets of 15 reps
+- Calf raises: 3 sets of 20 reps
+
+### Day 3: Full Body & Cardio
+- Burpees: 3 sets of 8 reps
+- Mountain climbers: 3 sets of 20 reps
+- Dumbbell deadlifts: 3 sets of 12 reps
+- Brisk walk or jog: 1 set of 20 minutes
+
+### Cool-down (every session)
+- Hamstring stretch: 2 sets of 30 seconds
+- Chest stretch: 2 sets of 30 seconds
+
+Stay consistent, rest well between sessions and track how you feel. You've got this! 💪
+"""
+
+LOCAL_DIET_PLAN = """## 🥗 Your 1-Day Sample Meal Plan
+
+Simple, budget-friendly meals with easy-to-find ingredients.
+
+### Breakfast
+- Oats cooked with milk or soy milk
+- 1 banana, sliced
+- A handful of peanuts
+
+### Lunch
+- Brown rice
+- Dal (lentil curry)
+- Mixed vegetable stir-fry
+- Cucumber salad
+
+### Dinner
+- 2 whole-wheat rotis
+- Chickpea curry
+- Sautéed spinach
+
+### Snack
+- Roasted chana
+- 1 apple
+
+Drink plenty of water through the day and enjoy your food! 🍽️
+"""
+
+
+class LocalBackend(LLMBackend):
+    """
+    Deterministic, in-process stand-in for a model server.
+
+    Streams a canned workout or diet plan word by word after `ttft` seconds,
+    at `tokens_per_second`. `jitter` randomly varies both by up to that
+    fraction and `failure_rate` makes that share of requests fail with a
+    retryable error before the first token.
+    """
+
+    name = "local"
+
+    def __init__(self, ttft=0.5, tokens_per_second=50.0, jitter=0.0, failure_rate=0.0, seed=None):
+        super().__init__()
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+    def _vary(self, value):
+        return value * (1 + self._random.uniform(-self.jitter, self.jitter)) if self.jitter else value
+
+    def canned_response(self, messages):
+        """Returns the plan text this backend answers `messages` with."""
+        prompt = messages[-1]["content"]
+        if all(marker in prompt for marker in SECTION_MARKERS.values()):
+            # Combined request: both plans, each under its marker line
+            plan = (f"{SECTION_MARKERS['workout']}\n{LOCAL_WORKOUT_PLAN}\n"
+                    f"{SECTION_MARKERS['diet']}\n{LOCAL_DIET_PLAN}")
+        else:
+            plan = LOCAL_DIET_PLAN if "meal plan" in prompt.lower() else LOCAL_WORKOUT_PLAN
+        # Same prompt, same answer; different prompts get a visibly different header
+        tag = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        return f"{plan}\n_Generated offline by the local backend (ref {tag})._"
+
+    def _stream(self, model, messages, **params):
+        time.sleep(max(0.0, self._vary(self.ttft)))
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise ConnectionError("Local backend: simulated upstream failure")
+
+        words = self.canned_response(messages).split(" ")
+        max_tokens = params.get("max_tokens")
+        emitted = 0
+        for i, word in enumerate(words):
+            text = word if i == 0 else " " + word
+            emitted += self.count_tokens(text)
+            if max_tokens and emitted > max_tokens:
+                return
+            if self.tokens_per_second:
+                time.sleep(self.count_tokens(text) / max(1e-6, self._vary(self.tokens_per_second)))
+            yield text
+
+
+def make_backend(settings):
+    """Builds the backend selected by the LLM_BACKEND setting from a secrets mapping."""
+    backend = settings.get("LLM_BACKEND", "huggingface")
+    if backend == "local":
+        return LocalBackend(
+            ttft=float(settings.get("LOCAL_TTFT", 0.5)),
+            tokens_per_second=float(settings.get("LOCAL_TOKENS_PER_SECOND", 50)),
+            jitter=float(settings.get("LOCAL_JITTER", 0.0)),
+            failure_rate=float(settings.get("LOCAL_FAILURE_RATE", 0.0)),
+        )
+    if backend == "huggingface":
+        return HuggingFaceBackend(
+            settings["HF_TOKEN"],
+            timeout=float(settings.get("INFERENCE_TOTAL_TIMEOUT", 120)),
+        )
+    raise ValueError(f"Unknown LLM_BACKEND: {backend!r}")
@@ -0,0 +1,245 @@
+"""
+Lightweight, dependency-free metrics.
+
+Histograms and counters live in a process-wide REGISTRY and are rendered in
+the Prometheus text format, either on the admin Metrics tab or, when
+METRICS_PORT is set, from a small HTTP endpoint. Components that already
+keep their own counters (plan cache, inference gateway, model backend)
+register a collector instead of double-counting.
+
+Optional structured JSON logs carry the submission's trace ID.
+"""
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; spans fast MongoDB calls up to slow model streams
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Tokens per second
+RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram for one label set."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """Thread-safe store of histograms and counters, keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = []
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, help="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, help)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, help="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, help)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name, help="", **labels):
+        """Observes the duration of the `with` block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, help=help, **labels)
+
+    def timed(self, name, help="", **labels):
+        """Decorator observing the duration of every call, in seconds."""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, help=help, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def register_collector(self, prefix, collect):
+        """Adds `collect()` -> {name: number}, exported as `<prefix>_<name>` gauges."""
+        with self._lock:
+            self._collectors.append((prefix, collect))
+
+    def summary(self):
+        """Returns {name: {labels: (count, mean seconds)}} for every histogram."""
+        with self._lock:
+            result = {}
+            for (name, labels), h in self._histograms.items():
+                result.setdefault(name, {})[_label_text(labels)] = (h.count, h.sum / h.count if h.count else 0.0)
+            return result
+
+    def render_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name in sorted({n for n, _ in self._histograms}):
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), h in sorted(self._histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(h.buckets, h.counts):
+                        lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {count}")
+                    lines.append(f"{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{name}_sum{_label_text(labels)} {h.sum}")
+                    lines.append(f"{name}_count{_label_text(labels)} {h.count}")
+
+            for name in sorted({n for n, _ in self._counters}):
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} counter")
+                for (n, labels), value in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{_label_text(labels)} {value}")
+            collectors = list(self._collectors)
+
+        for prefix, collect in collectors:
+            for key, value in sorted(collect().items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class InstrumentedCollection:
+    """Wraps a MongoDB collection, timing every method call as `mongo_operation_seconds`.
+
+    Calls returning a cursor (find, aggregate) are timed when the cursor is
+    first iterated, which is when the query actually runs.
+    """
+
+    def __init__(self, collection, registry=REGISTRY):
+        self._collection = collection
+        self._registry = registry
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            labels = {"collection": self._collection.name, "op": name}
+            with self._registry.timer("mongo_operation_seconds", help="MongoDB call latency", **labels):
+                result = attr(*args, **kwargs)
+            if name in ("find", "aggregate"):
+                return _TimedCursor(result, self._registry, labels)
+            return result
+
+        return timed
+
+
+class _TimedCursor:
+    """Cursor proxy that times the fetch of the first batch."""
+
+    def __init__(self, cursor, registry, labels):
+        self._cursor = cursor
+        self._registry = registry
+        self._labels = labels
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name in ("sort", "limit", "skip") and callable(attr):
+            def chained(*args, **kwargs):
+                self._cursor = attr(*args, **kwargs)
+                return self
+            return chained
+        return attr
+
+    def __iter__(self):
+        iterator = iter(self._cursor)
+        with self._registry.timer("mongo_operation_seconds", help="MongoDB call latency",
+                                  **{**self._labels, "op": self._labels["op"] + "_fetch"}):
+            try:
+                first = next(iterator)
+            except StopIteration:
+                return
+        yield first
+        yield from iterator
+
+
+def serve_metrics(port, registry=REGISTRY):
+    """Serves `GET /metrics` in the Prometheus text format on a background thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as one JSON object per line, including any trace_id."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("trace_id", "stage", "duration_ms", "tokens", "tokens_per_second"):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        return json.dumps(entry)
+
+
+def configure_json_logging(logger_name="workout_planner", level=logging.INFO):
+    """Sends the app's logs to stderr as structured JSON."""
+    logger = logging.getLogger(logger_name)
+    if not any(isinstance(h.formatter, JsonFormatter) for h in logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
@@ -0,0 +1,191 @@
+"""
+Cache for generated plans.
+
+A small in-process LRU sits in front of a dedicated MongoDB collection whose
+TTL index expires old entries. Keys are hashes of the normalized prompt
+inputs, so profiles that only differ in whitespace or letter case share a plan.
+Optionally age, weight and height are keyed by band (CACHE_AGE_BAND etc.),
+so nearby profiles share a plan too; that is what lets `warm_cache.py`
+pre-generate plans that most submissions hit.
+"""
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from pymongo.errors import PyMongoError # type: ignore
+
+from prompts import COMBINED_FIELDS, DIET_FIELDS, WORKOUT_FIELDS, prompt_inputs
+
+# Bump when prompts change in a way that should invalidate every cached plan
+CACHE_KEY_VERSION = 1
+
+
+def normalize_value(value):
+    """Trims, collapses whitespace in and lowercases free text; other values pass through."""
+    if isinstance(value, str):
+        return " ".join(value.split()).lower()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def make_cache_key(kind, model, inputs):
+    """Returns a stable fingerprint for a plan of `kind` generated by `model` from `inputs`."""
+    payload = {
+        "v": CACHE_KEY_VERSION,
+        "kind": kind,
+        "model": model,
+        "inputs": {name: normalize_value(value) for name, value in inputs.items()},
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def band_value(value, width):
+    """Returns the start of the `width`-wide band containing `value`; unbanded if `width` is falsy."""
+    if not width or value is None:
+        return value
+    return math.floor(value / width) * width
+
+
+def cache_bands(settings):
+    """Reads the band widths for numeric profile fields from a secrets mapping."""
+    bands = {
+        "age": settings.get("CACHE_AGE_BAND"),
+        "weight": settings.get("CACHE_WEIGHT_BAND"),
+        "height": settings.get("CACHE_HEIGHT_BAND"),
+    }
+    return {field: float(width) for field, width in bands.items() if width}
+
+
+def cache_inputs(profile, fields, bands=None):
+    """Returns the prompt inputs of `profile` that key its cached plan, with numeric fields banded."""
+    inputs = prompt_inputs(profile, fields)
+    for field, width in (bands or {}).items():
+        if field in inputs:
+            inputs[field] = band_value(inputs[field], width)
+    return inputs
+
+
+def plan_cache_keys(profile, model, bands=None):
+    """Returns the (workout, diet) cache keys for a profile."""
+    return (
+        make_cache_key("workout", model, cache_inputs(profile, WORKOUT_FIELDS, bands)),
+        make_cache_key("diet", model, cache_inputs(profile, DIET_FIELDS, bands)),
+    )
+
+
+def diet_day_cache_key(profile, day, days, model, bands=None):
+    """
+    Returns the cache key of one day of a `days`-day meal plan. It depends
+    only on the dietary profile, so users who share one share the day.
+    """
+    return make_cache_key("diet_day", model, {**cache_inputs(profile, DIET_FIELDS, bands), "day": day, "days": days})
+
+
+def combined_cache_key(profile, model, bands=None):
+    """Returns the cache key of a profile's combined (workout and diet) response."""
+    return make_cache_key("combined", model, cache_inputs(profile, COMBINED_FIELDS, bands))
+
+
+def make_plan_cache(settings, db, maxsize=None, wrap=None):
+    """
+    Builds the PlanCache over its MongoDB collection from a secrets mapping.
+    `maxsize` overrides CACHE_LRU_SIZE; `wrap`, if given, wraps the
+    collection (e.g. metrics.InstrumentedCollection).
+    """
+    collection = db[settings.get("CACHE_COLLECTION_NAME", "plan_cache")]
+    return PlanCache(
+        wrap(collection) if wrap else collection,
+        maxsize=maxsize or int(settings.get("CACHE_LRU_SIZE", 256)),
+        ttl_seconds=int(settings.get("CACHE_TTL_SECONDS", 7 * 24 * 3600)),
+    )
+
+
+class PlanCache:
+    """Thread-safe two-level plan cache with hit/miss counters."""
+
+    def __init__(self, collection=None, maxsize=256, ttl_seconds=7 * 24 * 3600):
+        self._collection = collection
+        self._maxsize = maxsize
+        self._ttl_seconds = ttl_seconds
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if collection is not None:
+            try:
+                collection.create_index("created_at", expireAfterSeconds=ttl_seconds)
+            except PyMongoError:
+                # An existing index with different options still expires entries
+                pass
+
+    @property
+    def collection(self):
+        """The MongoDB collection behind the in-memory LRU, or None."""
+        return self._collection
+
+    def _remember(self, key, plan, expires_at):
+        with self._lock:
+            self._lru[key] = (plan, expires_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self._maxsize:
+                self._lru.popitem(last=False)
+
+    def get(self, key):
+        """Returns the cached plan for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry and entry[1] > time.time():
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._lru.pop(key, None)
+
+        doc = None
+        if self._collection is not None:
+            try:
+                doc = self._collection.find_one({"_id": key}, {"plan": 1, "created_at": 1})
+            except PyMongoError:
+                doc = None
+
+        if not doc:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        created_at = doc["created_at"].replace(tzinfo=timezone.utc).timestamp()
+        self._remember(key, doc["plan"], created_at + self._ttl_seconds)
+        with self._lock:
+            self.hits += 1
+        return doc["plan"]
+
+    def put(self, key, plan):
+        """Stores a freshly generated plan under `key`."""
+        self._remember(key, plan, time.time() + self._ttl_seconds)
+        if self._collection is not None:
+            try:
+                self._collection.update_one(
+                    {"_id": key},
+                    {"$set": {"plan": plan, "created_at": datetime.now(timezone.utc)}},
+                    upsert=True,
+                )
+            except PyMongoError:
+                # The in-process copy still serves this process
+                pass
+
+    def stats(self):
+        """Returns the hit/miss counters and the in-process LRU size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._lru),
+            }
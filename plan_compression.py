@@ -0,0 +1,240 @@
+"""
+Transparent compression of stored plan bodies.
+
+Plan Markdown is short and very repetitive from one plan to the next, so it
+compresses best against a shared dictionary trained on earlier plans. A
+compressed body is stored as a small versioned envelope,
+
+    {"v": 1, "codec": "zlib", "dict": "<dictionary id>", "size": <raw bytes>, "data": <bytes>}
+
+while plain strings, written before compression was enabled, are returned
+as they are. A plan's structured form (see plan_schema.py) is stored the
+same way, as compact JSON. Dictionaries are kept in their own collection and never
+deleted, so every envelope can still be decoded after retraining.
+
+zlib is always available; zstd needs the optional `zstandard` package.
+"""
+import hashlib
+import json
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+
+from bson.binary import Binary # type: ignore
+from pymongo import DESCENDING # type: ignore
+
+FORMAT_VERSION = 1
+CODECS = ("zlib", "zstd")
+# Plan fields stored through the codec
+COMPRESSED_FIELDS = ("workout_plan", "diet_plan")
+# Structured plan fields, stored as JSON text through the codec
+DATA_FIELDS = ("workout_data", "diet_data")
+# Bodies shorter than this (in bytes) are not worth an envelope
+MIN_COMPRESS_SIZE = 256
+# zlib only looks back 32 KiB, so a larger preset dictionary is wasted
+ZLIB_MAX_DICTIONARY = 32 * 1024
+DEFAULT_DICTIONARY_SIZE = 16 * 1024
+
+
+def _zstandard():
+    import zstandard # type: ignore
+    return zstandard
+
+
+def dictionary_id(data):
+    """Returns the short content hash that envelopes use to name a dictionary."""
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def train_dictionary(samples, codec="zlib", size=DEFAULT_DICTIONARY_SIZE):
+    """Builds a shared dictionary of at most `size` bytes from sample plan texts."""
+    if codec == "zstd":
+        return _zstandard().train_dictionary(size, [s.encode() for s in samples]).as_bytes()
+
+    # zlib preset dictionary: recurring lines, with the most common ones last
+    # (closest to the data, so they get the shortest back-references)
+    counts = Counter(line.strip() for text in samples for line in text.splitlines())
+    common = [line for line, n in counts.most_common() if line and n > 1]
+    size = min(size, ZLIB_MAX_DICTIONARY)
+    chosen, used = [], 0
+    for line in common:
+        encoded = line.encode() + b"\n"
+        if used + len(encoded) > size:
+            break
+        chosen.append(encoded)
+        used += len(encoded)
+    return b"".join(reversed(chosen))
+
+
+class PlanCodec:
+    """
+    Encodes plan bodies for storage and decodes them back to text.
+
+    `codec` is the algorithm used for new writes ("zlib", "zstd", or None to
+    store plain text), `dictionaries` maps dictionary ids to their bytes and
+    `write_dictionary` is the id new writes use, if any. With a
+    `dictionary_store`, a body written with a dictionary trained after the
+    codec was built (e.g. by another process) reloads the dictionaries.
+    """
+
+    def __init__(self, codec=None, level=6, dictionaries=None, write_dictionary=None,
+                 min_size=MIN_COMPRESS_SIZE, dictionary_store=None):
+        if codec is not None and codec not in CODECS:
+            raise ValueError(f"Unknown plan compression codec: {codec!r}")
+        if codec == "zstd":
+            _zstandard()  # fail at startup, not on the first write
+        self.codec = codec
+        self.level = level
+        self.dictionaries = dict(dictionaries or {})
+        self.write_dictionary = write_dictionary
+        self.min_size = min_size
+        self.dictionary_store = dictionary_store
+
+    def encode(self, text):
+        """Returns the stored form of `text`: an envelope, or the text itself if it would not shrink."""
+        raw = text.encode()
+        if self.codec is None or len(raw) < self.min_size:
+            return text
+
+        zdict = self.dictionaries.get(self.write_dictionary)
+        if self.codec == "zstd":
+            zstandard = _zstandard()
+            params = {"dict_data": zstandard.ZstdCompressionDict(zdict)} if zdict else {}
+            data = zstandard.ZstdCompressor(level=self.level, **params).compress(raw)
+        else:
+            compressor = zlib.compressobj(self.level, zdict=zdict) if zdict else zlib.compressobj(self.level)
+            data = compressor.compress(raw) + compressor.flush()
+
+        if len(data) >= len(raw):
+            return text
+        return {
+            "v": FORMAT_VERSION,
+            "codec": self.codec,
+            "dict": self.write_dictionary if zdict else None,
+            "size": len(raw),
+            "data": Binary(data),
+        }
+
+    def decode(self, value):
+        """Returns the text of a stored body, whichever format it was written in."""
+        if value is None or isinstance(value, str):
+            return value
+        if value.get("v") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported plan body format version: {value.get('v')!r}")
+
+        zdict = self._dictionary(value["dict"]) if value.get("dict") else None
+
+        data = bytes(value["data"])
+        if value["codec"] == "zstd":
+            zstandard = _zstandard()
+            params = {"dict_data": zstandard.ZstdCompressionDict(zdict)} if zdict else {}
+            raw = zstandard.ZstdDecompressor(**params).decompress(data, max_output_size=value["size"])
+        elif value["codec"] == "zlib":
+            decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+            raw = decompressor.decompress(data) + decompressor.flush()
+        else:
+            raise ValueError(f"Unknown plan compression codec: {value['codec']!r}")
+        return raw.decode()
+
+    def _dictionary(self, dict_id):
+        zdict = self.dictionaries.get(dict_id)
+        if zdict is None and self.dictionary_store is not None:
+            # Dictionaries are never deleted, so reloading them only ever adds entries
+            dictionaries, _ = self.dictionary_store.load()
+            self.dictionaries = {**self.dictionaries, **dictionaries}
+            zdict = self.dictionaries.get(dict_id)
+        if zdict is None:
+            raise ValueError(f"Plan body needs unknown compression dictionary {dict_id}")
+        return zdict
+
+    def encode_data(self, data):
+        """Returns the stored form of a plan's structured data: compact JSON, compressed if that helps."""
+        return self.encode(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    def decode_data(self, value):
+        """Returns the structured data of a stored data field, whichever format it was written in."""
+        if value is None or (isinstance(value, dict) and not is_envelope(value)):
+            return value
+        return json.loads(self.decode(value))
+
+    def encode_fields(self, doc):
+        """Encodes the plan body and data fields of `doc` in place and returns it."""
+        for field in COMPRESSED_FIELDS:
+            if isinstance(doc.get(field), str):
+                doc[field] = self.encode(doc[field])
+        for field in DATA_FIELDS:
+            if isinstance(doc.get(field), dict) and not is_envelope(doc[field]):
+                doc[field] = self.encode_data(doc[field])
+        return doc
+
+    def decode_fields(self, doc):
+        """Decodes the plan body and data fields of `doc` in place and returns it."""
+        if doc:
+            for field in COMPRESSED_FIELDS:
+                if field in doc:
+                    doc[field] = self.decode(doc[field])
+            for field in DATA_FIELDS:
+                if field in doc:
+                    doc[field] = self.decode_data(doc[field])
+        return doc
+
+
+def is_envelope(value):
+    """Returns True for a compressed body envelope (as opposed to plain text or a stored document)."""
+    return isinstance(value, dict) and "codec" in value and "data" in value
+
+
+def body_sizes(value):
+    """Returns (raw bytes, stored bytes) of one stored body."""
+    if is_envelope(value):
+        return value.get("size", 0), len(value.get("data", b""))
+    if isinstance(value, dict):
+        # Structured data stored as a document, before it went through the codec
+        raw = len(json.dumps(value, separators=(",", ":"), default=str).encode())
+        return raw, raw
+    raw = len(value.encode()) if isinstance(value, str) else 0
+    return raw, raw
+
+
+class DictionaryStore:
+    """Keeps trained compression dictionaries in a MongoDB collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def load(self):
+        """Returns ({id: bytes} for every dictionary, {codec: id of its newest dictionary})."""
+        dictionaries, latest = {}, {}
+        for doc in self.collection.find({}).sort("created_at", DESCENDING):
+            dictionaries[doc["_id"]] = bytes(doc["data"])
+            latest.setdefault(doc["codec"], doc["_id"])
+        return dictionaries, latest
+
+    def save(self, codec, data, samples=0):
+        """Stores a dictionary (idempotently) and returns its id."""
+        dict_id = dictionary_id(data)
+        self.collection.update_one(
+            {"_id": dict_id},
+            {"$setOnInsert": {
+                "codec": codec,
+                "data": Binary(data),
+                "samples": samples,
+                "created_at": datetime.now(timezone.utc),
+            }},
+            upsert=True,
+        )
+        return dict_id
+
+
+def make_plan_codec(settings, dictionary_store):
+    """Builds the codec selected by the PLAN_COMPRESSION setting from a secrets mapping."""
+    codec = settings.get("PLAN_COMPRESSION", "none")
+    codec = None if codec in (None, "", "none") else codec
+    dictionaries, latest = dictionary_store.load()
+    return PlanCodec(
+        codec,
+        level=int(settings.get("PLAN_COMPRESSION_LEVEL", 3 if codec == "zstd" else 6)),
+        dictionaries=dictionaries,
+        write_dictionary=latest.get(codec),
+        dictionary_store=dictionary_store,
+    )
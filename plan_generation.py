@@ -0,0 +1,228 @@
+"""
+Plan generation without Streamlit.
+
+Builds a profile's prompts and cache keys and generates the plans through
+an InferenceGateway, serving and storing them via the plan cache. The app
+streams plans through a PlanGenerator; `batch.py` uses the same generator
+to produce finished plans for whole cohorts.
+
+A multi-day meal plan does not fit one completion, so it is requested as
+one part per day ("diet_day1", "diet_day2", ...), generated in parallel
+and cached per day, and joined into the "diet" plan once all have finished.
+"""
+from concurrent.futures import wait
+
+from inference import GenerationError, InferenceGateway, PlanResult, RateLimiter
+from plan_cache import cache_bands, combined_cache_key, diet_day_cache_key, plan_cache_keys
+from plan_schema import merge_diet_days, parse_plan
+from prompts import (
+    SYSTEM_PROMPT, WEEKDAYS, SectionSplitter, splits_completely,
+    build_combined_prompt, build_diet_day_prompt, build_diet_prompt, build_workout_prompt,
+)
+
+# Completion budget per plan
+PLAN_MAX_TOKENS = 1024
+PLAN_PARTS = ("workout", "diet")
+DIET_DAY_PREFIX = "diet_day"
+
+
+def make_gateway(settings, stream_fn, model, max_concurrent=None, rate=None):
+    """
+    Builds an InferenceGateway configured from a secrets mapping, with
+    `model` as the primary model. A `rate` starts at most that many upstream
+    requests a minute, retries and hedges included.
+    """
+    hedge_after = settings.get("HEDGE_AFTER")
+    return InferenceGateway(
+        stream_fn,
+        [model] + list(settings.get("FALLBACK_MODELS", [])),
+        max_concurrent=max_concurrent or int(settings.get("MAX_CONCURRENT_INFERENCE", 4)),
+        total_timeout=float(settings.get("INFERENCE_TOTAL_TIMEOUT", 120)),
+        first_token_timeout=float(settings.get("FIRST_TOKEN_TIMEOUT", 30)),
+        max_retries=int(settings.get("INFERENCE_MAX_RETRIES", 2)),
+        hedge_after=float(hedge_after) if hedge_after is not None else None,
+        admit=RateLimiter(rate).acquire if rate else None,
+    )
+
+
+def cache_model(settings, model):
+    """Returns the name plans from `model` are cached under, qualified by the LLM_BACKEND setting."""
+    return f"{settings.get('LLM_BACKEND', 'huggingface')}:{model}"
+
+
+def make_plan_generator(settings, gateway, cache=None):
+    """Builds a PlanGenerator over `gateway` with the cache key model, bands and mode from a secrets mapping."""
+    return PlanGenerator(
+        gateway,
+        cache=cache,
+        model=cache_model(settings, gateway.models[0]),
+        bands=cache_bands(settings),
+        mode=settings.get("GENERATION_MODE", "separate"),
+    )
+
+
+def diet_day_part(day):
+    """Returns the part name of day `day` (1-based) of a multi-day meal plan."""
+    return f"{DIET_DAY_PREFIX}{day}"
+
+
+def diet_day_title(day):
+    return f"Day {day} · {WEEKDAYS[(day - 1) % 7]}"
+
+
+def diet_days(names):
+    """Returns the sorted day numbers of the per-day diet parts among part `names`."""
+    return sorted(int(name[len(DIET_DAY_PREFIX):]) for name in names if name.startswith(DIET_DAY_PREFIX))
+
+
+def join_diet_days(results):
+    """
+    Returns {part: PlanResult} with the per-day diet parts of a multi-day
+    plan joined into one "diet" result, with day headings and the days'
+    structured form. Other parts are returned as they are.
+    """
+    days = diet_days(results)
+    if not days:
+        return results
+    joined = {name: result for name, result in results.items() if not name.startswith(DIET_DAY_PREFIX)}
+    by_day = [(day, results[diet_day_part(day)]) for day in days]
+    errors = [f"day {day}: {result.error}" for day, result in by_day if not result.ok]
+    if errors:
+        joined["diet"] = PlanResult(error="; ".join(errors))
+        return joined
+    joined["diet"] = PlanResult(
+        "\n\n".join(f"## {diet_day_title(day)}\n\n{result.text}" for day, result in by_day),
+        data=merge_diet_days([(diet_day_title(day), parse_plan("diet", result.text)) for day, result in by_day]),
+    )
+    return joined
+
+
+class PlanGenerator:
+    """
+    Generates a profile's workout and diet plans.
+
+    `model` is the cache key namespace (backend and model name), `bands`
+    the cache key bands (see plan_cache.py) and `mode` "separate" (one
+    completion per plan) or "combined" (both plans from one completion).
+    """
+
+    def __init__(self, gateway, cache=None, model="", bands=None, mode="separate", max_tokens=PLAN_MAX_TOKENS):
+        self.gateway = gateway
+        self.cache = cache
+        self.model = model
+        self.bands = bands
+        self.mode = mode
+        self.max_tokens = max_tokens
+
+    def requests(self, profile):
+        """
+        Returns ({part: (prompt, cache_key)}, combined) for a profile, where
+        `combined` is the (prompt, cache_key) of the single-call request in
+        combined mode, else None. A profile with `diet_days` above 1 gets one
+        diet part per day, and never a combined request.
+        """
+        workout_key, diet_key = plan_cache_keys(profile, self.model, self.bands)
+        parts = {"workout": (build_workout_prompt(profile), workout_key)}
+        days = int(profile.get("diet_days") or 1)
+        if days > 1:
+            for day in range(1, days + 1):
+                parts[diet_day_part(day)] = (
+                    build_diet_day_prompt(profile, day, days),
+                    diet_day_cache_key(profile, day, days, self.model, self.bands),
+                )
+            return parts, None
+
+        parts["diet"] = (build_diet_prompt(profile), diet_key)
+        combined = None
+        if self.mode == "combined":
+            combined = (build_combined_prompt(profile), combined_cache_key(profile, self.model, self.bands))
+        return parts, combined
+
+    def stream_uncached(self, prompt, max_tokens=None):
+        """
+        Yields the model's response text chunk by chunk as it is generated.
+        Failures raise GenerationError.
+        """
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+        yield from self.gateway.stream(messages, max_tokens=max_tokens or self.max_tokens, temperature=0.8)
+
+    def stream(self, prompt, cache_key=None, fresh=False, max_tokens=None, usable=None):
+        """
+        Like stream_uncached, but served from the plan cache when `cache_key` is known.
+        A `fresh` request skips the lookup and overwrites the cached plan on success.
+        A response is only cached if it is not empty and passes `usable(text)`, if given.
+        """
+        if cache_key is None or self.cache is None:
+            yield from self.stream_uncached(prompt, max_tokens)
+            return
+
+        if not fresh:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        chunks = []
+        for text in self.stream_uncached(prompt, max_tokens):
+            chunks.append(text)
+            yield text
+        text = "".join(chunks).strip()
+        if text and (usable is None or usable(text)):
+            self.cache.put(cache_key, text)
+
+    def stream_combined(self, prompt, cache_key=None, fresh=False):
+        """
+        Streams a combined request; one completion carries both plans, so it gets
+        both plans' token budget. Only a response that splits into both plans is cached.
+        """
+        yield from self.stream(prompt, cache_key, fresh, max_tokens=2 * self.max_tokens, usable=splits_completely)
+
+    def generate_plan(self, prompt, cache_key=None, fresh=False):
+        """Returns a PlanResult; a failure is reported in it rather than as plan text."""
+        try:
+            return PlanResult("".join(self.stream(prompt, cache_key, fresh)).strip())
+        except GenerationError as e:
+            return PlanResult(error=str(e))
+
+    def _generate_combined(self, prompt, cache_key, fresh):
+        """Returns {part: PlanResult} from one combined request, or None if it failed or could not be split."""
+        splitter = SectionSplitter()
+        chunks = {name: [] for name in PLAN_PARTS}
+        try:
+            for text in self.stream_combined(prompt, cache_key, fresh):
+                for name, piece in splitter.feed(text):
+                    chunks[name].append(piece)
+            for name, piece in splitter.close():
+                chunks[name].append(piece)
+        except GenerationError:
+            return None
+        if not splitter.complete:
+            return None
+        return {name: PlanResult("".join(pieces).strip()) for name, pieces in chunks.items()}
+
+    def generate(self, profile, fresh=False, executor=None):
+        """
+        Returns {"workout": PlanResult, "diet": PlanResult} for a profile,
+        each with its structured `data` parsed. The parts (every day of a
+        multi-day meal plan included) run concurrently on `executor` if one
+        is given. In combined mode a failed combined
+        request falls back to separate requests, as plan jobs do.
+        """
+        parts, combined = self.requests(profile)
+        results = self._generate_combined(*combined, fresh) if combined else None
+        if results is None:
+            if executor is None:
+                results = {name: self.generate_plan(prompt, key, fresh) for name, (prompt, key) in parts.items()}
+            else:
+                futures = {name: executor.submit(self.generate_plan, prompt, key, fresh)
+                           for name, (prompt, key) in parts.items()}
+                wait(futures.values())
+                results = {name: future.result() for name, future in futures.items()}
+        results = join_diet_days(results)
+        for name, result in results.items():
+            if result.ok and result.data is None:
+                result.data = parse_plan(name, result.text)
+        return results
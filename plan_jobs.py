@@ -0,0 +1,275 @@
+"""
+Background plan generation jobs.
+
+Submitting a profile enqueues a job on an in-process worker pool and records
+it in MongoDB. The worker streams every part of the plan, keeps the partial
+text in memory for the UI to poll, and writes the finished plan to history
+itself, so Streamlit reruns never discard in-flight work. A job whose parts
+fail is marked failed and nothing is written to history.
+
+A job can instead ask for every part in one combined completion, which is
+split into the parts as it streams; if that fails or the response cannot
+be split, the job falls back to generating the parts separately.
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from pymongo.errors import PyMongoError # type: ignore
+
+from inference import PlanResult
+from metrics import REGISTRY
+from prompts import SectionSplitter
+
+logger = logging.getLogger("workout_planner.jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Finished jobs stay in memory this long so their sessions can pick up the results
+FINISHED_JOB_RETENTION = 15 * 60
+
+
+class PlanJob:
+    """A plan generation job and its live, per-part output."""
+
+    def __init__(self, job_id, username, parts, fresh=False, goal=None, combined=None, done=None):
+        self.id = job_id
+        self.username = username
+        self.goal = goal
+        self.fresh = fresh
+        self.parts = parts  # name -> (prompt, cache_key)
+        self.combined = combined  # (prompt, cache_key) producing every part at once, or None
+        self.status = QUEUED
+        self.plan_id = None
+        self.results = None  # name -> PlanResult once every part has finished
+        self.error = None  # why the job failed: its parts' errors, or saving the plan
+        self.finished_at = None
+        self._chunks = {name: [] for name in parts}
+        self._finished = set()
+        self._errors = {}
+        self._lock = threading.Lock()
+        for name, text in (done or {}).items():
+            # Parts carried over from an earlier attempt start out finished
+            self._chunks[name] = [text]
+            self._finished.add(name)
+
+    def append(self, name, text):
+        with self._lock:
+            self._chunks[name].append(text)
+
+    def reset_part(self, name):
+        """Discards a part's output so it can be generated again."""
+        with self._lock:
+            self._chunks[name] = []
+            self._finished.discard(name)
+            self._errors.pop(name, None)
+
+    def finish_part(self, name, error=None):
+        with self._lock:
+            self._finished.add(name)
+            if error is not None:
+                self._errors[name] = error
+
+    def snapshot(self):
+        """Returns {name: (text so far, finished, error)} for every part."""
+        with self._lock:
+            return {
+                name: ("".join(chunks), name in self._finished, self._errors.get(name))
+                for name, chunks in self._chunks.items()
+            }
+
+    @property
+    def done(self):
+        return self.status in (DONE, FAILED)
+
+
+class JobManager:
+    """Runs plan jobs on a bounded worker pool and tracks them in a MongoDB collection."""
+
+    def __init__(self, collection, stream_part, part_executor, on_complete,
+                 max_workers=4, record_ttl_seconds=24 * 3600, stream_combined=None):
+        """
+        `stream_part(prompt, cache_key, fresh)` yields text chunks for one part,
+        `part_executor` runs the parts of a job concurrently, and
+        `on_complete(job, texts)` persists a successful job and returns the plan id.
+        `stream_combined` streams a combined request; it defaults to `stream_part`.
+        """
+        self._collection = collection
+        self._stream_part = stream_part
+        self._stream_combined = stream_combined or stream_part
+        self._part_executor = part_executor
+        self._on_complete = on_complete
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plan-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+        try:
+            self._collection.create_index("created_at", expireAfterSeconds=record_ttl_seconds)
+            self._collection.create_index([("user", 1), ("created_at", -1)])
+        except PyMongoError:
+            pass
+
+    def _record(self, job_id, **fields):
+        fields["updated_at"] = datetime.now(timezone.utc)
+        try:
+            self._collection.update_one({"_id": job_id}, {"$set": fields})
+        except PyMongoError:
+            # The in-memory job is authoritative for this process
+            pass
+
+    def submit(self, username, parts, fresh=False, goal=None, combined=None, done=None):
+        """
+        Enqueues a job generating every part in `parts` ({name: (prompt, cache_key)}),
+        in a single call to `combined` ((prompt, cache_key)) if one is given.
+        Parts in `done` ({name: text}) are already generated and are not run again.
+        """
+        job = PlanJob(uuid.uuid4().hex, username, parts, fresh=fresh, goal=goal, combined=combined, done=done)
+        now = datetime.now(timezone.utc)
+        try:
+            self._collection.insert_one({
+                "_id": job.id,
+                "user": username,
+                "goal": goal,
+                "status": QUEUED,
+                "created_at": now,
+                "updated_at": now,
+            })
+        except PyMongoError:
+            pass
+
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        logger.info("Plan job submitted", extra={"trace_id": job.id, "stage": QUEUED})
+        return job.id
+
+    def resubmit(self, job_id):
+        """
+        Enqueues a copy of a live job to retry it, keeping its `fresh` setting
+        and the parts that already succeeded, so only the failed parts run
+        again. Returns the new id or None.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        done = {name: text for name, (text, finished, error) in job.snapshot().items()
+                if finished and error is None}
+        return self.submit(job.username, job.parts, fresh=job.fresh, goal=job.goal,
+                           combined=None if done else job.combined, done=done)
+
+    def get(self, job_id):
+        """Returns the live job, or its stored record if it ran in another process."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        try:
+            return self._collection.find_one({"_id": job_id})
+        except PyMongoError:
+            return None
+
+    def _prune(self):
+        cutoff = time.time() - FINISHED_JOB_RETENTION
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def _run_part(self, job, name):
+        prompt, cache_key = job.parts[name]
+        start = time.perf_counter()
+        first_chunk_at = None
+        error = None
+        try:
+            for text in self._stream_part(prompt, cache_key, job.fresh):
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                    REGISTRY.observe("plan_part_first_chunk_seconds", first_chunk_at - start,
+                                     help="Time from a plan part starting to its first text", part=name)
+                job.append(name, text)
+        except Exception as e:
+            error = str(e)
+        job.finish_part(name, error=error)
+
+        duration = time.perf_counter() - start
+        REGISTRY.observe("plan_part_seconds", duration, help="Time to generate one plan part",
+                         part=name, outcome="error" if error else "ok")
+        logger.info(
+            "Plan part finished" if error is None else f"Plan part failed: {error}",
+            extra={"trace_id": job.id, "stage": name, "duration_ms": round(duration * 1000)},
+        )
+
+    def _run_combined(self, job):
+        """Streams every part from one combined request. Returns False, with the parts reset, if that failed."""
+        prompt, cache_key = job.combined
+        splitter = SectionSplitter()
+        start = time.perf_counter()
+        error = None
+        try:
+            for text in self._stream_combined(prompt, cache_key, job.fresh):
+                for name, piece in splitter.feed(text):
+                    job.append(name, piece)
+            for name, piece in splitter.close():
+                job.append(name, piece)
+            if not splitter.complete:
+                missing = [name for name, seen in splitter.seen.items() if not seen]
+                error = f"could not split the response (missing {', '.join(missing)})"
+        except Exception as e:
+            error = str(e)
+
+        duration = time.perf_counter() - start
+        REGISTRY.observe("plan_part_seconds", duration, help="Time to generate one plan part",
+                         part="combined", outcome="error" if error else "ok")
+        if error is None:
+            for name in job.parts:
+                job.finish_part(name)
+            return True
+
+        REGISTRY.inc("plan_combined_fallbacks", help="Combined requests retried as separate calls")
+        logger.info(f"Combined generation failed, falling back to separate calls: {error}",
+                    extra={"trace_id": job.id, "stage": "combined", "duration_ms": round(duration * 1000)})
+        for name in job.parts:
+            job.reset_part(name)
+        return False
+
+    def _run(self, job):
+        start = time.perf_counter()
+        job.status = RUNNING
+        self._record(job.id, status=RUNNING)
+
+        if job.combined is None or not self._run_combined(job):
+            pending = [name for name, (_, finished, _) in job.snapshot().items() if not finished]
+            futures = [self._part_executor.submit(self._run_part, job, name) for name in pending]
+            wait(futures)
+
+        job.results = {
+            name: PlanResult(text.strip(), error)
+            for name, (text, _, error) in job.snapshot().items()
+        }
+        errors = [result.error for result in job.results.values() if not result.ok]
+
+        try:
+            if errors:
+                raise RuntimeError("; ".join(errors))
+            texts = {name: result.text for name, result in job.results.items()}
+            job.plan_id = self._on_complete(job, texts)
+            job.status = DONE
+            self._record(job.id, status=DONE, plan_id=job.plan_id)
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+            self._record(job.id, status=FAILED, error=job.error)
+        job.finished_at = time.time()
+
+        duration = time.perf_counter() - start
+        REGISTRY.observe("plan_job_seconds", duration, help="Time from a job starting to its plan being saved",
+                         outcome=job.status)
+        logger.info(f"Plan job {job.status}", extra={
+            "trace_id": job.id, "stage": job.status, "duration_ms": round(duration * 1000),
+        })
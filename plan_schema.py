@@ -0,0 +1,306 @@
+"""
+Structured form of generated plans.
+
+The model answers in free Markdown. When a plan finishes it is parsed once
+into plain, JSON-friendly data, stored next to the Markdown and rendered
+from there:
+
+    workout: {"v": 1, "title", "intro": [..], "notes": [..],
+              "sections": [{"kind": "day" | "warmup" | "cooldown" | "other",
+                            "title", "day", "notes": [..], "footer": [..],
+                            "exercises": [{"name", "sets", "reps", "unit", "detail",
+                                           "notes": [..]}]}]}
+    diet:    {"v": 1, "title", "intro": [..], "notes": [..],
+              "meals": [{"name", "notes": [..], "items": [{"text", "calories"}],
+                         "day": <day title, multi-day plans only>}]}
+
+Parsing is line-based and forgiving; when the output has no recognisable
+structure (no workout day with exercises, no meal with items) the parser
+returns None and the plan is shown as the original Markdown. Rendering keeps
+everything the model wrote: the rest of an exercise line beyond its sets and
+reps, nested tips and prose between sections stay where they were.
+"""
+import re
+
+SCHEMA_VERSION = 1
+
+_HEADING_RE = re.compile(r"^\s*#{1,6}\s*(.+?)\s*#*\s*$")
+_BOLD_LINE_RE = re.compile(r"^\s*(?:\*\*|__)(.+?)(?:\*\*|__)\s*:?\s*$")
+_BULLET_RE = re.compile(r"^(\s*)(?:[-*+•]|\d+[.)])\s+(.*)$")
+# A bullet that comments on the exercise above it rather than naming one
+_TIP_RE = re.compile(r"^\W*(?:tips?|notes?|form|cues?)\b\s*:", re.I)
+_MARKUP_RE = re.compile(r"[*_`]+")
+_DAY_RE = re.compile(r"\bday\s*(\d+)\b|\b(monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b", re.I)
+_WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+_WARMUP_RE = re.compile(r"warm[\s-]?up", re.I)
+_COOLDOWN_RE = re.compile(r"cool[\s-]?down|stretch", re.I)
+_SETS_RE = re.compile(
+    r"(\d+)\s*(?:sets?\s*(?:of|x|×)?|x|×)\s*(\d+(?:\s*[-–]\s*\d+)?)\s*"
+    r"(reps?|repetitions|seconds?|secs?|minutes?|mins?)?",
+    re.I,
+)
+_AMOUNT_RE = re.compile(r"(\d+(?:\s*[-–]\s*\d+)?)\s*(reps?|repetitions|seconds?|secs?|minutes?|mins?)\b", re.I)
+_MEAL_RE = re.compile(r"breakfast|brunch|lunch|dinner|supper|snack|pre[\s-]?workout|post[\s-]?workout", re.I)
+_INLINE_MEAL_RE = re.compile(r"^([^:]{2,40}?)\s*:\s*(.*)$")
+_CALORIES_RE = re.compile(r"(\d{2,4})\s*(?:kcal|calories|cal)\b", re.I)
+
+
+def _clean(text):
+    return _MARKUP_RE.sub("", text).strip().rstrip(":").strip()
+
+
+def _unit(word):
+    word = (word or "").lower()
+    if word.startswith("sec"):
+        return "seconds"
+    if word.startswith("min"):
+        return "minutes"
+    return "reps"
+
+
+def _heading(line):
+    """Returns the text of a Markdown heading or a line that is entirely bold, else None."""
+    match = _HEADING_RE.match(line) or _BOLD_LINE_RE.match(line)
+    return _clean(match.group(1)) if match else None
+
+
+def parse_exercise(text):
+    """Parses one exercise line, e.g. "Push-ups: 3 sets of 10 reps" or "Squats - 3x12"."""
+    text = _clean(text)
+    name, detail = text, ""
+    for separator in (":", " - ", " – ", " — ", "("):
+        if separator in text:
+            name, detail = text.split(separator, 1)
+            detail = detail.rstrip(")") if separator == "(" else detail
+            break
+    name, detail = name.strip(), detail.strip()
+
+    exercise = {"name": name, "sets": None, "reps": None, "unit": None, "detail": detail, "notes": []}
+    match = _SETS_RE.search(detail or text)
+    if match:
+        exercise["sets"] = int(match.group(1))
+        exercise["reps"] = re.sub(r"\s+", "", match.group(2)).replace("–", "-")
+        exercise["unit"] = _unit(match.group(3))
+    else:
+        match = _AMOUNT_RE.search(detail or text)
+        if match:
+            exercise["reps"] = re.sub(r"\s+", "", match.group(1)).replace("–", "-")
+            exercise["unit"] = _unit(match.group(2))
+    return exercise
+
+
+def _section_for(title):
+    match = _DAY_RE.search(title)
+    if match:
+        day = int(match.group(1)) if match.group(1) else _WEEKDAYS.index(match.group(2).lower()) + 1
+        return {"kind": "day", "title": title, "day": day, "exercises": [], "notes": [], "footer": []}
+    if _WARMUP_RE.search(title):
+        kind = "warmup"
+    elif _COOLDOWN_RE.search(title):
+        kind = "cooldown"
+    else:
+        kind = "other"
+    return {"kind": kind, "title": title, "day": None, "exercises": [], "notes": [], "footer": []}
+
+
+def parse_workout(markdown):
+    """Returns the structured form of a workout plan, or None if it has no recognisable days."""
+    if not markdown:
+        return None
+    plan = {"v": SCHEMA_VERSION, "title": None, "intro": [], "sections": [], "notes": []}
+    section = None
+    for line in markdown.splitlines():
+        if not line.strip():
+            continue
+        heading = _heading(line)
+        if heading is not None:
+            if plan["title"] is None and section is None and not _DAY_RE.search(heading) \
+                    and not _WARMUP_RE.search(heading):
+                plan["title"] = heading
+                continue
+            section = _section_for(heading)
+            plan["sections"].append(section)
+            continue
+
+        bullet = _BULLET_RE.match(line)
+        if bullet and section is not None:
+            exercises = section["exercises"]
+            if exercises and (bullet.group(1) or _TIP_RE.match(bullet.group(2))):
+                # An indented bullet or a tip belongs to the exercise above it
+                exercises[-1]["notes"].append(_clean(bullet.group(2)))
+            else:
+                exercises.append(parse_exercise(bullet.group(2)))
+        elif section is None:
+            plan["intro"].append(line.strip())
+        elif section["exercises"] and section["kind"] != "other":
+            section["footer"].append(line.strip())
+        else:
+            section["notes"].append(line.strip())
+
+    if not any(s["kind"] == "day" and s["exercises"] for s in plan["sections"]):
+        return None
+    # Prose after the last section's exercises closes the whole plan
+    last = plan["sections"][-1]
+    plan["notes"], last["footer"] = last["footer"], []
+    return plan
+
+
+def _meal(name):
+    return {"name": name, "items": [], "notes": []}
+
+
+def _item(text):
+    text = _clean(text)
+    calories = _CALORIES_RE.search(text)
+    return {"text": text, "calories": int(calories.group(1)) if calories else None}
+
+
+def parse_diet(markdown):
+    """Returns the structured form of a meal plan, or None if it has no recognisable meals."""
+    if not markdown:
+        return None
+    plan = {"v": SCHEMA_VERSION, "title": None, "intro": [], "meals": [], "notes": []}
+    meal = None
+    for line in markdown.splitlines():
+        if not line.strip():
+            continue
+        heading = _heading(line)
+        if heading is not None:
+            if _MEAL_RE.search(heading):
+                meal = _meal(heading)
+                plan["meals"].append(meal)
+            elif plan["title"] is None and meal is None:
+                plan["title"] = heading
+            else:
+                meal = None  # e.g. a "Tips" section: its lines are notes
+            continue
+
+        bullet = _BULLET_RE.match(line)
+        text = bullet.group(2) if bullet else line
+        inline = _INLINE_MEAL_RE.match(_MARKUP_RE.sub("", text).strip())
+        if inline and _MEAL_RE.search(inline.group(1)):
+            # "**Breakfast:** Oats with banana" on one line
+            meal = _meal(inline.group(1).strip())
+            plan["meals"].append(meal)
+            if inline.group(2).strip():
+                meal["items"].append(_item(inline.group(2)))
+        elif bullet and meal is not None:
+            meal["items"].append(_item(text))
+        elif meal is None:
+            (plan["notes"] if plan["meals"] else plan["intro"]).append(line.strip())
+        elif meal["items"]:
+            plan["notes"].append(line.strip())
+            meal = None
+        else:
+            meal["notes"].append(line.strip())
+
+    if not any(m["items"] for m in plan["meals"]):
+        return None
+    return plan
+
+
+def merge_diet_days(days):
+    """
+    Joins parsed single-day meal plans, [(day title, plan)], into one plan
+    whose meals carry their day. Returns None unless every day parsed.
+    """
+    if not days or not all(plan for _, plan in days):
+        return None
+    merged = {"v": SCHEMA_VERSION, "title": None, "intro": [], "meals": [], "notes": []}
+    for title, plan in days:
+        merged["meals"] += [{**meal, "day": title} for meal in plan["meals"]]
+        # Days often close with the same tips; keep each once
+        merged["notes"] += [line for line in plan["intro"] + plan["notes"] if line not in merged["notes"]]
+    return merged
+
+
+def _amount(exercise):
+    if exercise["reps"] is None:
+        return exercise["detail"] or "—"
+    if exercise["unit"] == "reps":
+        return exercise["reps"]
+    return f"{exercise['reps']} {exercise['unit']}"
+
+
+def _remark(exercise):
+    """Returns what the exercise line says beyond its sets and reps, e.g. "per leg", plus its tips."""
+    notes = list(exercise.get("notes", []))
+    detail = exercise["detail"]
+    if exercise["reps"] is not None and detail:
+        match = _SETS_RE.search(detail) if exercise["sets"] is not None else _AMOUNT_RE.search(detail)
+        if match:
+            rest = (detail[:match.start()] + " " + detail[match.end():]).strip(" ,;.-–—")
+            if rest.startswith("(") and rest.endswith(")") and rest.count("(") == 1:
+                rest = rest[1:-1].strip()
+            if rest:
+                notes.insert(0, rest)
+    return "; ".join(notes).replace("|", "/")
+
+
+def workout_to_markdown(plan):
+    """Renders a structured workout plan, with one table of exercises per section."""
+    lines = []
+    if plan.get("title"):
+        lines += [f"## {plan['title']}", ""]
+    lines += [*plan["intro"], ""] if plan["intro"] else []
+    for section in plan["sections"]:
+        lines += [f"### {section['title']}", ""]
+        lines += [*section["notes"], ""] if section["notes"] else []
+        if section["exercises"]:
+            remarks = [_remark(exercise) for exercise in section["exercises"]]
+            if any(remarks):
+                lines += ["| Exercise | Sets | Reps / time | Notes |", "|---|---|---|---|"]
+            else:
+                lines += ["| Exercise | Sets | Reps / time |", "|---|---|---|"]
+            for exercise, remark in zip(section["exercises"], remarks):
+                sets = exercise["sets"] if exercise["sets"] is not None else "—"
+                row = f"| {exercise['name']} | {sets} | {_amount(exercise)} |"
+                lines.append(f"{row} {remark} |" if any(remarks) else row)
+            lines.append("")
+        lines += [*section.get("footer", []), ""] if section.get("footer") else []
+    lines += plan["notes"]
+    return "\n".join(lines).strip()
+
+
+def diet_to_markdown(plan):
+    """Renders a structured meal plan, with calorie totals where the model gave them."""
+    lines = []
+    if plan.get("title"):
+        lines += [f"## {plan['title']}", ""]
+    lines += [*plan["intro"], ""] if plan["intro"] else []
+    day = None
+    for meal in plan["meals"]:
+        if meal.get("day") and meal["day"] != day:
+            day = meal["day"]
+            lines += [f"## {day}", ""]
+        calories = [item["calories"] for item in meal["items"] if item["calories"]]
+        # A heading like "Breakfast (approx. 400 calories)" already states the meal's total
+        total = f" _(≈ {sum(calories)} kcal)_" if calories and not _CALORIES_RE.search(meal["name"]) else ""
+        lines += [f"### {meal['name']}{total}", ""]
+        lines += [*meal["notes"], ""] if meal["notes"] else []
+        lines += [f"- {item['text']}" for item in meal["items"]]
+        lines.append("")
+    lines += plan["notes"]
+    return "\n".join(lines).strip()
+
+
+PARSERS = {"workout": parse_workout, "diet": parse_diet}
+RENDERERS = {"workout": workout_to_markdown, "diet": diet_to_markdown}
+
+
+def parse_plan(kind, markdown):
+    """Parses a "workout" or "diet" plan; never raises, returning None when parsing fails."""
+    try:
+        return PARSERS[kind](markdown)
+    except Exception:
+        return None
+
+
+def render_plan(kind, markdown, data=None):
+    """Returns the Markdown to show for a plan: rendered from `data` if it is usable, else the original."""
+    if data and data.get("v") == SCHEMA_VERSION:
+        try:
+            return RENDERERS[kind](data)
+        except Exception:
+            pass
+    return markdown or ""
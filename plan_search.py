@@ -0,0 +1,207 @@
+"""
+Full-text search over a user's plan history.
+
+Every plan is stored with `search_lines`: the distinct headings, exercise
+names and meal items of both plans, without sets, reps, details or prose,
+so the field stays a fraction of the plan's size. A MongoDB text index over those
+lines, the goal and the summary (prefixed by `user`, so every search is
+scoped to one user's plans) ranks matches, and result snippets are cut
+from the matching lines, so plan bodies, which may be compressed, are
+never loaded.
+
+MongoDB stand-ins without `$text` support (mongomock) get an in-memory
+inverted index per user instead, built from the same fields and ranked
+with TF-IDF over the same field weights.
+"""
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from pymongo import ASCENDING, DESCENDING # type: ignore
+from pymongo.errors import OperationFailure # type: ignore
+
+SEARCH_PAGE_SIZE = 10
+SNIPPETS_PER_RESULT = 3
+MAX_SEARCH_LINES = 60
+# Longer list items are cut at a word boundary
+MAX_SEARCH_LINE_LENGTH = 48
+SEARCH_FIELDS = ("date", "goal", "summary", "search_lines")
+# Relative importance of a match in each field, for both backends
+FIELD_WEIGHTS = {"goal": 5, "summary": 3, "search_lines": 1}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_LINE_RE = re.compile(r"^\s*(?:#{1,6}\s*|[-*+•]\s+|\d+[.)]\s+)")
+_MARKUP_RE = re.compile(r"[*_`|]+")
+# Where an item's name ends and its amount or detail begins: "Push-ups: 3x10", "Oats (300 kcal)"
+_DETAIL_RE = re.compile(r"\s*(?::|\(|\s[-–—]\s)")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from in into is it of on or the this to with your you".split()
+)
+
+
+def stem(word):
+    """Crude suffix stripping so "routines"/"routine" and "squatting"/"squat" match."""
+    for suffix in ("ing", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text):
+    """Returns the stemmed, lowercased search terms of `text`."""
+    return [stem(w) for w in _WORD_RE.findall((text or "").lower()) if w not in _STOPWORDS]
+
+
+def _search_line(line):
+    heading = line.lstrip().startswith("#")
+    line = _MARKUP_RE.sub("", _LINE_RE.sub("", line)).strip(" :")
+    if not heading:
+        line = _DETAIL_RE.split(line, 1)[0].strip()
+    if len(line) > MAX_SEARCH_LINE_LENGTH:
+        line = line[:MAX_SEARCH_LINE_LENGTH].rsplit(" ", 1)[0]
+    return line
+
+
+def search_lines(*plans):
+    """Returns the distinct headings, exercise names and meal items of Markdown plans: what a search matches on."""
+    lines, seen = [], set()
+    for plan in plans:
+        for line in (plan or "").splitlines():
+            if not _LINE_RE.match(line):
+                continue
+            line = _search_line(line)
+            if len(line) > 2 and line.lower() not in seen:
+                seen.add(line.lower())
+                lines.append(line)
+    return lines[:MAX_SEARCH_LINES]
+
+
+def highlight(line, terms):
+    """Returns `line` with the words matching any of `terms` in bold."""
+    def bold(match):
+        return f"**{match.group(0)}**" if stem(match.group(0).lower()) in terms else match.group(0)
+    return re.sub(r"[A-Za-z0-9]+", bold, line)
+
+
+def snippets(doc, terms, limit=SNIPPETS_PER_RESULT):
+    """Returns up to `limit` highlighted lines of a result that contain a query term."""
+    found = []
+    for line in doc.get("search_lines") or []:
+        if terms & set(tokenize(line)):
+            found.append(highlight(line, terms))
+            if len(found) == limit:
+                break
+    return found
+
+
+class _UserIndex:
+    """Inverted index of one user's plans: term -> {plan id: weighted term frequency}."""
+
+    def __init__(self, docs):
+        self.docs = {doc["_id"]: doc for doc in docs}
+        self.postings = defaultdict(dict)
+        for doc in docs:
+            counts = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                value = doc.get(field)
+                texts = value if isinstance(value, list) else [value or ""]
+                for text in texts:
+                    for term in tokenize(text):
+                        counts[term] += weight
+            for term, count in counts.items():
+                self.postings[term][doc["_id"]] = count
+
+    def search(self, terms):
+        """Returns [(score, doc)] of plans matching any term, best first."""
+        scores = Counter()
+        total = len(self.docs)
+        for term in terms:
+            postings = self.postings.get(term, {})
+            if not postings:
+                continue
+            idf = math.log(1 + total / len(postings))
+            for plan_id, count in postings.items():
+                scores[plan_id] += (1 + math.log(count)) * idf
+        # Best score first; newest first among equal scores
+        ranked = sorted(scores.items(), key=lambda item: self.docs[item[0]]["date"], reverse=True)
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return [(score, self.docs[plan_id]) for plan_id, score in ranked]
+
+
+class PlanSearch:
+    """Searches the plans collection, with a text index or the in-memory fallback."""
+
+    def __init__(self, collection, use_text_index=None):
+        """`use_text_index` None detects whether the server supports `$text` on the first search."""
+        self.collection = collection
+        self._indexes = {}  # username -> (plan count when built, _UserIndex)
+        self._lock = threading.Lock()
+        try:
+            self.collection.create_index(
+                [("user", ASCENDING), ("search_lines", "text"), ("summary", "text"), ("goal", "text")],
+                weights=FIELD_WEIGHTS,
+                name="plan_search",
+            )
+        except OperationFailure:
+            # e.g. an existing text index with other options; `$text` may still work
+            pass
+        self.use_text_index = use_text_index
+
+    def search(self, username, query, page=0, page_size=SEARCH_PAGE_SIZE):
+        """
+        Returns (results, has_more) for one page of `username`'s plans matching
+        `query`, best first. Each result has _id, date, goal, summary, score
+        and highlighted `snippets`.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return [], False
+        docs = None
+        if self.use_text_index is not False:
+            try:
+                docs = self._search_text_index(username, query, page * page_size, page_size + 1)
+                if docs:
+                    # Some stand-ins only fail once a document reaches the `$text` filter
+                    self.use_text_index = True
+            except (NotImplementedError, OperationFailure):
+                if self.use_text_index:
+                    raise
+                # No `$text` support (or no text index): use the in-memory index from now on
+                self.use_text_index = False
+        if docs is None:
+            docs = self._search_fallback(username, terms, page * page_size, page_size + 1)
+
+        results = []
+        for doc in docs[:page_size]:
+            doc["snippets"] = snippets(doc, terms)
+            doc.pop("search_lines", None)
+            results.append(doc)
+        return results, len(docs) > page_size
+
+    def _search_text_index(self, username, query, skip, limit):
+        projection = {field: 1 for field in SEARCH_FIELDS}
+        projection["score"] = {"$meta": "textScore"}
+        return list(
+            self.collection.find({"user": username, "$text": {"$search": query}}, projection)
+            .sort([("score", {"$meta": "textScore"}), ("date", DESCENDING)])
+            .skip(skip)
+            .limit(limit)
+        )
+
+    def _user_index(self, username):
+        # Rebuilt when the user's plan count changes, i.e. after a plan is added
+        count = self.collection.count_documents({"user": username})
+        with self._lock:
+            cached = self._indexes.get(username)
+        if cached is not None and cached[0] == count:
+            return cached[1]
+        docs = list(self.collection.find({"user": username}, {field: 1 for field in SEARCH_FIELDS}))
+        index = _UserIndex(docs)
+        with self._lock:
+            self._indexes[username] = (count, index)
+        return index
+
+    def _search_fallback(self, username, terms, skip, limit):
+        ranked = self._user_index(username).search(terms)
+        return [{**doc, "score": score} for score, doc in ranked[skip:skip + limit]]
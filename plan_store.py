@@ -0,0 +1,284 @@
+"""
+Storage for generated plans.
+
+Each plan is its own document in a `plans` collection indexed on
+(user, date), instead of an ever-growing `history` array embedded in the
+user document. Listings use projections and cursor-based pagination so a
+page never pulls more than it shows.
+
+Plan bodies and their structured data go through a PlanCodec, which can
+compress them transparently (see plan_compression.py).
+
+Run `python plan_store.py migrate` once to move existing embedded histories,
+`python plan_store.py train-dictionary` to train a compression dictionary
+on stored plans, `python plan_store.py stats` to see how well they compress
+and `python plan_store.py index-search` to make older plans searchable.
+"""
+import argparse
+import re
+from datetime import datetime
+
+from bson import ObjectId # type: ignore
+from pymongo import ASCENDING, DESCENDING, MongoClient, UpdateOne # type: ignore
+from pymongo.errors import BulkWriteError # type: ignore
+
+from plan_compression import (COMPRESSED_FIELDS, DATA_FIELDS, DictionaryStore, PlanCodec, body_sizes,
+                               is_envelope, make_plan_codec, train_dictionary)
+from plan_search import search_lines
+from settings import load_secrets
+
+HISTORY_PAGE_SIZE = 10
+SUMMARY_LENGTH = 120
+# Embedded history stored dates as strings in this format; it is still used for display
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+DUPLICATE_KEY_ERROR = 11000
+# Fields loaded when a plan is opened: the Markdown and its structured form (see plan_schema.py)
+BODY_FIELDS = ("workout_plan", "diet_plan", "workout_data", "diet_data")
+
+
+def summarize_plan(text, length=SUMMARY_LENGTH):
+    """Returns the first line of prose in a Markdown plan, stripped of markup and shortened."""
+    for line in text.splitlines():
+        line = re.sub(r"[#*_`>|]+", "", line).strip(" -:")
+        if len(line) > 20:
+            return line if len(line) <= length else line[:length - 1].rstrip() + "…"
+    return ""
+
+
+class PlanStore:
+    """Reads and writes plan documents for a single MongoDB collection."""
+
+    def __init__(self, collection, codec=None):
+        self.collection = collection
+        self.codec = codec or PlanCodec()
+        self.collection.create_index(
+            [("user", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]
+        )
+
+    def new_plan(self, username, workout_plan, diet_plan, goal=None, date=None, workout_data=None, diet_data=None,
+                 plan_id=None):
+        """Returns the document to store for a plan, with its id (new, unless `plan_id` is given) assigned up front."""
+        return self.codec.encode_fields({
+            "_id": plan_id or ObjectId(),
+            "user": username,
+            "date": date or datetime.now(),
+            "goal": goal,
+            "summary": summarize_plan(workout_plan),
+            "workout_plan": workout_plan,
+            "diet_plan": diet_plan,
+            "workout_data": workout_data,
+            "diet_data": diet_data,
+            "search_lines": search_lines(workout_plan, diet_plan),
+        })
+
+    def add_plan(self, username, workout_plan, diet_plan, goal=None, date=None, workout_data=None, diet_data=None):
+        """Stores a plan, along with the metadata used by listings, and returns its id."""
+        doc = self.new_plan(username, workout_plan, diet_plan, goal=goal, date=date,
+                            workout_data=workout_data, diet_data=diet_data)
+        self.collection.insert_one(doc)
+        return doc["_id"]
+
+    def write_plans(self, docs):
+        """Stores documents from `new_plan` in one bulk insert. Writing a plan twice is harmless."""
+        if not docs:
+            return 0
+        try:
+            self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Plans already stored by an earlier, partly failed attempt keep their ids
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+        return len(docs)
+
+    def list_plans(self, username, cursor=None, limit=HISTORY_PAGE_SIZE, fields=("date", "goal", "summary")):
+        """
+        Returns (plans, next_cursor) for one page of a user's plans, newest first.
+        `cursor` is the value returned for the previous page; only `fields` are loaded.
+        """
+        query = {"user": username}
+        if cursor is not None:
+            date, plan_id = cursor
+            query["$or"] = [
+                {"date": {"$lt": date}},
+                {"date": date, "_id": {"$lt": plan_id}},
+            ]
+
+        projection = {field: 1 for field in fields}
+        docs = list(
+            self.collection.find(query, projection)
+            .sort([("date", DESCENDING), ("_id", DESCENDING)])
+            .limit(limit + 1)
+        )
+
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = (docs[-1]["date"], docs[-1]["_id"])
+        return docs, next_cursor
+
+    def get_plan(self, username, plan_id, fields=BODY_FIELDS):
+        """Returns a single plan owned by `username`, or None."""
+        return self.codec.decode_fields(self.collection.find_one(
+            {"_id": plan_id, "user": username}, {field: 1 for field in fields}
+        ))
+
+    def import_history(self, username, history):
+        """Copies embedded history entries into the plans collection. Safe to re-run."""
+        operations = []
+        for entry in history:
+            date = entry.get("date")
+            if isinstance(date, str):
+                date = datetime.strptime(date, DATE_FORMAT)
+            workout_plan = entry.get("workout_plan", "")
+            doc = {
+                "user": username,
+                "date": date,
+                "goal": None,
+                "summary": summarize_plan(workout_plan),
+                "workout_plan": workout_plan,
+                "diet_plan": entry.get("diet_plan", ""),
+                "search_lines": search_lines(workout_plan, entry.get("diet_plan", "")),
+            }
+            operations.append(UpdateOne(
+                {"user": username, "date": date}, {"$setOnInsert": self.codec.encode_fields(doc)}, upsert=True
+            ))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    def backfill_search_lines(self):
+        """
+        Stores `search_lines` on plans saved before search existed, and
+        shortens those indexed by an earlier version. Returns how many were updated.
+        """
+        updated = 0
+        docs = self.collection.find({}, {field: 1 for field in (*COMPRESSED_FIELDS, "search_lines")})
+        for doc in docs:
+            self.codec.decode_fields(doc)
+            lines = search_lines(doc.get("workout_plan"), doc.get("diet_plan"))
+            if doc.get("search_lines") != lines:
+                self.collection.update_one({"_id": doc["_id"]}, {"$set": {"search_lines": lines}})
+                updated += 1
+        return updated
+
+    def sample_bodies(self, limit=500):
+        """Returns the text of up to `limit` recent plan bodies, e.g. to train a dictionary."""
+        docs = self.collection.find({}, {field: 1 for field in COMPRESSED_FIELDS})
+        texts = []
+        for doc in docs.sort("date", DESCENDING).limit(limit):
+            self.codec.decode_fields(doc)
+            texts.extend(doc[field] for field in COMPRESSED_FIELDS if doc.get(field))
+        return texts
+
+    def compression_stats(self):
+        """
+        Returns counts and raw vs. stored sizes of every plan body and data
+        field, overall, per codec and per field. `by_field` also reports the
+        size of the (never compressed) `search_lines`.
+        """
+        fields = COMPRESSED_FIELDS + DATA_FIELDS
+        stats = {"plans": 0, "bodies": 0, "raw_bytes": 0, "stored_bytes": 0, "by_codec": {}, "by_field": {}}
+        for doc in self.collection.find({}, {field: 1 for field in (*fields, "search_lines")}):
+            stats["plans"] += 1
+            if doc.get("search_lines"):
+                size = sum(len(line.encode()) for line in doc["search_lines"])
+                entry = stats["by_field"].setdefault("search_lines", {"bodies": 0, "raw_bytes": 0, "stored_bytes": 0})
+                entry["bodies"] += 1
+                entry["raw_bytes"] += size
+                entry["stored_bytes"] += size
+            for field in fields:
+                if doc.get(field) is None:
+                    continue
+                value = doc[field]
+                raw, stored = body_sizes(value)
+                codec = value.get("codec", "?") if is_envelope(value) else "plain"
+                entries = (
+                    stats["by_codec"].setdefault(codec, {"bodies": 0, "raw_bytes": 0, "stored_bytes": 0}),
+                    stats["by_field"].setdefault(field, {"bodies": 0, "raw_bytes": 0, "stored_bytes": 0}),
+                )
+                for target in (stats, *entries):
+                    target["bodies"] += 1
+                    target["raw_bytes"] += raw
+                    target["stored_bytes"] += stored
+        stats["ratio"] = stats["raw_bytes"] / stats["stored_bytes"] if stats["stored_bytes"] else 1.0
+        return stats
+
+
+def make_plan_store(settings, db, wrap=None):
+    """
+    Builds the PlanStore, with its compression codec and dictionaries, from
+    a secrets mapping. `wrap`, if given, wraps the plans collection (e.g.
+    metrics.InstrumentedCollection).
+    """
+    dictionary_store = DictionaryStore(db[settings.get("DICTIONARIES_COLLECTION_NAME", "plan_dictionaries")])
+    collection = db[settings.get("PLANS_COLLECTION_NAME", "plans")]
+    return PlanStore(wrap(collection) if wrap else collection, codec=make_plan_codec(settings, dictionary_store))
+
+
+def migrate_user_history(users_collection, plan_store, username):
+    """Moves one user's embedded `history` array, if any, into the plans collection."""
+    user_data = users_collection.find_one(
+        {"_id": username, "history.0": {"$exists": True}}, {"history": 1}
+    )
+    if not user_data:
+        return 0
+
+    moved = plan_store.import_history(username, user_data["history"])
+    users_collection.update_one({"_id": username}, {"$unset": {"history": ""}})
+    return moved
+
+
+def migrate_embedded_history(users_collection, plan_store):
+    """Moves every user's embedded history into the plans collection. Returns (users, plans) moved."""
+    users = plans = 0
+    for user_data in users_collection.find({"history.0": {"$exists": True}}, {"_id": 1}):
+        plans += migrate_user_history(users_collection, plan_store, user_data["_id"])
+        users += 1
+    # Drop the empty arrays left on users who never generated a plan
+    users_collection.update_many({"history": {"$size": 0}}, {"$unset": {"history": ""}})
+    return users, plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan history maintenance.")
+    parser.add_argument("command", choices=["migrate", "stats", "train-dictionary", "index-search"])
+    parser.add_argument("--codec", choices=["zlib", "zstd"], help="dictionary codec (default: PLAN_COMPRESSION)")
+    parser.add_argument("--samples", type=int, default=500, help="recent plans to train the dictionary on")
+    args = parser.parse_args()
+
+    secrets = load_secrets()
+    db = MongoClient(secrets["MONGO_URI"])[secrets["DB_NAME"]]
+    users_collection = db[secrets["COLLECTION_NAME"]]
+    plan_store = make_plan_store(secrets, db)
+
+    if args.command == "migrate":
+        users, plans = migrate_embedded_history(users_collection, plan_store)
+        print(f"Migrated {plans} plans for {users} users.")
+
+    elif args.command == "index-search":
+        print(f"Indexed {plan_store.backfill_search_lines()} older plans for search.")
+
+    elif args.command == "train-dictionary":
+        codec = args.codec or plan_store.codec.codec or "zlib"
+        samples = plan_store.sample_bodies(args.samples)
+        if not samples:
+            parser.error("no stored plans to train on")
+        data = train_dictionary(samples, codec)
+        dict_id = plan_store.codec.dictionary_store.save(codec, data, samples=len(samples))
+        print(f"Trained {codec} dictionary {dict_id} ({len(data)} bytes) on {len(samples)} plan bodies.")
+        print("New plans use it from the next app restart.")
+
+    elif args.command == "stats":
+        stats = plan_store.compression_stats()
+        print(f"{stats['plans']} plans, {stats['bodies']} bodies: "
+              f"{stats['raw_bytes']:,} bytes of text stored in {stats['stored_bytes']:,} bytes "
+              f"(ratio {stats['ratio']:.2f}x)")
+        for group in ("by_codec", "by_field"):
+            for name, entry in sorted(stats[group].items()):
+                ratio = entry["raw_bytes"] / entry["stored_bytes"] if entry["stored_bytes"] else 1.0
+                print(f"  {name}: {entry['bodies']} bodies, {entry['raw_bytes']:,} -> "
+                      f"{entry['stored_bytes']:,} bytes ({ratio:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Write-behind persistence for finished plans.
+
+Saving a plan only assigns its id and queues the document, so results are
+shown without waiting on MongoDB. One background thread drains the queue,
+gathering plans that finish around the same time into a single bulk write,
+and retries failed writes with exponential backoff. Plans that still cannot
+be written are appended to a local spill file, one JSON document per line,
+which is replayed when the writer starts and after MongoDB comes back.
+Plans are keyed by their id, so a replayed plan is never duplicated.
+
+Until a plan is written it stays readable from the writer, so a user's
+History shows it straight away.
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from bson import json_util # type: ignore
+
+from metrics import REGISTRY
+from plan_store import BODY_FIELDS
+
+logger = logging.getLogger("workout_planner.writer")
+
+# Marks the end of the queue when the writer is closed
+_STOP = object()
+
+
+class PlanWriter:
+    """Queues plans for `plan_store` and writes them in batches on a background thread."""
+
+    def __init__(self, plan_store, spill_path, batch_size=50, linger=0.05,
+                 max_retries=4, backoff=0.5):
+        """
+        Batches hold up to `batch_size` plans; after the first plan arrives the
+        writer waits `linger` seconds for others to join its batch.
+        """
+        self.plan_store = plan_store
+        self.spill_path = spill_path
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._queue = queue.Queue()
+        self._spill_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._has_spill = True  # check for a spill file left by an earlier run
+        self._pending = {}  # plan id -> document not yet written by this process
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.spilled = 0
+        self.replayed = 0
+
+        self._thread = threading.Thread(target=self._run, name="plan-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, username, workout_plan, diet_plan, goal=None, workout_data=None, diet_data=None):
+        """Queues a plan for writing and returns its id straight away."""
+        doc = self.plan_store.new_plan(username, workout_plan, diet_plan, goal=goal,
+                                       workout_data=workout_data, diet_data=diet_data)
+        with self._lock:
+            self.queued += 1
+            self._pending[doc["_id"]] = doc
+        self._queue.put(doc)
+        return doc["_id"]
+
+    def pending_plans(self, username, fields=("date", "goal", "summary")):
+        """Returns `username`'s plans that are queued or spilled but not yet written, newest first."""
+        with self._lock:
+            docs = [doc for doc in self._pending.values() if doc["user"] == username]
+        docs.sort(key=lambda doc: (doc["date"], doc["_id"]), reverse=True)
+        return [{"_id": doc["_id"], **{field: doc.get(field) for field in fields}} for doc in docs]
+
+    def get_pending(self, username, plan_id, fields=BODY_FIELDS):
+        """Returns a plan that has not been written yet, decoded like PlanStore.get_plan, or None."""
+        with self._lock:
+            doc = self._pending.get(plan_id)
+        if doc is None or doc["user"] != username:
+            return None
+        return self.plan_store.codec.decode_fields({"_id": plan_id, **{field: doc.get(field) for field in fields}})
+
+    def _forget(self, docs):
+        with self._lock:
+            for doc in docs:
+                self._pending.pop(doc["_id"], None)
+
+    def close(self, timeout=10.0):
+        """Writes (or spills) everything still queued and stops the writer."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        self._replay_spill()
+        while True:
+            batch, stop = self._next_batch()
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def _next_batch(self):
+        """Blocks for the first queued plan, then gathers more for up to `linger` seconds."""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            try:
+                doc = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if doc is _STOP:
+                return batch, True
+            batch.append(doc)
+        return batch, False
+
+    def _write(self, batch):
+        """Bulk-writes `batch`, retrying with backoff, and spills it if MongoDB stays unavailable."""
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.0))
+            try:
+                with REGISTRY.timer("plan_write_seconds", help="Time to bulk-write a batch of plans"):
+                    self.plan_store.write_plans(batch)
+            except Exception as e:
+                logger.warning(f"Plan write failed (attempt {attempt + 1}): {e}")
+                continue
+
+            REGISTRY.observe("plan_write_batch_size", len(batch), buckets=(1, 2, 5, 10, 20, 50, 100),
+                             help="Plans per bulk write")
+            self._forget(batch)
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+            if self._has_spill:
+                # MongoDB is reachable again: bring back anything spilled earlier
+                self._replay_spill()
+            return True
+
+        self._spill(batch)
+        return False
+
+    def _spill(self, batch):
+        with self._spill_lock:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for doc in batch:
+                    f.write(json_util.dumps(doc) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._has_spill = True
+        with self._lock:
+            self.spilled += len(batch)
+        logger.error(f"MongoDB unavailable; spilled {len(batch)} plans to {self.spill_path}")
+
+    def _replay_spill(self):
+        """Writes back plans spilled by this or an earlier run."""
+        replay_path = self.spill_path + ".replay"
+        while True:
+            with self._spill_lock:
+                self._has_spill = False
+                # A .replay file left behind means an earlier replay was interrupted; finish it first
+                if os.path.exists(self.spill_path) and not os.path.exists(replay_path):
+                    os.replace(self.spill_path, replay_path)
+                if not os.path.exists(replay_path):
+                    return
+                with open(replay_path, encoding="utf-8") as f:
+                    docs = [json_util.loads(line) for line in f if line.strip()]
+
+            try:
+                for start in range(0, len(docs), self.batch_size):
+                    self.plan_store.write_plans(docs[start:start + self.batch_size])
+            except Exception as e:
+                # Keep the file for the next attempt; plans already written are skipped then
+                logger.warning(f"Replaying spilled plans failed: {e}")
+                self._has_spill = True
+                return
+            os.remove(replay_path)
+            self._forget(docs)
+            with self._lock:
+                self.replayed += len(docs)
+            logger.info(f"Replayed {len(docs)} spilled plans from {self.spill_path}")
+
+    def stats(self):
+        """Returns the queue depth and write, retry, spill and replay counters."""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queued": self.queued,
+                "written": self.written,
+                "batches": self.batches,
+                "retries": self.retries,
+                "spilled": self.spilled,
+                "replayed": self.replayed,
+            }
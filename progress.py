@@ -0,0 +1,131 @@
+"""
+Progress tracking: weight, workouts completed and meals followed.
+
+Logs are stored as one document per user and month, each day's entry a
+field of that document,
+
+    {"_id": "alice:2026-10", "user": "alice", "month": "2026-10", "height": 170.0,
+     "days": {"17": {"weight": 64.5, "workout": true, "meals": 3}}}
+
+so years of daily entries are a few dozen small documents, fetched with a
+single indexed query. Analytics run as vectorized pandas/NumPy operations
+over the whole series.
+"""
+from datetime import datetime
+
+import numpy as np # type: ignore
+import pandas as pd # type: ignore
+from pymongo import ASCENDING # type: ignore
+
+# Meals in a day's plan: Breakfast, Lunch, Dinner and one Snack
+MEALS_PER_DAY = 4
+
+
+def bucket_id(username, day):
+    return f"{username}:{day:%Y-%m}"
+
+
+class ProgressStore:
+    """Reads and writes month-bucketed progress logs in a MongoDB collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.collection.create_index([("user", ASCENDING), ("month", ASCENDING)])
+
+    def log(self, username, day, weight=None, workout=None, meals=None, height=None):
+        """Records (or overwrites) the given values for one day. Values left as None are kept."""
+        values = {"weight": weight, "workout": workout, "meals": meals}
+        update = {f"days.{day.day}.{field}": value for field, value in values.items() if value is not None}
+        if height is not None:
+            update["height"] = height
+        if not update:
+            return
+        self.collection.update_one(
+            {"_id": bucket_id(username, day)},
+            {"$set": update, "$setOnInsert": {"user": username, "month": f"{day:%Y-%m}"}},
+            upsert=True,
+        )
+
+    def load(self, username, since=None):
+        """Returns the user's month buckets, oldest first, starting with the month of `since`."""
+        query = {"user": username}
+        if since is not None:
+            query["month"] = {"$gte": f"{since:%Y-%m}"}
+        return list(self.collection.find(query, {"_id": 0, "month": 1, "height": 1, "days": 1})
+                    .sort("month", ASCENDING))
+
+
+def to_frame(buckets, since=None):
+    """
+    Flattens month buckets into a daily DataFrame indexed by date, with
+    float columns weight, workout (0/1), meals and height. Days without a
+    log are absent; missing values are NaN.
+    """
+    dates, rows = [], []
+    for bucket in buckets:
+        year, month = map(int, bucket["month"].split("-"))
+        height = bucket.get("height")
+        for day, entry in bucket.get("days", {}).items():
+            dates.append(datetime(year, month, int(day)))
+            rows.append((entry.get("weight"), entry.get("workout"), entry.get("meals"), height))
+
+    frame = pd.DataFrame(rows, index=pd.DatetimeIndex(dates, name="date"),
+                         columns=["weight", "workout", "meals", "height"], dtype=float).sort_index()
+    if since is not None:
+        frame = frame[frame.index >= pd.Timestamp(since)]
+    return frame
+
+
+def weight_trend(frame, window_days=7):
+    """Returns daily weight and its trailing `window_days` rolling average."""
+    weight = frame["weight"].dropna()
+    return pd.DataFrame({
+        "weight": weight,
+        f"{window_days}-day average": weight.rolling(f"{window_days}D").mean(),
+    })
+
+
+def bmi_trend(frame, height_cm=None):
+    """
+    Returns BMI for every logged weight. Height comes from `height_cm` or,
+    if not given, from the height stored with the logs, carried forward.
+    """
+    height = pd.Series(height_cm, index=frame.index, dtype=float) if height_cm else frame["height"].ffill().bfill()
+    bmi = frame["weight"] / np.square(height / 100.0)
+    return bmi.dropna().rename("BMI")
+
+
+def adherence(frame, workout_days_per_week=3, meals_per_day=MEALS_PER_DAY):
+    """
+    Returns weekly adherence rates (0-1): workouts completed against the
+    planned days per week, and meals followed against the meals planned on
+    the days that were logged. A week without any workout (or meal) log is
+    NaN for that rate, not 0.
+    """
+    weekly = frame[["workout", "meals"]].resample("W-SUN").agg(["sum", "count"])
+    workouts_logged = weekly[("workout", "count")]
+    workouts = (weekly[("workout", "sum")] / max(1, workout_days_per_week)).clip(upper=1.0)
+    meals_logged = weekly[("meals", "count")] * meals_per_day
+    meals = (weekly[("meals", "sum")] / meals_logged.where(meals_logged > 0)).clip(upper=1.0)
+    return pd.DataFrame({"workouts": workouts.where(workouts_logged > 0), "meals": meals})
+
+
+def summary(frame, workout_days_per_week=3, height_cm=None):
+    """Returns headline numbers: latest weight and its change over 30 days, latest BMI, overall adherence."""
+    weight = frame["weight"].dropna()
+    result = {"entries": len(frame), "weight": None, "weight_change_30d": None, "bmi": None,
+              "workout_adherence": None, "meal_adherence": None}
+    if not weight.empty:
+        result["weight"] = float(weight.iloc[-1])
+        earlier = weight[weight.index <= weight.index[-1] - pd.Timedelta(days=30)]
+        if not earlier.empty:
+            result["weight_change_30d"] = float(weight.iloc[-1] - earlier.iloc[-1])
+        bmi = bmi_trend(frame, height_cm)
+        if not bmi.empty:
+            result["bmi"] = float(bmi.iloc[-1])
+    if not frame.empty:
+        # Averaged over the weeks that have logs; None if there are none
+        rates = adherence(frame, workout_days_per_week).mean(skipna=True)
+        result["workout_adherence"] = None if pd.isna(rates["workouts"]) else float(rates["workouts"])
+        result["meal_adherence"] = None if pd.isna(rates["meals"]) else float(rates["meals"])
+    return result
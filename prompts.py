@@ -0,0 +1,251 @@
+"""
+Prompt building for the workout and diet planner.
+
+Kept free of Streamlit so the same prompts (and the cache keys derived from
+their inputs) can be produced outside the app.
+"""
+
+# --- Profile Form Options ---
+GENDERS = ["Male", "Female", "Prefer not to say"]
+GOALS = ["Lose Weight", "Gain Muscle", "Improve Fitness & Stamina"]
+LOCATIONS = ["Home", "Gym"]
+DIETS = ["Anything", "Vegetarian", "Vegan"]
+# Days covered by the diet plan: a 1-day sample, or a full week generated one day per request
+DIET_PLAN_DAYS = {"1-day sample": 1, "Full week": 7}
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Main protein of each day of a multi-day meal plan, per diet; days are
+# generated in parallel, so every day is told the others' up front
+DAY_PROTEINS = {
+    "Anything": ["eggs", "chicken", "lentils (dal)", "fish", "paneer or cottage cheese", "chickpeas", "kidney beans"],
+    "Vegetarian": ["paneer or cottage cheese", "lentils (dal)", "chickpeas", "yogurt", "kidney beans", "tofu", "eggs"],
+    "Vegan": ["tofu", "lentils (dal)", "chickpeas", "soy chunks", "kidney beans", "peanuts", "black beans"],
+}
+DAY_STAPLES = ["rice", "whole-wheat flatbread", "millet", "pasta or noodles", "potatoes", "quinoa or bulgur",
+               "whole-grain bread"]
+
+# The form's free-text fields, as submitted when left unchanged
+PROFILE_DEFAULTS = {"available_equipment": "None", "cuisine_pref": "Indian", "allergies": "None", "special_info": ""}
+# Allowed (min, max) of the form's numeric fields; profiles from files are held to the same ranges
+PROFILE_RANGES = {"age": (16, 80), "weight": (40.0, 150.0), "height": (140.0, 220.0), "workout_days": (1, 7)}
+
+SYSTEM_PROMPT = "You are an expert fitness and nutrition coach for students. Your goal is to create practical, budget-friendly, and effective workout and diet plans. Be encouraging and clear in your instructions. Format your response using Markdown."
+
+# Profile fields that feed each prompt; a plan only depends on (and is cached by) these
+WORKOUT_FIELDS = (
+    "age", "gender", "height", "weight", "fitness_goal", "workout_days",
+    "workout_location", "available_equipment", "special_info",
+)
+DIET_FIELDS = (
+    "age", "gender", "fitness_goal", "diet_pref", "cuisine_pref",
+    "allergies", "special_info",
+)
+COMBINED_FIELDS = tuple(dict.fromkeys(WORKOUT_FIELDS + DIET_FIELDS))
+
+# Lines separating the plans in a combined response, in the order they are requested
+SECTION_MARKERS = {
+    "workout": "===WORKOUT PLAN===",
+    "diet": "===DIET PLAN===",
+}
+
+
+def _special_notes(profile):
+    """Returns the optional free-text notes section shared by both prompts."""
+    special_info = profile.get("special_info")
+    if special_info and special_info.strip():
+        return f"\nImportant Additional Notes from the user: {special_info}"
+    return ""
+
+
+def build_workout_prompt(profile):
+    """Builds the workout plan prompt from a profile dict."""
+    p = profile
+    return f"""
+    Create a personalized workout plan for a {p['age']}-year-old {p['gender']} student who is {p['height']} cm tall and weighs {p['weight']} kg.
+    Primary Goal: {p['fitness_goal']}.
+    Workout Schedule: {p['workout_days']} days a week.
+    Workout Location: {p['workout_location']}.
+    Available Equipment: {p['available_equipment']}.
+    {_special_notes(p)}
+    Please provide a weekly schedule. For each workout day, list the exercises with sets and reps. Include a warm-up and cool-down routine. Make the plan encouraging and easy to follow for a student.
+    """
+
+
+def build_diet_prompt(profile):
+    """Builds the diet plan prompt from a profile dict."""
+    p = profile
+    return f"""
+    Create a personalized, budget-friendly, 1-day sample meal plan for a {p['age']}-year-old {p['gender']} student with the goal of '{p['fitness_goal']}'.
+    Dietary Preference: {p['diet_pref']}.
+    Preferred Cuisine: {p['cuisine_pref']}.
+    Allergies: {p['allergies']}.
+    {_special_notes(p)}
+    The plan should be simple, using easily available ingredients suitable for a student's budget. Provide options for Breakfast, Lunch, Dinner, and one Snack. Make it sound delicious and motivating!
+    """
+
+
+def diet_day_themes(profile, days):
+    """Returns the (protein, staple) each day of a `days`-day meal plan is built around, all distinct."""
+    proteins = DAY_PROTEINS.get(profile.get("diet_pref"), DAY_PROTEINS["Anything"])
+    return [(proteins[i % len(proteins)], DAY_STAPLES[i % len(DAY_STAPLES)]) for i in range(days)]
+
+
+def build_diet_day_prompt(profile, day, days):
+    """
+    Builds the prompt for day `day` (1-based) of a `days`-day meal plan.
+    Each day is generated separately, so the prompt carries the plan for
+    the whole week (what every other day is built around) to keep days from
+    repeating meals.
+    """
+    p = profile
+    themes = diet_day_themes(p, days)
+    protein, staple = themes[day - 1]
+    others = "; ".join(
+        f"{WEEKDAYS[i % 7]}: {other_protein} with {other_staple}"
+        for i, (other_protein, other_staple) in enumerate(themes) if i != day - 1
+    )
+    return f"""
+    Create day {day} ({WEEKDAYS[(day - 1) % 7]}) of a personalized, budget-friendly {days}-day meal plan for a {p['age']}-year-old {p['gender']} student with the goal of '{p['fitness_goal']}'.
+    Dietary Preference: {p['diet_pref']}.
+    Preferred Cuisine: {p['cuisine_pref']}.
+    Allergies: {p['allergies']}.
+    {_special_notes(p)}
+    Build today's main meals around {protein}, served with {staple}. The rest of the week is planned around other ingredients ({others}), so do not make those today's main ingredients and do not repeat dishes from other days.
+    The plan should be simple, using easily available ingredients suitable for a student's budget. Provide options for Breakfast, Lunch, Dinner, and one Snack, with approximate calories for each item. Cover only this one day and do not add a title.
+    """
+
+
+def build_combined_prompt(profile):
+    """Builds a single prompt asking for both plans, separated by SECTION_MARKERS."""
+    p = profile
+    return f"""
+    Create two plans for a {p['age']}-year-old {p['gender']} student who is {p['height']} cm tall and weighs {p['weight']} kg.
+    Primary Goal: {p['fitness_goal']}.
+    Workout Schedule: {p['workout_days']} days a week.
+    Workout Location: {p['workout_location']}.
+    Available Equipment: {p['available_equipment']}.
+    Dietary Preference: {p['diet_pref']}.
+    Preferred Cuisine: {p['cuisine_pref']}.
+    Allergies: {p['allergies']}.
+    {_special_notes(p)}
+    First, a personalized workout plan: provide a weekly schedule. For each workout day, list the exercises with sets and reps. Include a warm-up and cool-down routine. Make the plan encouraging and easy to follow for a student.
+    Second, a budget-friendly, 1-day sample meal plan, simple and using easily available ingredients suitable for a student's budget. Provide options for Breakfast, Lunch, Dinner, and one Snack. Make it sound delicious and motivating!
+    Start the workout plan with a line containing only {SECTION_MARKERS['workout']} and the meal plan with a line containing only {SECTION_MARKERS['diet']}. Write nothing before the first of these lines.
+    """
+
+
+class SectionSplitter:
+    """
+    Splits a streamed combined response into its sections as the text arrives.
+
+    `feed` and `close` return (section name, text) pieces; a marker split
+    across chunks is held back until it is complete. Text before the first
+    marker is dropped.
+    """
+
+    def __init__(self, markers=SECTION_MARKERS):
+        self.markers = {marker: name for name, marker in markers.items()}
+        self.current = None
+        self.seen = {name: False for name in markers}
+        self._buffer = ""
+
+    def _emit(self, text):
+        if self.current is None or not text:
+            return []
+        if text.strip():
+            self.seen[self.current] = True
+        return [(self.current, text)]
+
+    def feed(self, text):
+        self._buffer += text
+        pieces = []
+        while True:
+            found = [(self._buffer.find(m), m) for m in self.markers if m in self._buffer]
+            if not found:
+                break
+            index, marker = min(found)
+            pieces += self._emit(self._buffer[:index])
+            self.current = self.markers[marker]
+            self._buffer = self._buffer[index + len(marker):].lstrip("\n")
+
+        # Hold back a tail that may be the start of a marker
+        hold = max(
+            (k for m in self.markers for k in range(1, len(m)) if self._buffer.endswith(m[:k])),
+            default=0,
+        )
+        pieces += self._emit(self._buffer[:len(self._buffer) - hold])
+        self._buffer = self._buffer[len(self._buffer) - hold:]
+        return pieces
+
+    def close(self):
+        pieces = self._emit(self._buffer)
+        self._buffer = ""
+        return pieces
+
+    @property
+    def complete(self):
+        """True once every section has had some text."""
+        return all(self.seen.values())
+
+
+def splits_completely(text):
+    """Returns True if a whole combined response has text in every section."""
+    splitter = SectionSplitter()
+    list(splitter.feed(text))
+    list(splitter.close())
+    return splitter.complete
+
+
+def prompt_inputs(profile, fields):
+    """Returns the subset of `profile` that feeds a prompt, for cache keying."""
+    return {field: profile.get(field) for field in fields}
+
+
+def _choice(record, field, options, default):
+    value = str(record.get(field) or "").strip()
+    if not value:
+        return default
+    for option in options:
+        if option.lower() == value.lower():
+            return option
+    raise ValueError(f"{field} must be one of {', '.join(options)}, not {value!r}")
+
+
+def _value(record, field, default):
+    """Returns `record[field]`, or `default` when it is missing or an empty cell."""
+    value = record.get(field)
+    return default if value is None or str(value).strip() == "" else value
+
+
+def normalize_profile(record):
+    """
+    Builds a profile, typed as the form submits it, from a loosely typed
+    record such as a CSV row. Age, weight and height are required; other
+    fields default to the form's defaults. Raises ValueError on bad values.
+    """
+    try:
+        profile = {
+            "age": int(float(record["age"])),
+            "weight": float(record["weight"]),
+            "height": float(record["height"]),
+            "workout_days": int(float(_value(record, "workout_days", 3))),
+            "diet_days": int(float(_value(record, "diet_days", 1))),
+        }
+    except KeyError as e:
+        raise ValueError(f"missing {e.args[0]}") from None
+    except (TypeError, ValueError):
+        raise ValueError("age, weight, height, workout_days and diet_days must be numbers") from None
+    for field, (low, high) in PROFILE_RANGES.items():
+        if not low <= profile[field] <= high:
+            raise ValueError(f"{field} must be between {low:g} and {high:g}")
+    if profile["diet_days"] not in DIET_PLAN_DAYS.values():
+        raise ValueError(f"diet_days must be one of {', '.join(map(str, DIET_PLAN_DAYS.values()))}")
+
+    profile["gender"] = _choice(record, "gender", GENDERS, "Prefer not to say")
+    profile["fitness_goal"] = _choice(record, "fitness_goal", GOALS, GOALS[0])
+    profile["workout_location"] = _choice(record, "workout_location", LOCATIONS, LOCATIONS[0])
+    profile["diet_pref"] = _choice(record, "diet_pref", DIETS, DIETS[0])
+    for field, default in PROFILE_DEFAULTS.items():
+        value = str(record.get(field) or "").strip()
+        profile[field] = value or default
+    return profile
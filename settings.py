@@ -0,0 +1,43 @@
+"""
+Settings for command-line tools.
+
+The Streamlit app reads `st.secrets`; scripts run outside Streamlit read the
+same `.streamlit/secrets.toml` file, with environment variables taking
+precedence so deployments can override individual keys.
+"""
+import os
+import tomllib
+
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+# Keys the command-line tools read; each can be set in the environment alone
+ENV_KEYS = (
+    "MONGO_URI", "DB_NAME", "COLLECTION_NAME", "PLANS_COLLECTION_NAME", "CACHE_COLLECTION_NAME",
+    "DICTIONARIES_COLLECTION_NAME", "LLM_BACKEND", "HF_TOKEN", "FALLBACK_MODELS", "GENERATION_MODE",
+    "MAX_CONCURRENT_INFERENCE", "INFERENCE_TOTAL_TIMEOUT", "FIRST_TOKEN_TIMEOUT", "INFERENCE_MAX_RETRIES",
+    "HEDGE_AFTER", "CACHE_LRU_SIZE", "CACHE_TTL_SECONDS", "CACHE_AGE_BAND", "CACHE_WEIGHT_BAND",
+    "CACHE_HEIGHT_BAND", "PLAN_COMPRESSION", "PLAN_COMPRESSION_LEVEL", "BATCH_API_TOKEN",
+    "LOCAL_TTFT", "LOCAL_TOKENS_PER_SECOND", "LOCAL_JITTER", "LOCAL_FAILURE_RATE",
+)
+
+
+def env_value(text):
+    """Parses an environment variable: a TOML array such as '["a", "b"]' becomes a list, anything else stays text."""
+    if text.strip().startswith("["):
+        try:
+            return tomllib.loads(f"value = {text}")["value"]
+        except tomllib.TOMLDecodeError:
+            pass
+    return text
+
+
+def load_secrets(path=SECRETS_PATH):
+    """Returns the secrets file as a dict, overlaid with matching environment variables."""
+    secrets = {}
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            secrets = tomllib.load(f)
+
+    for key in set(secrets) | set(ENV_KEYS):
+        if key in os.environ:
+            secrets[key] = env_value(os.environ[key])
+    return secrets
@@ -0,0 +1,161 @@
+"""Tests for the inference gateway's limiter, retry and hedge paths."""
+import threading
+import time
+
+import pytest
+
+from inference import FairLimiter, GenerationError, InferenceGateway, RateLimiter
+
+MESSAGES = [{"role": "user", "content": "plan"}]
+
+
+@pytest.fixture
+def hang():
+    """An event upstreams block on; set at teardown so their threads can exit."""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_limiter_admits_waiters_in_arrival_order():
+    limiter = FairLimiter(1)
+    assert limiter.acquire()
+    order = []
+
+    def waiter(name):
+        limiter.acquire()
+        order.append(name)
+
+    threads = []
+    for name in ("first", "second"):
+        thread = threading.Thread(target=waiter, args=(name,))
+        thread.start()
+        threads.append(thread)
+        assert wait_for(lambda: limiter.queue_depth == len(threads))
+
+    limiter.release()
+    assert wait_for(lambda: order == ["first"])
+    limiter.release()
+    for thread in threads:
+        thread.join(1)
+    assert order == ["first", "second"]
+    assert not limiter.acquire(timeout=0.01)
+
+
+def test_silent_upstream_frees_its_slots(hang):
+    def silent(model, messages, **params):
+        hang.wait()
+        yield "late"
+
+    gateway = InferenceGateway(silent, ["m"], max_concurrent=2, total_timeout=5,
+                               first_token_timeout=0.1, max_retries=1, backoff=0.01)
+    with pytest.raises(GenerationError, match="did not respond"):
+        list(gateway.stream(MESSAGES))
+    assert gateway.stats()["in_flight"] == 0
+    assert gateway.stats()["retries"] == 1
+
+
+def test_total_timeout_after_first_token_frees_the_slot(hang):
+    def stalls(model, messages, **params):
+        yield "start"
+        hang.wait()
+        yield "late"
+
+    gateway = InferenceGateway(stalls, ["m"], max_concurrent=1, total_timeout=0.2,
+                               first_token_timeout=0.1, max_retries=0)
+    with pytest.raises(GenerationError, match="did not finish"):
+        list(gateway.stream(MESSAGES))
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_retry_fails_over_to_the_next_model():
+    calls = []
+
+    def flaky(model, messages, **params):
+        calls.append(model)
+        if model == "primary":
+            raise ConnectionError("reset")
+        yield "ok"
+
+    gateway = InferenceGateway(flaky, ["primary", "fallback"], max_concurrent=1,
+                               first_token_timeout=1, max_retries=2, backoff=0.01)
+    assert "".join(gateway.stream(MESSAGES)) == "ok"
+    assert calls == ["primary", "fallback"]
+    assert gateway.stats()["retries"] == 1
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_permanent_error_is_not_retried():
+    def rejects(model, messages, **params):
+        raise ValueError("bad request")
+        yield
+
+    gateway = InferenceGateway(rejects, ["m"], max_concurrent=1, max_retries=2, backoff=0.01)
+    with pytest.raises(GenerationError, match="bad request"):
+        list(gateway.stream(MESSAGES))
+    assert gateway.stats()["retries"] == 0
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_hedge_wins_over_a_silent_primary(hang):
+    def answers(model, messages, **params):
+        if model == "slow":
+            hang.wait()
+        yield "from "
+        yield model
+
+    gateway = InferenceGateway(answers, ["slow", "fast"], max_concurrent=2, first_token_timeout=1,
+                               max_retries=0, hedge_after=0.05)
+    assert "".join(gateway.stream(MESSAGES)) == "from fast"
+    stats = gateway.stats()
+    assert (stats["hedges"], stats["hedge_wins"], stats["in_flight"]) == (1, 1, 0)
+
+
+def test_hedge_needs_a_spare_slot():
+    def answers(model, messages, **params):
+        time.sleep(0.2)
+        yield model
+
+    gateway = InferenceGateway(answers, ["slow", "fast"], max_concurrent=1, first_token_timeout=1,
+                               max_retries=0, hedge_after=0.05)
+    assert "".join(gateway.stream(MESSAGES)) == "slow"
+    assert gateway.stats()["hedges"] == 0
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_rate_limit_wait_is_not_model_latency():
+    calls = []
+
+    def answers(model, messages, **params):
+        calls.append(model)
+        yield model
+
+    limiter = RateLimiter(600)  # one request every 0.1s
+    limiter.acquire()
+    gateway = InferenceGateway(answers, ["m"], max_concurrent=1, first_token_timeout=0.05,
+                               max_retries=0, admit=limiter.acquire)
+    # Waiting 0.1s to be admitted does not run down the 0.05s first-token timeout
+    assert "".join(gateway.stream(MESSAGES)) == "m"
+    assert calls == ["m"]
+    assert gateway.stats()["in_flight"] == 0
+
+
+def test_hedge_is_not_sent_over_the_rate_limit():
+    def answers(model, messages, **params):
+        time.sleep(0.2)
+        yield model
+
+    gateway = InferenceGateway(answers, ["slow", "fast"], max_concurrent=2, first_token_timeout=1,
+                               max_retries=0, hedge_after=0.05, admit=RateLimiter(60).acquire)
+    assert "".join(gateway.stream(MESSAGES)) == "slow"
+    stats = gateway.stats()
+    assert (stats["upstream_calls"], stats["hedges"]) == (1, 0)
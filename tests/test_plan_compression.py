@@ -0,0 +1,18 @@
+"""Tests for reading plan bodies compressed with a shared dictionary."""
+import mongomock
+
+from plan_compression import DictionaryStore, make_plan_codec, train_dictionary
+
+PLAN = "\n".join(f"- Exercise {n}: 3 sets of 10 reps" for n in range(40))
+
+
+def test_body_written_with_a_newer_dictionary_is_readable():
+    store = DictionaryStore(mongomock.MongoClient().db.dictionaries)
+    settings = {"PLAN_COMPRESSION": "zlib"}
+    reader = make_plan_codec(settings, store)
+
+    # Another process trains a dictionary and writes with it after the reader started
+    store.save("zlib", train_dictionary([PLAN, PLAN]))
+    body = make_plan_codec(settings, store).encode(PLAN)
+    assert body["dict"]
+    assert reader.decode(body) == PLAN
@@ -0,0 +1,33 @@
+"""Tests for what the plan generator caches."""
+from plan_generation import PlanGenerator, make_gateway, make_plan_generator
+from prompts import SECTION_MARKERS
+
+
+class FakeGateway:
+    def __init__(self, text):
+        self.text = text
+
+    def stream(self, messages, **params):
+        yield self.text
+
+
+class FakeCache(dict):
+    def put(self, key, text):
+        self[key] = text
+
+
+def test_combined_response_is_cached_only_if_it_splits():
+    cache = FakeCache()
+    list(PlanGenerator(FakeGateway("Here is your plan, no sections."), cache=cache).stream_combined("p", "bad"))
+    complete = f"{SECTION_MARKERS['workout']}\nSquats\n{SECTION_MARKERS['diet']}\nOats"
+    list(PlanGenerator(FakeGateway(complete), cache=cache).stream_combined("p", "good"))
+    assert cache == {"good": complete}
+
+
+def test_builders_read_the_shared_settings():
+    settings = {"LLM_BACKEND": "local", "FALLBACK_MODELS": ["backup"], "GENERATION_MODE": "combined",
+                "CACHE_AGE_BAND": 5, "FIRST_TOKEN_TIMEOUT": 7}
+    gateway = make_gateway(settings, None, "primary", rate=60)
+    assert (gateway.models, gateway.first_token_timeout) == (["primary", "backup"], 7.0)
+    generator = make_plan_generator(settings, gateway)
+    assert (generator.model, generator.bands, generator.mode) == ("local:primary", {"age": 5.0}, "combined")
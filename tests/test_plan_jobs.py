@@ -0,0 +1,41 @@
+"""Tests for retrying plan jobs."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mongomock
+
+from plan_jobs import DONE, FAILED, JobManager
+
+
+def wait_done(manager, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    job = manager.get(job_id)
+    while not job.done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_resubmit_reruns_only_failed_parts_and_keeps_fresh():
+    calls = []
+    failing = {"diet"}
+
+    def stream_part(prompt, cache_key, fresh):
+        calls.append((prompt, fresh))
+        if prompt in failing:
+            raise RuntimeError("upstream down")
+        yield prompt + " plan"
+
+    manager = JobManager(mongomock.MongoClient().db.jobs, stream_part, ThreadPoolExecutor(2),
+                         on_complete=lambda job, texts: "plan-id")
+    parts = {"workout": ("workout", "k1"), "diet": ("diet", "k2")}
+    job = wait_done(manager, manager.submit("ana", parts))
+    assert job.status == FAILED
+
+    failing.clear()
+    calls.clear()
+    retry = wait_done(manager, manager.resubmit(job.id))
+    assert retry.status == DONE
+    assert calls == [("diet", False)]
+    assert {name: result.text for name, result in retry.results.items()} == {
+        "workout": "workout plan", "diet": "diet plan",
+    }
@@ -0,0 +1,36 @@
+"""Tests that plans rendered from their structured form keep what the model wrote."""
+from plan_schema import parse_plan, render_plan
+
+WORKOUT = """## Your Plan
+
+### Day 1: Upper Body
+- Dumbbell rows: 3 sets of 12 reps (use 5 kg dumbbells)
+  + Tip: keep your back straight
+- Push-ups: 3 sets of 10 reps
+Rest 60-90 seconds between sets.
+
+### Day 2: Lower Body
+- Lunges: 3x10 per leg
+"""
+
+DIET = """## Meal Plan
+
+### Breakfast (approx. 400 calories)
+- Oats with milk (300 kcal)
+- 1 banana (100 kcal)
+"""
+
+
+def test_workout_render_keeps_details_tips_and_section_prose():
+    plan = parse_plan("workout", WORKOUT)
+    assert [e["name"] for e in plan["sections"][0]["exercises"]] == ["Dumbbell rows", "Push-ups"]
+    rendered = render_plan("workout", WORKOUT, plan)
+    assert "| Dumbbell rows | 3 | 12 | use 5 kg dumbbells; Tip: keep your back straight |" in rendered
+    assert "| Lunges | 3 | 10 | per leg |" in rendered
+    assert rendered.index("Rest 60-90 seconds") < rendered.index("### Day 2")
+
+
+def test_diet_render_keeps_the_heading_total():
+    rendered = render_plan("diet", DIET, parse_plan("diet", DIET))
+    assert "### Breakfast (approx. 400 calories)\n" in rendered
+    assert "kcal)_" not in rendered
@@ -0,0 +1,75 @@
+"""Tests for the write-behind plan writer's spill and replay path."""
+import os
+import time
+
+import mongomock
+from bson import json_util
+
+from plan_store import PlanStore
+from plan_writer import PlanWriter
+
+
+class FlakyPlanStore(PlanStore):
+    """A PlanStore whose writes fail while `down` is set."""
+
+    down = False
+
+    def write_plans(self, docs):
+        if self.down:
+            raise ConnectionError("MongoDB unavailable")
+        return super().write_plans(docs)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def make_writer(store, tmp_path):
+    return PlanWriter(store, spill_path=str(tmp_path / "spill.jsonl"), linger=0.01, max_retries=1, backoff=0.01)
+
+
+def test_outage_spills_then_replays_without_duplicates(tmp_path):
+    store = FlakyPlanStore(mongomock.MongoClient().db.plans)
+    store.down = True
+    writer = make_writer(store, tmp_path)
+
+    first = writer.submit("ana", "## Workout\n- Squats: 3x10", "## Diet\n- Oats", goal="Lose Weight")
+    assert wait_for(lambda: writer.stats()["spilled"] == 1)
+    assert os.path.exists(writer.spill_path)
+    # Still readable during the outage
+    assert [doc["_id"] for doc in writer.pending_plans("ana")] == [first]
+    assert writer.pending_plans("ben") == []
+    assert writer.get_pending("ana", first)["workout_plan"] == "## Workout\n- Squats: 3x10"
+    assert writer.get_pending("ben", first) is None
+
+    store.down = False
+    second = writer.submit("ana", "## Workout\n- Lunges: 3x10", "## Diet\n- Rice")
+    assert wait_for(lambda: writer.stats()["replayed"] == 1)
+    writer.close()
+
+    assert sorted(doc["_id"] for doc in store.collection.find({}, {"_id": 1})) == sorted([first, second])
+    assert writer.pending_plans("ana") == []
+    assert not os.path.exists(writer.spill_path)
+
+
+def test_spill_left_by_an_earlier_run_is_replayed_once(tmp_path):
+    store = FlakyPlanStore(mongomock.MongoClient().db.plans)
+    store.down = True
+    writer = make_writer(store, tmp_path)
+    plan_id = writer.submit("ana", "## Workout\n- Squats: 3x10", "## Diet\n- Oats")
+    assert wait_for(lambda: writer.stats()["spilled"] == 1)
+    writer.close()
+
+    # The plan reached MongoDB before the spill was replayed, e.g. a write that timed out but landed
+    store.down = False
+    with open(writer.spill_path, encoding="utf-8") as f:
+        store.write_plans([json_util.loads(line) for line in f])
+    restarted = make_writer(store, tmp_path)
+    assert wait_for(lambda: restarted.stats()["replayed"] == 1)
+    restarted.close()
+    assert [doc["_id"] for doc in store.collection.find({}, {"_id": 1})] == [plan_id]
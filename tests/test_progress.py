@@ -0,0 +1,24 @@
+"""Tests for progress adherence over weeks with and without logs."""
+from datetime import date
+
+from progress import summary, to_frame
+
+
+def bucket(month, days):
+    return {"month": month, "height": 170.0, "days": days}
+
+
+def test_weeks_without_logs_do_not_count_as_zero_adherence():
+    frame = to_frame([
+        bucket("2026-09", {"1": {"meals": 2}}),
+        bucket("2026-10", {"13": {"weight": 64.0}, "14": {"workout": True}}),
+    ])
+    stats = summary(frame, workout_days_per_week=2)
+    assert stats["meal_adherence"] == 0.5
+    assert stats["workout_adherence"] == 0.5
+
+
+def test_no_workout_or_meal_logs_give_no_adherence():
+    stats = summary(to_frame([bucket("2026-10", {"13": {"weight": 64.0}})], since=date(2026, 10, 1)))
+    assert stats["weight"] == 64.0
+    assert (stats["workout_adherence"], stats["meal_adherence"]) == (None, None)
@@ -0,0 +1,19 @@
+"""Tests for normalizing profiles read from cohort files."""
+import pytest
+
+from prompts import normalize_profile
+
+
+def test_profile_from_a_csv_row_gets_form_types_and_defaults():
+    profile = normalize_profile({"age": "20", "weight": "60.5", "height": "170", "diet_pref": ""})
+    assert (profile["age"], profile["weight"], profile["workout_days"]) == (20, 60.5, 3)
+    assert profile["diet_pref"] and profile["cuisine_pref"] == "Indian"
+
+
+@pytest.mark.parametrize("field, value", [
+    ("age", -5), ("age", 81), ("weight", 0), ("weight", "nan"), ("height", 9999), ("workout_days", 0),
+])
+def test_values_outside_the_form_ranges_are_rejected(field, value):
+    record = {"age": 20, "weight": 60, "height": 170, field: value}
+    with pytest.raises(ValueError, match=field):
+        normalize_profile(record)
@@ -0,0 +1,26 @@
+"""Tests for how command-line tools read their settings."""
+import pytest
+
+from settings import ENV_KEYS, load_secrets
+
+
+@pytest.fixture(autouse=True)
+def clean_environment(monkeypatch):
+    for key in ENV_KEYS:
+        monkeypatch.delenv(key, raising=False)
+
+
+def test_environment_overrides_and_adds_keys(tmp_path, monkeypatch):
+    path = tmp_path / "secrets.toml"
+    path.write_text('DB_NAME = "planner"\nLLM_BACKEND = "huggingface"\n')
+    monkeypatch.setenv("LLM_BACKEND", "local")
+    monkeypatch.setenv("BATCH_API_TOKEN", "s3cret")
+    monkeypatch.setenv("FALLBACK_MODELS", '["m1", "m2"]')
+    secrets = load_secrets(str(path))
+    assert secrets == {"DB_NAME": "planner", "LLM_BACKEND": "local", "BATCH_API_TOKEN": "s3cret",
+                       "FALLBACK_MODELS": ["m1", "m2"]}
+
+
+def test_environment_alone_is_enough(tmp_path, monkeypatch):
+    monkeypatch.setenv("MONGO_URI", "mongodb://db:27017")
+    assert load_secrets(str(tmp_path / "missing.toml"))["MONGO_URI"] == "mongodb://db:27017"
@@ -0,0 +1,236 @@
+"""
+Pre-generates plans for common profiles into the plan cache.
+
+Enumerates the profiles the form produces for a set of ages, weights and
+heights (and, by default, every gender, goal, location, diet and a few
+weekly schedules), most common first, builds the same prompts as the app
+and generates the plans on a bounded worker pool under a requests-per-minute
+limit. Each plan is stored under the key the app looks it up by, so matching
+submissions are served from the cache. With CACHE_AGE_BAND,
+CACHE_WEIGHT_BAND and CACHE_HEIGHT_BAND set, one plan per band covers every
+profile in it.
+
+Plans are cached as they finish and plans already in the cache are skipped,
+so an interrupted run picks up where it stopped when started again:
+
+    python warm_cache.py --ages 18,20,22,25 --weights 50:90:10 --limit 500
+"""
+import argparse
+import itertools
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pymongo import MongoClient # type: ignore
+
+from llm_backends import DEFAULT_MODEL, make_backend
+from plan_cache import cache_bands, combined_cache_key, make_plan_cache, plan_cache_keys
+from plan_generation import cache_model, make_gateway, make_plan_generator
+from prompts import (
+    DIETS, GENDERS, GOALS, LOCATIONS, PROFILE_DEFAULTS,
+    build_combined_prompt, build_diet_prompt, build_workout_prompt, splits_completely,
+)
+from settings import load_secrets
+
+# Workout days per week, most common first (the form's default is 3)
+DEFAULT_WORKOUT_DAYS = "3,4,5,2"
+# Cache lookups per query when checking which plans already exist
+LOOKUP_BATCH = 500
+
+
+def parse_values(text, cast=float):
+    """Parses "18,20,25" or a "start:stop:step" range (stop included) into a list of values."""
+    if ":" in text:
+        start, stop, step = (cast(part) for part in text.split(":"))
+        values, value = [], start
+        while value <= stop:
+            values.append(value)
+            value += step
+        return values
+    return [cast(part) for part in text.split(",") if part.strip()]
+
+
+def parse_choices(text, options):
+    """Parses a comma-separated subset of `options`; empty means all of them."""
+    if not text:
+        return list(options)
+    chosen = [part.strip() for part in text.split(",")]
+    unknown = [choice for choice in chosen if choice not in options]
+    if unknown:
+        raise ValueError(f"unknown value(s) {', '.join(unknown)}; choose from {', '.join(options)}")
+    return chosen
+
+
+def enumerate_profiles(domains):
+    """
+    Yields a profile for every combination of `domains` (field -> values,
+    most common first), ordered so combinations of more common values come
+    first.
+    """
+    fields = list(domains)
+    ranked = sorted(
+        itertools.product(*(range(len(domains[field])) for field in fields)),
+        key=sum,
+    )
+    for indexes in ranked:
+        # Free-text fields keep the form's defaults, as most submissions do
+        profile = dict(PROFILE_DEFAULTS)
+        profile.update({field: domains[field][i] for field, i in zip(fields, indexes)})
+        yield profile
+
+
+def plan_requests(profiles, model, bands=None, mode="separate"):
+    """
+    Returns {cache key: (kind, prompt)} for the plans the profiles need, in
+    profile order. Profiles that share a plan (same inputs or same bands)
+    yield it once.
+    """
+    requests = {}
+    for profile in profiles:
+        if mode == "combined":
+            requests.setdefault(combined_cache_key(profile, model, bands),
+                                ("combined", build_combined_prompt(profile)))
+            continue
+        workout_key, diet_key = plan_cache_keys(profile, model, bands)
+        if workout_key not in requests:
+            requests[workout_key] = ("workout", build_workout_prompt(profile))
+        if diet_key not in requests:
+            requests[diet_key] = ("diet", build_diet_prompt(profile))
+    return requests
+
+
+def cached_keys(collection, keys):
+    """Returns the subset of `keys` already stored in the cache collection."""
+    found = set()
+    keys = list(keys)
+    for start in range(0, len(keys), LOOKUP_BATCH):
+        batch = keys[start:start + LOOKUP_BATCH]
+        found.update(doc["_id"] for doc in collection.find({"_id": {"$in": batch}}, {"_id": 1}))
+    return found
+
+
+def generate(generator, kind, prompt):
+    """Returns the finished completion for one prompt; raises if it is empty or unusable."""
+    max_tokens = 2 * generator.max_tokens if kind == "combined" else generator.max_tokens
+    text = "".join(generator.stream_uncached(prompt, max_tokens))
+    if not text.strip():
+        raise ValueError("empty response")
+    # Only cache responses the app can split into both plans
+    if kind == "combined" and not splits_completely(text):
+        raise ValueError("response is missing a plan section")
+    return text
+
+
+def warm(cache, generator, requests, workers=4, report_every=10, log=print):
+    """
+    Generates the plans in `requests` ({key: (kind, prompt)}) with at most
+    `workers` in flight and stores each one in `cache` as it finishes.
+    The generator's gateway applies any requests-per-minute limit.
+    Returns (generated, failed).
+    """
+    pending = iter(requests.items())
+    generated = failed = 0
+    start = time.monotonic()
+
+    def report():
+        elapsed = time.monotonic() - start
+        done = generated + failed
+        rate = generated / elapsed * 60 if elapsed else 0.0
+        log(f"{done}/{len(requests)} done ({failed} failed), {rate:.1f} plans/min")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="warm") as executor:
+        running = {}
+
+        def fill():
+            # Keep only `workers` requests queued, so an interrupted run leaves little unstarted work behind
+            while len(running) < workers:
+                item = next(pending, None)
+                if item is None:
+                    return
+                key, (kind, prompt) = item
+                running[executor.submit(generate, generator, kind, prompt)] = key
+
+        try:
+            fill()
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key = running.pop(future)
+                    try:
+                        cache.put(key, future.result())
+                        generated += 1
+                    except Exception as e:
+                        failed += 1
+                        log(f"Plan {key[:12]} failed: {e}")
+                    if (generated + failed) % report_every == 0:
+                        report()
+                fill()
+        except KeyboardInterrupt:
+            for future in running:
+                future.cancel()
+            log("Interrupted; plans cached so far are kept. Run again to resume.")
+            raise
+    report()
+    return generated, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate common plans into the plan cache.")
+    parser.add_argument("--ages", default="18,20,22,25", help="ages, e.g. 18,20,25 or 18:30:2")
+    parser.add_argument("--weights", default="50,60,70,80", help="weights in kg")
+    parser.add_argument("--heights", default="160,170,180", help="heights in cm")
+    parser.add_argument("--workout-days", default=DEFAULT_WORKOUT_DAYS, help="workout days per week")
+    parser.add_argument("--genders", help=f"subset of {', '.join(GENDERS)} (default: all)")
+    parser.add_argument("--goals", help=f"subset of {', '.join(GOALS)} (default: all)")
+    parser.add_argument("--locations", help=f"subset of {', '.join(LOCATIONS)} (default: all)")
+    parser.add_argument("--diets", help=f"subset of {', '.join(DIETS)} (default: all)")
+    parser.add_argument("--mode", choices=["separate", "combined"],
+                        help="plans to warm, as the app's GENERATION_MODE (default: that setting)")
+    parser.add_argument("--limit", type=int, help="generate at most this many plans, most common first")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent model requests")
+    parser.add_argument("--rate", type=float, help="at most this many model requests per minute")
+    parser.add_argument("--force", action="store_true", help="regenerate plans that are already cached")
+    parser.add_argument("--dry-run", action="store_true", help="only count the plans that would be generated")
+    args = parser.parse_args()
+
+    secrets = load_secrets()
+    try:
+        domains = {
+            "age": parse_values(args.ages, int),
+            "weight": parse_values(args.weights),
+            "height": parse_values(args.heights),
+            "workout_days": parse_values(args.workout_days, int),
+            "gender": parse_choices(args.genders, GENDERS),
+            "fitness_goal": parse_choices(args.goals, GOALS),
+            "workout_location": parse_choices(args.locations, LOCATIONS),
+            "diet_pref": parse_choices(args.diets, DIETS),
+        }
+    except ValueError as e:
+        parser.error(str(e))
+
+    mode = args.mode or secrets.get("GENERATION_MODE", "separate")
+    model = cache_model(secrets, DEFAULT_MODEL)
+    requests = plan_requests(enumerate_profiles(domains), model, cache_bands(secrets), mode)
+
+    db = MongoClient(secrets["MONGO_URI"])[secrets["DB_NAME"]]
+    cache = make_plan_cache(secrets, db, maxsize=1)  # this process never reads its plans back
+    total = len(requests)
+    if not args.force:
+        done = cached_keys(cache.collection, requests)
+        requests = {key: request for key, request in requests.items() if key not in done}
+    if args.limit is not None:
+        requests = dict(itertools.islice(requests.items(), args.limit))
+    print(f"{total} distinct plans for these profiles, {len(requests)} to generate ({mode} mode).")
+    if args.dry_run or not requests:
+        return
+
+    gateway = make_gateway(secrets, make_backend(secrets).stream_chat, DEFAULT_MODEL, args.workers, args.rate)
+    generator = make_plan_generator(secrets, gateway)
+    try:
+        generated, failed = warm(cache, generator, requests, workers=args.workers)
+    except KeyboardInterrupt:
+        raise SystemExit(130)
+    print(f"Cached {generated} plans; {failed} failed (run again to retry them).")
+
+
+if __name__ == "__main__":
+    main()